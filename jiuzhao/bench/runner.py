@@ -0,0 +1,154 @@
+import json
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from jiuzhao.bench.server import MockLLMServer
+from jiuzhao.core.agent import Agent
+from jiuzhao.core.llm import LLMClient
+from jiuzhao.tools.lean import LeanTool
+from jiuzhao.tools.registry import ToolRegistry
+from jiuzhao.utils.ui import console
+
+PROBLEMS_FILE = Path(__file__).with_name("problems.jsonl")
+STAGES = ("llm", "parse", "tool", "render")
+UNPROVEN_RE = re.compile(r"\b(sorry|admit)\b")
+
+
+def load_problems(path: Optional[str] = None) -> List[Dict[str, Any]]:
+    with open(path or PROBLEMS_FILE, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def stub_checker(latency: float = 0.0) -> Callable[[str, float, Optional[bool]], Tuple[int, str]]:
+    """A stand-in for compile_lean_file: a file passes unless it contains `sorry` or `admit`."""
+    def check(path: str, timeout: float, incremental: Optional[bool] = None) -> Tuple[int, str]:
+        if latency:
+            time.sleep(latency)
+        with open(path, "r", encoding="utf-8") as f:
+            source = f.read()
+        match = UNPROVEN_RE.search(source)
+        if match:
+            line = source.count("\n", 0, match.start()) + 1
+            return 1, f"{path}:{line}:0: error: declaration uses '{match.group(1)}'"
+        return 0, ""
+    return check
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Linear-interpolated percentile, q in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(samples),
+        "total": sum(samples),
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95)
+    }
+
+
+def run_benchmark(
+    problems: List[Dict[str, Any]],
+    latency: float = 0.05,
+    tokens_per_second: float = 0,
+    stub_lean: bool = True,
+    lean_latency: float = 0.0,
+    stream: bool = True,
+    repeat: int = 1
+) -> Dict[str, Any]:
+    """
+    Run every problem through a full Agent against the local stand-in server
+    and return a report with throughput, pass rate, token estimates and
+    p50/p95 timings per stage. Agent output is rendered to /dev/null so
+    rendering cost is measured without flooding the terminal.
+    """
+    stage_samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    problem_times: List[float] = []
+    passed = turns = prompt_tokens = completion_tokens = 0
+    runs = 0
+
+    with MockLLMServer(problems, latency=latency, tokens_per_second=tokens_per_second) as server, \
+            tempfile.TemporaryDirectory(prefix="jiuzhao-bench-") as workdir, \
+            open(os.devnull, "w") as devnull:
+        llm = LLMClient(model_config={"name": "bench", "provider": "openai", "base_url": server.base_url, "api_key": "bench"})
+        # Every run must hit the server, never the response cache.
+        llm.cache = None
+
+        stdout = console.file
+        console.file = devnull
+        start = time.perf_counter()
+        try:
+            for round_no in range(repeat):
+                for problem in problems:
+                    root = os.path.join(workdir, f"{round_no}-{problem['id']}")
+                    os.makedirs(root)
+                    tools = ToolRegistry(root)
+                    if stub_lean:
+                        tools.register(LeanTool(root, checker=stub_checker(lean_latency)))
+                    agent = Agent(llm, root=root, tools=tools)
+                    agent.gen_config["stream"] = stream
+
+                    problem_start = time.perf_counter()
+                    result = agent.run(problem["statement"])
+                    problem_times.append(time.perf_counter() - problem_start)
+
+                    runs += 1
+                    passed += result["status"] == "proved"
+                    turns += result["turns"]
+                    prompt_tokens += result["prompt_tokens"]
+                    completion_tokens += result["completion_tokens"]
+                    for stage, samples in agent.stage_times.items():
+                        stage_samples.setdefault(stage, []).extend(samples)
+        finally:
+            console.file = stdout
+        wall_time = time.perf_counter() - start
+
+    return {
+        "problems": runs,
+        "passed": passed,
+        "pass_rate": passed / runs if runs else 0.0,
+        "wall_time": wall_time,
+        "throughput": runs / wall_time if wall_time else 0.0,
+        "turns": turns,
+        "tokens": {"prompt": prompt_tokens, "completion": completion_tokens},
+        "stages": {stage: summarize(samples) for stage, samples in stage_samples.items()},
+        "problem": summarize(problem_times),
+        "settings": {
+            "latency": latency,
+            "tokens_per_second": tokens_per_second,
+            "stub_lean": stub_lean,
+            "lean_latency": lean_latency,
+            "stream": stream,
+            "repeat": repeat
+        }
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> List[Tuple[str, float, float, float]]:
+    """
+    (metric, baseline, current, relative change) rows for the timing and
+    throughput figures shared by both reports. For timings a positive change
+    means slower; for throughput and pass rate it means better.
+    """
+    rows = []
+    for metric in ("throughput", "pass_rate"):
+        if metric in baseline:
+            rows.append((metric, baseline[metric], report[metric]))
+    current_rows = [("problem", report["problem"])] if "problem" in report else []
+    for name, current in current_rows + sorted(report["stages"].items()):
+        old = baseline.get("problem") if name == "problem" else baseline.get("stages", {}).get(name)
+        if not old:
+            continue
+        for q in ("p50", "p95"):
+            rows.append((f"{name}.{q}", old[q], current[q]))
+    return [(metric, old, new, (new - old) / old if old else 0.0) for metric, old, new in rows]
@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+
+# Stand-in "tokens" for pacing streamed output.
+CHARS_PER_TOKEN = 4
+FALLBACK_REPLY = "QED"
+
+
+class MockLLMServer:
+    """
+    Local OpenAI-compatible `/v1/chat/completions` endpoint replaying canned
+    responses for the benchmark problems.
+
+    A request is matched to a problem by finding its statement in the first user
+    message; the number of assistant messages so far selects the scripted turn.
+    `latency` is the delay before the first byte and `tokens_per_second` paces
+    the body (0 means unthrottled). `stop` sequences are honoured like a real
+    endpoint, so the agent's streaming early stop is exercised.
+    """
+
+    def __init__(
+        self,
+        problems: List[Dict[str, Any]],
+        latency: float = 0.05,
+        tokens_per_second: float = 0,
+        host: str = "127.0.0.1",
+        port: int = 0
+    ):
+        self.scripts = {p["statement"]: p.get("script", []) for p in problems}
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reply_for(self, messages: List[Dict[str, str]]) -> str:
+        with self._lock:
+            self.requests += 1
+        first_user = next((m["content"] for m in messages if m["role"] == "user"), "")
+        turn = sum(1 for m in messages if m["role"] == "assistant")
+        for statement, script in self.scripts.items():
+            if statement in first_user:
+                return script[turn] if turn < len(script) else FALLBACK_REPLY
+        return FALLBACK_REPLY
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; Nagle would add ~40ms per response.
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                text = server.reply_for(body.get("messages", []))
+                finish_reason = "stop"
+                for stop in body.get("stop") or []:
+                    if stop in text:
+                        text = text[:text.index(stop)]
+                time.sleep(server.latency)
+                if body.get("stream"):
+                    self._stream(body, text, finish_reason)
+                else:
+                    self._complete(body, text, finish_reason)
+
+            def _usage(self, body: Dict[str, Any], text: str) -> Dict[str, int]:
+                prompt = sum(len(m.get("content", "")) for m in body.get("messages", [])) // CHARS_PER_TOKEN
+                completion = len(text) // CHARS_PER_TOKEN
+                return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+            def _complete(self, body: Dict[str, Any], text: str, finish_reason: str):
+                if server.tokens_per_second:
+                    time.sleep(len(text) / CHARS_PER_TOKEN / server.tokens_per_second)
+                payload = json.dumps({
+                    "id": "bench",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "bench"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": finish_reason
+                    }],
+                    "usage": self._usage(body, text)
+                }).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, body: Dict[str, Any], text: str, finish_reason: str):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                delay = 1 / server.tokens_per_second if server.tokens_per_second else 0
+                for i in range(0, len(text), CHARS_PER_TOKEN):
+                    self._event(body, {"content": text[i:i + CHARS_PER_TOKEN]}, None)
+                    if delay:
+                        time.sleep(delay)
+                self._event(body, {}, finish_reason)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def _event(self, body: Dict[str, Any], delta: Dict[str, str], finish_reason: Optional[str]):
+                chunk = {
+                    "id": "bench",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model", "bench"),
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        return Handler
@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Any, List
+
+# Kept free of jiuzhao imports at module level: the first-turn probe runs this
+# module in a fresh interpreter and times every import it triggers.
+
+
+def _time_process(args: List[str], env: Dict[str, str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(args, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def run_startup_benchmark(runs: int = 5) -> Dict[str, Any]:
+    """
+    Time `jiuzhao --help` and one agent turn against the mock server, each in
+    a fresh interpreter, `runs` times. `first_turn` is the whole process;
+    `first_turn.import` and `first_turn.turn` split it as seen from inside.
+    """
+    from jiuzhao.bench.runner import load_problems, summarize
+    from jiuzhao.bench.server import MockLLMServer
+
+    env = dict(os.environ)
+    # One turn, never served from the response cache.
+    env.update({"JIUZHAO_GENERATION_MAX_TURNS": "1", "JIUZHAO_GENERATION_CACHE": "false"})
+    problem = load_problems()[0]
+    samples: Dict[str, List[float]] = {"help": [], "first_turn": [], "first_turn.import": [], "first_turn.turn": []}
+
+    with MockLLMServer([problem], latency=0) as server:
+        for _ in range(runs):
+            samples["help"].append(_time_process([sys.executable, "-m", "jiuzhao.main", "--help"], env))
+            start = time.perf_counter()
+            out = subprocess.run(
+                [sys.executable, "-m", "jiuzhao.bench.startup", server.base_url, problem["statement"]],
+                env=env, capture_output=True, text=True, check=True
+            ).stdout
+            samples["first_turn"].append(time.perf_counter() - start)
+            probe = json.loads(out.strip().splitlines()[-1])
+            samples["first_turn.import"].append(probe["import"])
+            samples["first_turn.turn"].append(probe["turn"])
+
+    return {
+        "stages": {name: summarize(values) for name, values in samples.items()},
+        "settings": {"runs": runs}
+    }
+
+
+def _first_turn(base_url: str, statement: str):
+    start = time.perf_counter()
+    from jiuzhao.bench.runner import stub_checker
+    from jiuzhao.core.agent import Agent
+    from jiuzhao.core.llm import LLMClient
+    from jiuzhao.tools.lean import LeanTool
+    from jiuzhao.tools.registry import ToolRegistry
+    imported = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(prefix="jiuzhao-startup-") as root:
+        llm = LLMClient(model_config={"name": "bench", "provider": "openai", "base_url": base_url, "api_key": "bench"})
+        tools = ToolRegistry(root)
+        tools.register(LeanTool(root, checker=stub_checker()))
+        Agent(llm, root=root, quiet=True, tools=tools).run(statement)
+    print(json.dumps({"import": imported - start, "turn": time.perf_counter() - imported}))
+
+
+if __name__ == "__main__":
+    _first_turn(sys.argv[1], sys.argv[2])
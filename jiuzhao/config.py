@@ -1,11 +1,15 @@
+import copy
 import json
 import os
+import shlex
+import threading
 from pathlib import Path
 from typing import List, Dict, Optional, Any
 
 CONFIG_DIR = Path.home() / ".jiuzhao"
 CONFIG_FILE = CONFIG_DIR / "config.json"
-MODELS_FILE = Path("models.json")
+# Bundled with the package rather than looked up in the working directory.
+MODELS_FILE = Path(__file__).with_name("models.json")
 
 DEFAULT_CONFIG = {
     "current_model": "rwkv-7-prover-1.5b",
@@ -13,13 +17,94 @@ DEFAULT_CONFIG = {
         "temperature": 0.2,
         "max_tokens": 4096,
         "max_turns": 15,
-        "timeout": 60
+        "timeout": 60,
+        "stream": True,
+        "context_budget": 24000,
+        "keep_recent_messages": 6,
+        "cache": False,
+        "cache_max_mb": 100,
+        "max_retries": 3,
+        "retry_base_delay": 0.5,
+        "retry_max_delay": 8.0,
+        "circuit_failures": 3,
+        "circuit_cooldown": 30.0,
+        "max_connections": 16,
+        "keepalive_expiry": 120,
+        "time_limit": 0,
+        "cascade": [],
+        "cascade_escalate_after": 2,
+        "cascade_min_samples": 10,
+        "max_tool_calls": 8,
+        "tool_workers": 4,
+        "best_of_n": 4,
+        "parallel_rounds": 3,
+        "sample_temperature": 0.8,
+        "llm_concurrency": 4,
+        "check_concurrency": 2
+    },
+    "lean": {
+        "use_repl": True,
+        "repl_command": ["lake", "exe", "repl"],
+        "pool_size": 2,
+        "request_timeout": 30,
+        "startup_timeout": 300,
+        "max_worker_rss_mb": 8192,
+        "max_requests_per_worker": 500,
+        "incremental": True,
+        "cache": True,
+        "cache_max_entries": 2000,
+        "speculative": True,
+        "speculative_workers": 1,
+        "max_jobs": 4,
+        "memory_reserve_mb": 1024,
+        "job_memory_mb": 16384,
+        "job_cpu_seconds": 3600,
+        "shared_admission": True,
+        "output_head_chars": 20000,
+        "output_tail_chars": 20000,
+        "build_jobs": 0,
+        "build_timeout": 300,
+        "diagnostics_max_chars": 4000,
+        "diagnostics_goal_chars": 1500
+    },
+    "search": {
+        "tactics_per_node": 8,
+        "max_expansions": 200,
+        "max_nodes": 5000,
+        "max_depth": 30,
+        "time_limit": 600,
+        "tactic_timeout": 10,
+        "max_repl_rss_mb": 8192,
+        "depth_weight": 1.0,
+        "goal_weight": 2.0,
+        "automation": True,
+        "automation_tactics": ["simp", "omega", "linarith", "norm_num", "decide", "aesop"],
+        "automation_budget": 15,
+        "automation_tactic_timeout": 10,
+        "automation_header": ""
     },
     "models": []
 }
 
+# Sections that are merged key-by-key with the defaults instead of replaced.
+MERGED_SECTIONS = ("generation", "lean", "search")
+
+# JIUZHAO_MODEL selects the model; JIUZHAO_<SECTION>_<KEY> overrides one setting,
+# e.g. JIUZHAO_GENERATION_MAX_TOKENS=8192 or JIUZHAO_LEAN_USE_REPL=false.
+ENV_PREFIX = "JIUZHAO_"
+ENV_MODEL = "JIUZHAO_MODEL"
+TRUE_STRINGS = {"1", "true", "yes", "on"}
+FALSE_STRINGS = {"0", "false", "no", "off"}
+# Durations in seconds with integer defaults; they also take fractional values.
+FRACTIONAL_SETTINGS = {
+    ("generation", "timeout"), ("generation", "time_limit"), ("generation", "keepalive_expiry"),
+    ("lean", "request_timeout"), ("lean", "startup_timeout"), ("lean", "build_timeout"),
+    ("search", "time_limit"), ("search", "tactic_timeout"), ("search", "automation_budget"),
+    ("search", "automation_tactic_timeout")
+}
+
 def load_default_models() -> List[Dict]:
-    """Load models from the local models.json file if it exists."""
+    """Load the bundled models.json."""
     if MODELS_FILE.exists():
         try:
             with open(MODELS_FILE, "r") as f:
@@ -28,44 +113,184 @@ def load_default_models() -> List[Dict]:
             return []
     return []
 
-def load_config() -> Dict:
-    """Load user configuration, merging with defaults."""
-    config = DEFAULT_CONFIG.copy()
-    
+def _coerce(value: Any, default: Any, fractional: bool = False) -> Any:
+    """
+    Convert `value` to the type of `default`; environment values arrive as
+    strings. With `fractional`, an int setting also takes a non-integral
+    number, kept as a float.
+    """
+    if isinstance(default, bool):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in TRUE_STRINGS | FALSE_STRINGS:
+            return value.strip().lower() in TRUE_STRINGS
+    elif isinstance(default, int):
+        if isinstance(value, str):
+            value = float(value.strip())
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, float) and fractional:
+            return value
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    elif isinstance(default, float):
+        if isinstance(value, str):
+            return float(value.strip())
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    elif isinstance(default, list):
+        if isinstance(value, str):
+            return json.loads(value) if value.lstrip().startswith("[") else shlex.split(value)
+        if isinstance(value, list):
+            return value
+    elif isinstance(default, str):
+        if isinstance(value, str):
+            return value
+    else:
+        return value
+    raise ValueError(f"expected {type(default).__name__}, got {value!r}")
+
+class Settings:
+    """
+    The validated configuration: defaults, overlaid with ~/.jiuzhao/config.json,
+    overlaid with JIUZHAO_* environment variables. Every known setting has
+    the type of its default; a value that cannot be converted keeps the
+    default and is reported in `problems`.
+    """
+
+    def __init__(self, user_config: Dict[str, Any], environ: Dict[str, str]):
+        self.problems: List[str] = []
+        self.current_model: str = DEFAULT_CONFIG["current_model"]
+        self.generation: Dict[str, Any] = dict(DEFAULT_CONFIG["generation"])
+        self.lean: Dict[str, Any] = copy.deepcopy(DEFAULT_CONFIG["lean"])
+        self.search: Dict[str, Any] = dict(DEFAULT_CONFIG["search"])
+        self.models: List[Dict[str, Any]] = []
+
+        for section in MERGED_SECTIONS:
+            values = user_config.get(section) or {}
+            if not isinstance(values, dict):
+                self.problems.append(f"config.json: '{section}' must be an object")
+                continue
+            for key, value in values.items():
+                self._set(section, key, value, f"config.json: {section}.{key}")
+        if isinstance(user_config.get("current_model"), str):
+            self.current_model = user_config["current_model"]
+        if isinstance(user_config.get("models"), list):
+            self.models = user_config["models"]
+
+        for name, value in sorted(environ.items()):
+            if name == ENV_MODEL:
+                self.current_model = value
+                continue
+            rest = name[len(ENV_PREFIX):].lower()
+            section = next((s for s in MERGED_SECTIONS if rest.startswith(s + "_")), None)
+            if section is None:
+                continue  # not a setting, e.g. a variable of another tool sharing the prefix
+            key = rest[len(section) + 1:]
+            if key not in DEFAULT_CONFIG[section]:
+                self.problems.append(f"{name}: unknown setting")
+                continue
+            self._set(section, key, value, name)
+
+        # Ensure models list is populated
+        if not self.models:
+            self.models = load_default_models()
+
+    def _set(self, section: str, key: str, value: Any, source: str):
+        values = getattr(self, section)
+        if key not in DEFAULT_CONFIG[section]:
+            # Unknown keys pass through untouched, e.g. settings of a newer version.
+            values[key] = value
+            return
+        try:
+            values[key] = _coerce(value, DEFAULT_CONFIG[section][key], (section, key) in FRACTIONAL_SETTINGS)
+        except ValueError as e:
+            self.problems.append(f"{source}: {e}; using {DEFAULT_CONFIG[section][key]!r}")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return copy.deepcopy({
+            "current_model": self.current_model,
+            "generation": self.generation,
+            "lean": self.lean,
+            "search": self.search,
+            "models": self.models
+        })
+
+    def model(self, name: str) -> Optional[Dict[str, Any]]:
+        for m in self.models:
+            if m.get("name") == name:
+                return m
+        return None
+
+_settings: Optional[Settings] = None
+_settings_key: Optional[tuple] = None
+_settings_lock = threading.Lock()
+
+def _read_user_config() -> Dict[str, Any]:
     if CONFIG_FILE.exists():
         try:
             with open(CONFIG_FILE, "r") as f:
                 user_config = json.load(f)
-                # Deep merge for generation settings
-                if "generation" in user_config:
-                    config["generation"].update(user_config["generation"])
-                if "current_model" in user_config:
-                    config["current_model"] = user_config["current_model"]
-                if "models" in user_config:
-                    config["models"] = user_config["models"]
+            if isinstance(user_config, dict):
+                return user_config
         except Exception:
             pass # Fallback to default on error
-    
-    # Ensure models list is populated
-    if not config["models"]:
-        config["models"] = load_default_models()
-        
-    return config
+    return {}
+
+def _env_overrides() -> Dict[str, str]:
+    return {k: v for k, v in os.environ.items() if k.startswith(ENV_PREFIX)}
+
+def get_settings() -> Settings:
+    """
+    The process-wide Settings. config.json is parsed again only when its
+    mtime or size changes, or when a JIUZHAO_* variable changes.
+    """
+    global _settings, _settings_key
+    try:
+        st = CONFIG_FILE.stat()
+        file_key = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        file_key = None
+    environ = _env_overrides()
+    key = (file_key, tuple(sorted(environ.items())))
+    with _settings_lock:
+        if _settings is None or key != _settings_key:
+            _settings = Settings(_read_user_config(), environ)
+            _settings_key = key
+        return _settings
+
+def load_config(apply_env: bool = True) -> Dict:
+    """
+    Load user configuration, merged with defaults, as a private copy. Pass
+    apply_env=False when the result is going to be saved, so environment
+    overrides do not end up in config.json.
+    """
+    if apply_env:
+        return get_settings().as_dict()
+    return Settings(_read_user_config(), {}).as_dict()
 
 def save_config(config: Dict):
     """Save configuration to disk."""
+    global _settings
     CONFIG_DIR.mkdir(parents=True, exist_ok=True)
     with open(CONFIG_FILE, "w") as f:
         json.dump(config, f, indent=2)
+    with _settings_lock:
+        _settings = None
 
 def get_model_config(model_name: str) -> Optional[Dict]:
     """Retrieve specific model configuration by name."""
-    config = load_config()
-    for m in config.get("models", []):
-        if m["name"] == model_name:
-            return m
-    return None
+    model = get_settings().model(model_name)
+    return copy.deepcopy(model) if model is not None else None
 
 def get_generation_config() -> Dict[str, Any]:
     """Get generation parameters."""
-    return load_config().get("generation", DEFAULT_CONFIG["generation"])
+    return dict(get_settings().generation)
+
+def get_lean_config() -> Dict[str, Any]:
+    """Get Lean toolchain and REPL pool parameters."""
+    return dict(get_settings().lean)
+
+def get_search_config() -> Dict[str, Any]:
+    """Get proof-state tree search limits."""
+    return dict(get_settings().search)
@@ -1,16 +1,56 @@
-import re
+import contextlib
 import json
-from jiuzhao.core.llm import LLMClient
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+from jiuzhao.core.cascade import CascadeRouter
+from jiuzhao.core.llm import LLMClient, LLMError, TOOL_BLOCK_RE
+from jiuzhao.core.context import ContextManager, combine_tool_outputs, estimate_tokens, format_stats, message_meta, tool_call_meta, tool_output_meta
+from jiuzhao.tools.automation import extract_statement
 from jiuzhao.tools.registry import ToolRegistry
-from jiuzhao.config import get_generation_config
-from jiuzhao.utils.ui import console, print_agent_msg, print_tool_use, print_tool_output, print_success, print_error
+from jiuzhao.utils.trace import span
+from jiuzhao.utils.ui import console, print_agent_msg, print_tool_use, print_tool_output, print_success, print_error, StreamingAgentMsg
+
+# A file that compiles but still contains these is not a proof.
+UNPROVEN_RE = re.compile(r"\b(sorry|admit)\b")
 
 class Agent:
-    def __init__(self):
-        self.llm = LLMClient()
-        self.tools = ToolRegistry()
+    def __init__(
+        self,
+        llm: Optional[LLMClient] = None,
+        root: str = ".",
+        quiet: bool = False,
+        tools: Optional[ToolRegistry] = None
+    ):
+        self.llm = llm or LLMClient()
+        self.root = root
+        # Quiet agents print nothing, so several can run side by side in one process.
+        self.quiet = quiet
+        self.tools = tools or ToolRegistry(root)
         self.history = []
-        self.gen_config = get_generation_config()
+        # Per-message metadata for the context manager, aligned with self.history.
+        self.history_meta = []
+        # A private copy of the client's settings, so a session can adjust its own.
+        self.gen_config = dict(self.llm.gen_config)
+        # Cascade mode: each turn goes to the cheapest listed model that has not failed too often yet.
+        cascade = self.gen_config.get("cascade") or []
+        self.router = CascadeRouter(
+            self.llm,
+            cascade,
+            escalate_after=self.gen_config.get("cascade_escalate_after", 2),
+            min_samples=self.gen_config.get("cascade_min_samples", 10)
+        ) if cascade else None
+        self.context = ContextManager(
+            budget=self.gen_config.get("context_budget", 24000),
+            keep_recent=self.gen_config.get("keep_recent_messages", 6)
+        )
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Path and success of the most recent check_file, used to report the final proof.
+        self.last_check: Optional[Dict[str, Any]] = None
+        # Seconds spent per stage (llm, parse, tool, render), one entry per occurrence.
+        self.stage_times: Dict[str, List[float]] = {}
         self._init_system_prompt()
 
     def _init_system_prompt(self):
@@ -27,9 +67,9 @@ AVAILABLE TOOLS:
 INSTRUCTIONS:
 1. **Explore**: If you don't know the project structure, use `file_system` (list) or `project_search`.
 2. **Plan**: Break down the proof into lemmas if necessary.
-3. **Act**: Write code using `file_system` (write).
+3. **Act**: Write new files with `file_system` (write); change existing ones with `replace` or `patch`.
 4. **Verify**: ALWAYS verify your code using `lean_tool` (check_file).
-5. **Refine**: If compilation fails, read the error, adjust the code, and retry.
+5. **Refine**: If compilation fails, read the error, adjust the code, and retry. An `AUTOMATION:` line names tactics that close unsolved goals on their own.
 6. **Finish**: When `lean_tool` returns SUCCESS, inform the user.
 
 TOOL USAGE FORMAT:
@@ -38,73 +78,300 @@ To use a tool, output XML strictly like this:
 {{ "json_key": "json_value" }}
 </TOOL>
 
+You may make several tool calls in one response, e.g. a few searches and file reads.
+They run in the order written and you receive all their outputs together, so do not
+write tool outputs yourself.
+
 Do not use markdown code blocks (```xml) for tool calls.
 """
-        self.history.append({"role": "system", "content": system_prompt})
-
-    def _parse_tool_call(self, text: str):
-        # Improved regex to handle potential newlines inside the tag
-        pattern = r'<TOOL name="(.*?)">\s*({.*?})\s*</TOOL>'
-        match = re.search(pattern, text, re.DOTALL)
-        if match:
-            return match.group(1), match.group(2)
-        return None, None
-
-    def run(self, user_input: str):
-        self.history.append({"role": "user", "content": user_input})
+        self._append("system", system_prompt, message_meta("system"))
+
+    def _append(self, role: str, content: str, meta: dict):
+        self.history.append({"role": role, "content": content})
+        self.history_meta.append(meta)
+
+    def _context_messages(self):
+        messages, stats = self.context.build(self.history, self.history_meta)
+        self.prompt_tokens += stats["sent_tokens"]
+        if stats["saved_tokens"] > 0:
+            self._show(console.print, f"[dim]{format_stats(stats)}[/dim]")
+        return messages
+
+    @contextlib.contextmanager
+    def _timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_times.setdefault(stage, []).append(time.perf_counter() - start)
+
+    def _show(self, printer, *args):
+        if not self.quiet:
+            with self._timed("render"), span("ui.render", "ui", kind=printer.__name__):
+                printer(*args)
+
+    def _status(self, message: str):
+        return contextlib.nullcontext() if self.quiet else console.status(message)
+
+    def _book_turn(self, parse_errors: int, check: Optional[bool]):
+        """Report a turn's outcome to the cascade router and announce an escalation."""
+        latency = self.stage_times["llm"][-1]
+        reason = self.router.record_turn(latency, parse_errors, check)
+        if reason:
+            self._show(console.print, f"[dim]Escalating to {self.router.model} ({reason}).[/dim]")
+
+    def _escalate_on_error(self, error: LLMError) -> bool:
+        """After a failed request, whether a stronger model takes over the next turn."""
+        if self.router is None or not self.router.escalate(f"{self.router.model} request failed"):
+            return False
+        self._show(console.print, f"[dim]Escalating to {self.router.model} after a failed request: {error}[/dim]")
+        return True
+
+    def _escalate_on_stop(self, proof_task: bool) -> bool:
+        """
+        After a turn without tool calls, whether a stronger model carries on:
+        on a proof task, stopping without a verified proof counts as a failed
+        round. Other stops, such as a clarifying question, end the turn.
+        """
+        if self.router is None or not proof_task or self._proof() is not None:
+            return False
+        previous = self.router.model
+        if not self.router.escalate(f"{previous} stopped without a verified proof"):
+            return False
+        self._show(console.print, f"[dim]Escalating to {self.router.model}: {previous} stopped without a verified proof.[/dim]")
+        self._append(
+            "user",
+            "No proof has been verified yet. Continue the task and verify the finished file with lean_tool check_file.",
+            message_meta("user")
+        )
+        return True
+
+    def _automation_prepass(self, user_input: str) -> bool:
+        """
+        Before the first model call, try to close a request that states a Lean
+        theorem with decision procedures alone. True when one of them proved it.
+        """
+        lean_tool = self.tools.tools.get("lean_tool")
+        statement = extract_statement(user_input)
+        automation = lean_tool.automation() if statement and hasattr(lean_tool, "automation") else None
+        if automation is None:
+            return False
+        imports, signature = statement
+        with self._status("[bold cyan]Trying decision procedures..."), self._timed("tool"), span("agent.automation", "agent") as s:
+            found = automation.close(signature, imports, budget=lean_tool.time_left(automation.budget))
+            s.set(tactic=found["tactic"] if found else None)
+        if not found:
+            return False
+        path = os.path.relpath(found["path"], self.root)
+        self.last_check = {"path": path, "ok": True}
+        note = f"Closed by `{found['tactic']}` in {found['elapsed']:.1f}s without a model call; the proof is in {path}."
+        self._append("assistant", f"{note}\n\n{found['source']}", message_meta("assistant"))
+        self._show(print_success, note)
+        return True
+
+    def _proof(self) -> Optional[str]:
+        if not self.last_check or not self.last_check["ok"]:
+            return None
+        try:
+            with open(os.path.join(self.root, self.last_check["path"]), "r", encoding="utf-8") as f:
+                source = f.read()
+        except OSError:
+            return None
+        return None if UNPROVEN_RE.search(source) else source
+
+    def _parse_tool_calls(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Every tool call in `text`, in order: name, decoded args and the span
+        of the JSON. A call whose arguments do not decode has args None and
+        an error message instead.
+        """
+        calls = []
+        # Handles potential newlines inside the tag
+        for match in TOOL_BLOCK_RE.finditer(text):
+            call = {"name": match.group(1), "args": None, "span": match.span(2)}
+            # Clean up potential markdown formatting inside JSON if model hallucinates it
+            clean_json = match.group(2).strip()
+            if clean_json.startswith("```json"): clean_json = clean_json[7:]
+            if clean_json.endswith("```"): clean_json = clean_json[:-3]
+            try:
+                args = json.loads(clean_json)
+                if isinstance(args, dict):
+                    call["args"] = args
+                else:
+                    call["error"] = "Error: Tool arguments must be a JSON object."
+            except json.JSONDecodeError:
+                call["error"] = "Error: Invalid JSON in tool arguments."
+            calls.append(call)
+        return calls
+
+    def _run_tools(self, calls: List[Dict[str, Any]], assistant_meta: Dict[str, Any]):
+        """
+        Execute the tool calls of one response and answer them all in a single
+        message. Read-only calls between two writes run concurrently.
+        """
+        max_calls = self.gen_config.get("max_tool_calls", 8)
+        skipped = len(calls) - max_calls
+        calls = calls[:max_calls]
+        valid = [c for c in calls if c["args"] is not None]
+        assistant_meta["tool_calls"] = [tool_call_meta(c["name"], c["args"], c["span"]) for c in valid]
+        for call in valid:
+            self._show(print_tool_use, call["name"], str(call["args"]))
+
+        label = valid[0]["name"] if len(valid) == 1 else f"{len(valid)} tool calls"
+        with self._status(f"[bold cyan]Executing {label}...") as status, self._timed("tool"):
+            if status is not None:
+                self.tools.set_progress(lambda message: status.update(f"[bold cyan]Executing {label}: {message}"))
+            try:
+                results = iter(self.tools.execute_all(
+                    [(c["name"], c["args"]) for c in valid],
+                    max_workers=self.gen_config.get("tool_workers", 4)
+                ))
+            finally:
+                self.tools.set_progress(None)
+
+        sections = []
+        for call in calls:
+            if call["args"] is None:
+                self._show(print_error, call["error"])
+                sections.append((call["error"], message_meta("user")))
+                continue
+            tool_name, tool_args = call["name"], call["args"]
+            tool_result = next(results)
+            self._show(print_tool_output, tool_result)
+            sections.append((f"Tool '{tool_name}' output:\n{tool_result}", tool_output_meta(tool_name, tool_args)))
+
+            if tool_name == "lean_tool" and tool_args.get("command") == "check_file":
+                self.last_check = {"path": tool_args.get("path"), "ok": tool_result.startswith("SUCCESS")}
+
+            if "SUCCESS" in tool_result:
+                self._show(print_success, "Action verified successfully by tool!")
+        if skipped > 0:
+            note = f"Error: {skipped} further tool calls were not executed; at most {max_calls} run per response."
+            self._show(print_error, note)
+            sections.append((note, message_meta("user")))
+
+        content, meta = combine_tool_outputs(sections)
+        self._append("user", content, meta)
+
+    def run(self, user_input: str) -> Dict[str, Any]:
+        """
+        Work on `user_input` until the model stops calling tools or the turn
+        or time limit is hit. Returns a summary: status (proved, stopped,
+        max_turns, time_limit or llm_error), turns, estimated tokens, wall time
+        and the verified proof.
+        """
+        self._append("user", user_input, message_meta("user"))
+        start = time.monotonic()
+        # Tool subprocesses still running at the deadline are killed rather than waited for.
+        time_limit = self.gen_config.get("time_limit", 0)
+        deadline = start + time_limit if time_limit else None
+        self.tools.set_deadline(deadline)
+        if self.router:
+            self.router.start()
+        prompt_tokens, completion_tokens = self.prompt_tokens, self.completion_tokens
+        # A statement to prove, or a request that leads to a check_file, is a proof task.
+        check_before_run = self.last_check
+        stated = extract_statement(user_input) is not None
         
         max_turns = self.gen_config.get("max_turns", 15)
         turn = 0
-        
-        while turn < max_turns:
+        status = "max_turns"
+        error = None
+        automated = self._automation_prepass(user_input)
+
+        while turn < max_turns and not automated:
+            if deadline is not None and time.monotonic() >= deadline:
+                status = "time_limit"
+                self._show(print_error, f"Time limit of {time_limit}s reached.")
+                break
             turn += 1
-            
-            with console.status(f"[bold green]Jiuzhao is thinking ({turn}/{max_turns})..."):
-                response = self.llm.chat(self.history)
-            
-            self.history.append({"role": "assistant", "content": response})
-            print_agent_msg(response)
+            llm = self.router.client() if self.router else self.llm
+            progress = f"{turn}/{max_turns}, {llm.model_name}" if self.router else f"{turn}/{max_turns}"
+            with span("agent.turn", "agent", turn=turn):
+                if self.gen_config.get("stream", True) and not self.quiet:
+                    console.print(f"[dim]Jiuzhao is thinking ({progress})...[/dim]")
+                    messages = self._context_messages()
+                    render_time = 0.0
+
+                    def on_delta(text: str):
+                        nonlocal render_time
+                        before = time.perf_counter()
+                        live.update(text)
+                        render_time += time.perf_counter() - before
 
-            tool_name, tool_args_str = self._parse_tool_call(response)
+                    llm_start = time.perf_counter()
+                    try:
+                        with StreamingAgentMsg() as live:
+                            response = llm.chat_stream(messages, on_delta=on_delta)
+                    except LLMError as e:
+                        if self._escalate_on_error(e):
+                            continue
+                        status, error = "llm_error", str(e)
+                        print_error(f"LLM request failed: {e}")
+                        break
+                    finally:
+                        # Panel redraws happen inside the stream; book them as rendering.
+                        self.stage_times.setdefault("llm", []).append(time.perf_counter() - llm_start - render_time)
+                        self.stage_times.setdefault("render", []).append(render_time)
+                else:
+                    messages = self._context_messages()
+                    try:
+                        with self._status(f"[bold green]Jiuzhao is thinking ({progress})..."), self._timed("llm"):
+                            response = llm.chat(messages)
+                    except LLMError as e:
+                        if self._escalate_on_error(e):
+                            continue
+                        # Failures are reported, never added to the history as if the model said them.
+                        status, error = "llm_error", str(e)
+                        self._show(print_error, f"LLM request failed: {e}")
+                        break
+                    self._show(print_agent_msg, response)
+                self.completion_tokens += estimate_tokens(response)
             
-            if tool_name:
-                try:
-                    # Clean up potential markdown formatting inside JSON if model hallucinates it
-                    clean_json = tool_args_str.strip()
-                    if clean_json.startswith("```json"): clean_json = clean_json[7:]
-                    if clean_json.endswith("```"): clean_json = clean_json[:-3]
-                    
-                    tool_args = json.loads(clean_json)
-                    print_tool_use(tool_name, str(tool_args))
-                    
-                    with console.status(f"[bold cyan]Executing {tool_name}..."):
-                        tool_result = self.tools.execute(tool_name, tool_args)
-                    
-                    print_tool_output(tool_result)
-                    
-                    self.history.append({
-                        "role": "user", 
-                        "content": f"Tool '{tool_name}' output:\n{tool_result}"
-                    })
-
-                    if "SUCCESS" in tool_result:
-                        print_success("Action verified successfully by tool!")
-                    
-                except json.JSONDecodeError:
-                    error_msg = "Error: Invalid JSON in tool arguments."
-                    print_error(error_msg)
-                    self.history.append({"role": "user", "content": error_msg})
-                except Exception as e:
-                    error_msg = f"Error processing tool call: {str(e)}"
-                    print_error(error_msg)
-                    self.history.append({"role": "user", "content": error_msg})
-            else:
-                # No tool called. Check if the agent thinks it's done.
-                # Heuristic: If it says "QED" or "proven" or "done" and no tool was called.
-                if "QED" in response or ("proven" in response.lower() and "success" in response.lower()):
-                    print_success("Jiuzhao has finished the task.")
-                    break
+                assistant_meta = message_meta("assistant")
+                self._append("assistant", response, assistant_meta)
+
+                with self._timed("parse"), span("agent.parse", "agent"):
+                    calls = self._parse_tool_calls(response)
+
+                if calls:
+                    previous_check = self.last_check
+                    self._run_tools(calls, assistant_meta)
+                    if self.router:
+                        check = self.last_check["ok"] if self.last_check is not previous_check else None
+                        self._book_turn(sum(1 for c in calls if c["args"] is None), check)
+                else:
+                    if self.router:
+                        self._book_turn(0, None)
+                    # No tool called. Check if the agent thinks it's done.
+                    # Heuristic: If it says "QED" or "proven" or "done" and no tool was called.
+                    status = "stopped"
+                    if self._escalate_on_stop(stated or self.last_check is not check_before_run):
+                        continue
+                    if "QED" in response or ("proven" in response.lower() and "success" in response.lower()):
+                        self._show(print_success, "Jiuzhao has finished the task.")
+                        break
                 
-                # If it's just a conversational response, we might want to stop or ask user
-                # For now, we break to let the user reply in the main loop
-                break
+                    # If it's just a conversational response, we might want to stop or ask user
+                    # For now, we break to let the user reply in the main loop
+                    break
+
+        self.tools.set_deadline(None)
+        proof = self._proof()
+        result = {
+            "status": "proved" if proof is not None else status,
+            "turns": turn,
+            "prompt_tokens": self.prompt_tokens - prompt_tokens,
+            "completion_tokens": self.completion_tokens - completion_tokens,
+            "wall_time": round(time.monotonic() - start, 3),
+            "proof": proof
+        }
+        if error:
+            result["error"] = error
+        if automated:
+            result["automation"] = True
+        if self.router:
+            self.router.stats.flush()
+            result["model"] = self.router.model
+            result["escalations"] = list(self.router.escalations)
+        return result
@@ -0,0 +1,115 @@
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Any, Iterator, List, Optional, Set
+from jiuzhao.core.agent import Agent
+from jiuzhao.core.llm import LLMClient
+
+SAFE_ID_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def read_problems(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield {"id", "statement"} records from a JSONL file. A missing id falls back
+    to the line number; blank lines are skipped.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            statement = record.get("statement") or record.get("prompt")
+            if not statement:
+                raise ValueError(f"{path}:{lineno}: missing 'statement'")
+            yield {"id": str(record.get("id", lineno)), "statement": statement}
+
+
+def completed_ids(path: str) -> Set[str]:
+    """IDs that already have a result line. A torn last line from a crash is ignored."""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                continue
+    return done
+
+
+class BatchRunner:
+    """
+    Runs one quiet agent session per problem on a thread pool and appends one
+    JSON result line per problem in completion order. Lines are flushed and
+    fsynced as they arrive, so a rerun after a crash skips every ID already
+    written.
+
+    Each session gets its own working directory for the files it writes.
+    Model requests across all sessions go through one client, capped at
+    `llm_concurrency` in flight; Lean checks share the process-wide REPL pool.
+    """
+
+    def __init__(
+        self,
+        output_path: str,
+        workdir: str,
+        workers: int = 4,
+        llm_concurrency: Optional[int] = None,
+        llm: Optional[LLMClient] = None
+    ):
+        self.output_path = output_path
+        self.workdir = workdir
+        self.workers = max(1, workers)
+        self.llm = llm or LLMClient(max_concurrency=llm_concurrency or self.workers)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"done": 0, "proved": 0, "skipped": 0}
+
+    def run(
+        self,
+        problems: List[Dict[str, Any]],
+        on_result: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, int]:
+        done = completed_ids(self.output_path)
+        pending = [p for p in problems if p["id"] not in done]
+        self.stats["skipped"] = len(problems) - len(pending)
+        if os.path.dirname(self.output_path):
+            os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+
+        with open(self.output_path, "a+", encoding="utf-8") as out:
+            # Terminate a line torn by a crash so the next result starts on its own line.
+            if out.tell() > 0:
+                out.seek(out.tell() - 1)
+                if out.read(1) != "\n":
+                    out.write("\n")
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = [pool.submit(self._solve, p) for p in pending]
+                for future in as_completed(futures):
+                    result = future.result()
+                    self._write(out, result)
+                    if on_result:
+                        on_result(result)
+        return self.stats
+
+    def _solve(self, problem: Dict[str, Any]) -> Dict[str, Any]:
+        root = os.path.join(self.workdir, SAFE_ID_RE.sub("_", problem["id"]))
+        os.makedirs(root, exist_ok=True)
+        start = time.monotonic()
+        try:
+            result = Agent(self.llm, root=root, quiet=True).run(problem["statement"])
+        except Exception as e:
+            result = {"status": "error", "error": str(e), "turns": 0, "proof": None}
+        result["wall_time"] = round(time.monotonic() - start, 3)
+        return {"id": problem["id"], **result}
+
+    def _write(self, out, result: Dict[str, Any]):
+        with self._lock:
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+            self.stats["done"] += 1
+            if result["status"] == "proved":
+                self.stats["proved"] += 1
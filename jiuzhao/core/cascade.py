@@ -0,0 +1,170 @@
+import json
+import math
+import threading
+from typing import Dict, Any, List, Optional
+from jiuzhao.config import CONFIG_DIR
+from jiuzhao.core.llm import LLMClient
+
+STATS_FILE = CONFIG_DIR / "model_stats.json"
+COUNTERS = ("turns", "latency_s", "checks", "verified", "parse_errors")
+
+
+def load_model_stats() -> Dict[str, Dict[str, float]]:
+    if STATS_FILE.exists():
+        try:
+            with open(STATS_FILE, "r") as f:
+                stats = json.load(f)
+            if isinstance(stats, dict):
+                return stats
+        except (OSError, ValueError):
+            pass
+    return {}
+
+
+class ModelStats:
+    """
+    Per-model turn, latency and verification counters. Counts of this process
+    are kept in memory and folded into the persisted totals by flush(), so
+    escalation decisions learn across sessions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = load_model_stats()
+        self.pending: Dict[str, Dict[str, float]] = {}
+
+    def add(self, model: str, **counts: float):
+        with self._lock:
+            for bucket in (self.pending, self.totals):
+                entry = bucket.setdefault(model, {})
+                for name, value in counts.items():
+                    entry[name] = entry.get(name, 0) + value
+
+    def get(self, model: str) -> Dict[str, float]:
+        with self._lock:
+            entry = self.totals.get(model, {})
+            return {name: entry.get(name, 0) for name in COUNTERS}
+
+    def seconds_per_success(self, model: str, min_samples: int) -> Optional[float]:
+        """Model time spent per verified check; None until `min_samples` checks are known."""
+        entry = self.get(model)
+        if entry["checks"] < min_samples:
+            return None
+        if not entry["verified"]:
+            return math.inf
+        return entry["latency_s"] / entry["verified"]
+
+    def flush(self):
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        # Re-read so concurrent processes' counts are not lost.
+        totals = load_model_stats()
+        for model, counts in pending.items():
+            entry = totals.setdefault(model, {})
+            for name, value in counts.items():
+                entry[name] = entry.get(name, 0) + value
+        STATS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(STATS_FILE, "w") as f:
+            json.dump(totals, f, indent=2)
+
+
+_stats: Optional[ModelStats] = None
+_stats_lock = threading.Lock()
+
+
+def get_model_stats() -> ModelStats:
+    global _stats
+    with _stats_lock:
+        if _stats is None:
+            _stats = ModelStats()
+        return _stats
+
+
+class CascadeRouter:
+    """
+    Picks the model for each turn of an agent session. `models` is ordered
+    cheapest first. A session starts at the first model worth trying and
+    moves one step up after `escalate_after` failed verifications or parse
+    errors, or at once when a request fails. A model is passed over when,
+    over at least `min_samples` checks, it has spent more time per verified
+    check than the next model up, so a cheap model that rarely succeeds
+    stops costing more than the strong one.
+    """
+
+    def __init__(
+        self,
+        llm: LLMClient,
+        models: List[str],
+        escalate_after: int = 2,
+        min_samples: int = 10,
+        stats: Optional[ModelStats] = None
+    ):
+        self.llm = llm
+        self.models = models
+        for name in models:
+            llm.for_model(name)  # an unknown model fails here, not halfway through a session
+        self.escalate_after = max(1, escalate_after)
+        self.min_samples = min_samples
+        self.stats = stats or get_model_stats()
+        self.level = 0
+        self.strikes = 0
+        self.escalations: List[Dict[str, Any]] = []
+
+    @property
+    def model(self) -> str:
+        return self.models[self.level]
+
+    def client(self) -> LLMClient:
+        return self.llm.for_model(self.model)
+
+    def _worth_trying(self, level: int) -> bool:
+        if level == len(self.models) - 1:
+            return True
+        own = self.stats.seconds_per_success(self.models[level], self.min_samples)
+        stronger = self.stats.seconds_per_success(self.models[level + 1], self.min_samples)
+        return own is None or stronger is None or own <= stronger
+
+    def _settle(self, level: int) -> int:
+        while not self._worth_trying(level):
+            level += 1
+        return level
+
+    def start(self):
+        """Reset for a new request: back to the cheapest model worth trying."""
+        self.level = self._settle(0)
+        self.strikes = 0
+        self.escalations = []
+
+    def escalate(self, reason: str) -> bool:
+        """Move to the next stronger model; False when already at the strongest."""
+        if self.level == len(self.models) - 1:
+            return False
+        previous = self.model
+        self.level = self._settle(self.level + 1)
+        self.strikes = 0
+        self.escalations.append({"from": previous, "to": self.model, "reason": reason})
+        return True
+
+    def record_turn(self, latency: float, parse_errors: int = 0, check: Optional[bool] = None) -> Optional[str]:
+        """
+        Book one turn of the current model: its request latency, undecodable
+        tool calls and the result of a check_file, if one ran. Returns the
+        escalation reason when this turn used up the model's allowance.
+        """
+        counts = {"turns": 1, "latency_s": latency, "parse_errors": parse_errors}
+        if check is not None:
+            counts["checks"] = 1
+            counts["verified"] = int(check)
+        self.stats.add(self.model, **counts)
+
+        if check:
+            self.strikes = 0
+            return None
+        if parse_errors or check is False:
+            self.strikes += 1
+        if self.strikes < self.escalate_after:
+            return None
+        reason = f"{self.strikes} failed rounds on {self.model}"
+        return reason if self.escalate(reason) else None
@@ -0,0 +1,207 @@
+import json
+from typing import Dict, Any, List, Optional, Tuple
+
+# Tool outputs that carry a file's full content, keyed by (tool, action/command).
+FILE_CONTENT_OUTPUTS = {("file_system", "read")}
+COMPILER_OUTPUTS = {("lean_tool", "check_file"), ("lean_tool", "lake_build")}
+FILE_WRITE_CALLS = {("file_system", "write")}
+# Joins the outputs of several tool calls answered in one message.
+TOOL_OUTPUT_SEPARATOR = "\n\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate without a tokenizer: ~4 ASCII characters per token,
+    and one token per non-ASCII character (Lean's unicode notation, CJK text).
+    """
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return max(1, ascii_chars // 4 + (len(text) - ascii_chars))
+
+
+def _call_kind(name: str, args: Dict[str, Any]) -> Tuple[str, str]:
+    return name, str(args.get("action") or args.get("command") or "")
+
+
+class ContextManager:
+    """
+    Builds the message list actually sent to the model from the full history.
+
+    The history itself is never modified. Outside the `keep_recent` most recent
+    messages, file contents that a later read or write superseded collapse to a
+    reference, and compiler output older than the latest diagnostics collapses
+    to its status line. If the result is still over `budget`, the oldest tool
+    outputs are elided, then the oldest assistant messages are shortened. The
+    system prompt is always sent verbatim. A message answering several tool
+    calls is handled output by output and reassembled afterwards.
+    """
+
+    def __init__(self, budget: int = 24000, keep_recent: int = 6):
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.last_stats: Dict[str, int] = {}
+
+    def build(
+        self,
+        history: List[Dict[str, str]],
+        meta: List[Dict[str, Any]]
+    ) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        messages, meta, owners = self._split(history, meta)
+        original = [estimate_tokens(m["content"]) for m in messages]
+        recent = len(history) - self.keep_recent
+        protected = {i for i, owner in enumerate(owners) if owner >= recent}
+        protected.update(i for i, m in enumerate(messages) if m["role"] == "system")
+
+        elided = set()
+        self._collapse_superseded_files(messages, meta, protected, elided)
+        self._collapse_old_diagnostics(messages, meta, protected, elided)
+
+        tokens = [estimate_tokens(m["content"]) for m in messages]
+        total = sum(tokens)
+        for i in range(len(messages)):
+            if total <= self.budget:
+                break
+            info = meta[i] if i < len(meta) else {}
+            if i in protected or info.get("kind") != "tool_output" or i in elided:
+                continue
+            messages[i]["content"] = f"[Tool '{info.get('tool')}' output elided to save context ({tokens[i]} tokens)]"
+            total += estimate_tokens(messages[i]["content"]) - tokens[i]
+            tokens[i] = estimate_tokens(messages[i]["content"])
+
+        for i in range(len(messages)):
+            if total <= self.budget:
+                break
+            if i in protected or messages[i]["role"] != "assistant" or tokens[i] < 100:
+                continue
+            messages[i]["content"] = messages[i]["content"][:200] + "\n[... earlier reasoning elided ...]"
+            total += estimate_tokens(messages[i]["content"]) - tokens[i]
+            tokens[i] = estimate_tokens(messages[i]["content"])
+
+        messages = self._join(messages, owners)
+        stats = {
+            "messages": len(messages),
+            "original_tokens": sum(original),
+            "sent_tokens": total,
+            "saved_tokens": sum(original) - total,
+            "budget": self.budget
+        }
+        self.last_stats = stats
+        return messages, stats
+
+    @staticmethod
+    def _split(history, meta):
+        """
+        Copy the history with every combined tool-output message expanded into
+        one entry per output. `owners` maps each entry to its history index.
+        """
+        messages, parts_meta, owners = [], [], []
+        for i, message in enumerate(history):
+            info = meta[i] if i < len(meta) else {}
+            if info.get("kind") != "tool_outputs":
+                messages.append(dict(message))
+                parts_meta.append(info)
+                owners.append(i)
+                continue
+            for part in info["parts"]:
+                start, end = part["span"]
+                messages.append({"role": message["role"], "content": message["content"][start:end]})
+                parts_meta.append(part)
+                owners.append(i)
+        return messages, parts_meta, owners
+
+    @staticmethod
+    def _join(messages, owners):
+        joined = []
+        for i, message in enumerate(messages):
+            if i > 0 and owners[i] == owners[i - 1]:
+                joined[-1]["content"] += TOOL_OUTPUT_SEPARATOR + message["content"]
+            else:
+                joined.append(message)
+        return joined
+
+    def _collapse_superseded_files(self, messages, meta, protected, elided):
+        # Walk backwards so the first occurrence of each path seen is the latest version.
+        latest_seen = set()
+        for i in range(len(messages) - 1, -1, -1):
+            info = meta[i] if i < len(meta) else {}
+            if info.get("kind") == "tool_output":
+                path = info.get("path")
+                if (info.get("tool"), info.get("action")) not in FILE_CONTENT_OUTPUTS or not path:
+                    continue
+                if path in latest_seen and i not in protected:
+                    messages[i]["content"] = (
+                        f"Tool '{info.get('tool')}' output:\n"
+                        f"[Content of {path} elided: superseded by a later version]"
+                    )
+                    elided.add(i)
+                latest_seen.add(path)
+            elif info.get("kind") == "assistant":
+                calls = info.get("tool_calls") or []
+                # Later spans first so earlier offsets stay valid while rewriting.
+                for call in sorted(calls, key=lambda c: -c["span"][0]):
+                    path = call["args"].get("path")
+                    if _call_kind(call["name"], call["args"]) not in FILE_WRITE_CALLS or not path:
+                        continue
+                    if path in latest_seen and i not in protected:
+                        args = dict(call["args"])
+                        args["content"] = f"<elided: superseded version of {path}>"
+                        start, end = call["span"]
+                        content = messages[i]["content"]
+                        messages[i]["content"] = content[:start] + json.dumps(args, ensure_ascii=False) + content[end:]
+                    latest_seen.add(path)
+
+    def _collapse_old_diagnostics(self, messages, meta, protected, elided):
+        seen_latest = False
+        for i in range(len(messages) - 1, -1, -1):
+            info = meta[i] if i < len(meta) else {}
+            if info.get("kind") != "tool_output" or (info.get("tool"), info.get("action")) not in COMPILER_OUTPUTS:
+                continue
+            if seen_latest and i not in protected and i not in elided:
+                body = messages[i]["content"].split("\n")
+                status = body[1] if len(body) > 1 else ""
+                messages[i]["content"] = (
+                    f"{body[0]}\n{status}\n[Earlier diagnostics elided; see the latest compiler output]"
+                )
+                elided.add(i)
+            seen_latest = True
+
+
+def message_meta(kind: str, **fields: Any) -> Dict[str, Any]:
+    """Metadata recorded next to each history message for ContextManager."""
+    data: Dict[str, Any] = {"kind": kind}
+    data.update({k: v for k, v in fields.items() if v is not None})
+    return data
+
+
+def tool_output_meta(tool: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    _, action = _call_kind(tool, args)
+    return message_meta("tool_output", tool=tool, action=action, path=args.get("path"))
+
+
+def combine_tool_outputs(sections: List[Tuple[str, Dict[str, Any]]]) -> Tuple[str, Dict[str, Any]]:
+    """
+    One message answering several tool calls from (text, meta) sections, with
+    metadata recording where each section lies so ContextManager can treat
+    them separately. A single section is returned as an ordinary message.
+    """
+    if len(sections) == 1:
+        return sections[0]
+    parts = []
+    offset = 0
+    for text, meta in sections:
+        parts.append(dict(meta, span=(offset, offset + len(text))))
+        offset += len(text) + len(TOOL_OUTPUT_SEPARATOR)
+    content = TOOL_OUTPUT_SEPARATOR.join(text for text, _ in sections)
+    return content, message_meta("tool_outputs", parts=parts)
+
+
+def tool_call_meta(name: str, args: Dict[str, Any], span: Tuple[int, int]) -> Dict[str, Any]:
+    return {"name": name, "args": args, "span": span}
+
+
+def format_stats(stats: Optional[Dict[str, int]]) -> str:
+    if not stats:
+        return ""
+    return (
+        f"Context: {stats['sent_tokens']:,} / {stats['budget']:,} tokens "
+        f"(saved {stats['saved_tokens']:,} of {stats['original_tokens']:,})"
+    )
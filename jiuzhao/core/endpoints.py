@@ -0,0 +1,247 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar, Union
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    OpenAI,
+    RateLimitError
+)
+
+try:
+    import httpx
+except ImportError:  # bundled with openai; only used to tune the connection pool
+    httpx = None
+
+T = TypeVar("T")
+
+# Failures worth another attempt, possibly on another endpoint.
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
+
+# Weight of the newest sample in the per-endpoint latency average.
+LATENCY_ALPHA = 0.3
+# Latency assumed for every endpoint before any request has succeeded anywhere.
+DEFAULT_LATENCY = 1.0
+
+
+class LLMError(Exception):
+    """Raised when a completion cannot be obtained; never part of the conversation."""
+
+
+class Endpoint:
+    """
+    One OpenAI-compatible server. Its clients keep their connections alive
+    for the lifetime of the process. The circuit opens after
+    `failure_threshold` consecutive failures and lets a single probe through
+    once `cooldown` seconds have passed.
+    """
+
+    def __init__(self, base_url: Optional[str], api_key: str, options: Dict[str, Any]):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.options = options
+        self.outstanding = 0
+        self.latency = 0.0
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.requests = 0
+        self._client: Optional[OpenAI] = None
+        self._async_client: Optional[AsyncOpenAI] = None
+
+    def _pool_limits(self):
+        return httpx.Limits(
+            max_connections=self.options["max_connections"],
+            max_keepalive_connections=self.options["max_connections"],
+            keepalive_expiry=self.options["keepalive_expiry"]
+        )
+
+    @property
+    def client(self) -> OpenAI:
+        if self._client is None:
+            http_client = None
+            if httpx is not None:
+                http_client = httpx.Client(limits=self._pool_limits(), timeout=self.options["timeout"], follow_redirects=True)
+            # Retries are done by EndpointPool so they can move to another endpoint.
+            self._client = OpenAI(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                timeout=self.options["timeout"],
+                max_retries=0,
+                http_client=http_client
+            )
+        return self._client
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        if self._async_client is None:
+            http_client = None
+            if httpx is not None:
+                http_client = httpx.AsyncClient(limits=self._pool_limits(), timeout=self.options["timeout"], follow_redirects=True)
+            self._async_client = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                timeout=self.options["timeout"],
+                max_retries=0,
+                http_client=http_client
+            )
+        return self._async_client
+
+    def available(self, now: float, cooldown: float) -> bool:
+        if self.opened_at is None:
+            return True
+        return now - self.opened_at >= cooldown and not self.probing
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "outstanding": self.outstanding,
+            "latency_ms": round(self.latency * 1000, 1),
+            "failures": self.failures,
+            "open": self.opened_at is not None,
+            "requests": self.requests
+        }
+
+
+class EndpointPool:
+    """
+    Spreads requests over the endpoints of one model. Picks the available
+    endpoint with the lowest (outstanding + 1) * average latency; an endpoint
+    without a successful request yet counts with the mean latency of the
+    measured ones, so its outstanding requests still weigh. Retryable
+    errors back off exponentially with full jitter and move to the next best
+    endpoint. Other errors are raised immediately.
+    """
+
+    def __init__(self, model_config: Dict[str, Any], gen_config: Dict[str, Any]):
+        options = {
+            "timeout": gen_config.get("timeout", 60),
+            "max_connections": gen_config.get("max_connections", 16),
+            "keepalive_expiry": gen_config.get("keepalive_expiry", 120)
+        }
+        self.endpoints = [Endpoint(url, key, options) for url, key in endpoint_specs(model_config)]
+        self.max_retries = gen_config.get("max_retries", 3)
+        self.base_delay = gen_config.get("retry_base_delay", 0.5)
+        self.max_delay = gen_config.get("retry_max_delay", 8.0)
+        self.failure_threshold = gen_config.get("circuit_failures", 3)
+        self.cooldown = gen_config.get("circuit_cooldown", 30.0)
+        self._lock = threading.Lock()
+
+    def _acquire(self, tried: List[Endpoint]) -> Endpoint:
+        with self._lock:
+            now = time.monotonic()
+            candidates = [e for e in self.endpoints if e.available(now, self.cooldown)]
+            # A retry goes to an endpoint this call has not failed on yet, if there is one.
+            untried = [e for e in candidates if e not in tried]
+            candidates = untried or candidates
+            if not candidates:
+                # Every circuit is open: fail over to whichever reopens first rather than fail outright.
+                candidates = [min(self.endpoints, key=lambda e: e.opened_at or 0.0)]
+            measured = [e.latency for e in self.endpoints if e.latency > 0]
+            prior = sum(measured) / len(measured) if measured else DEFAULT_LATENCY
+            endpoint = min(candidates, key=lambda e: ((e.outstanding + 1) * (e.latency or prior), random.random()))
+            if endpoint.opened_at is not None:
+                endpoint.probing = True
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def _release(self, endpoint: Endpoint, elapsed: Optional[float] = None, failed: bool = False):
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.probing = False
+            if failed:
+                endpoint.failures += 1
+                if endpoint.failures >= self.failure_threshold or endpoint.opened_at is not None:
+                    endpoint.opened_at = time.monotonic()
+            elif elapsed is not None:
+                endpoint.failures = 0
+                endpoint.opened_at = None
+                endpoint.latency = elapsed if endpoint.latency == 0 else (
+                    LATENCY_ALPHA * elapsed + (1 - LATENCY_ALPHA) * endpoint.latency
+                )
+
+    def _delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, request: Callable[[OpenAI], T]) -> T:
+        """Run `request(client)` on the best endpoint, retrying transient failures elsewhere."""
+        tried: List[Endpoint] = []
+        for attempt in range(self.max_retries + 1):
+            endpoint = self._acquire(tried)
+            start = time.monotonic()
+            try:
+                result = request(endpoint.client)
+            except RETRYABLE_ERRORS as e:
+                self._release(endpoint, failed=True)
+                tried.append(endpoint)
+                if attempt == self.max_retries:
+                    raise LLMError(f"{endpoint.base_url}: {e} (after {attempt + 1} attempts)") from e
+                time.sleep(self._delay(attempt))
+                continue
+            except BaseException:
+                # Client errors say nothing about the endpoint's health.
+                self._release(endpoint)
+                raise
+            self._release(endpoint, time.monotonic() - start)
+            return result
+
+    async def acall(self, request: Callable[[AsyncOpenAI], Awaitable[T]]) -> T:
+        tried: List[Endpoint] = []
+        for attempt in range(self.max_retries + 1):
+            endpoint = self._acquire(tried)
+            start = time.monotonic()
+            try:
+                result = await request(endpoint.async_client)
+            except RETRYABLE_ERRORS as e:
+                self._release(endpoint, failed=True)
+                tried.append(endpoint)
+                if attempt == self.max_retries:
+                    raise LLMError(f"{endpoint.base_url}: {e} (after {attempt + 1} attempts)") from e
+                await asyncio.sleep(self._delay(attempt))
+                continue
+            except BaseException:
+                self._release(endpoint)
+                raise
+            self._release(endpoint, time.monotonic() - start)
+            return result
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [e.snapshot() for e in self.endpoints]
+
+
+def endpoint_specs(model_config: Dict[str, Any]) -> List[tuple]:
+    """
+    (base_url, api_key) pairs of a model. `endpoints` may list URLs or
+    {"base_url", "api_key"} objects; a plain `base_url` is a single endpoint.
+    """
+    # API Key resolution: Config > Env Var > Default/Ollama
+    default_key = model_config.get("api_key") or os.getenv("OPENAI_API_KEY", "ollama")
+    entries: List[Union[str, Dict[str, Any]]] = model_config.get("endpoints") or [model_config.get("base_url")]
+    specs = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            specs.append((entry.get("base_url"), entry.get("api_key") or default_key))
+        else:
+            specs.append((entry, default_key))
+    return specs
+
+
+_pools: Dict[tuple, EndpointPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_endpoint_pool(model_name: str, model_config: Dict[str, Any], gen_config: Dict[str, Any]) -> EndpointPool:
+    """Process-wide pool per model and endpoint list, so every client shares connections and health state."""
+    key = (model_name, tuple(endpoint_specs(model_config)))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = EndpointPool(model_config, gen_config)
+        return pool
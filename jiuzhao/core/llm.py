@@ -1,40 +1,315 @@
-import os
-from openai import OpenAI
-from typing import List, Dict, Any
-from jiuzhao.config import load_config, get_model_config, get_generation_config
+import contextlib
+import copy
+import re
+import threading
+import time
+from openai import AsyncOpenAI, OpenAI, BadRequestError
+from typing import Callable, List, Dict, Any, Optional, Tuple
+from jiuzhao.config import get_settings
+from jiuzhao.core.endpoints import LLMError, get_endpoint_pool
+from jiuzhao.core.replay import ReplayExhaustedError, ResponseCache, SessionRecorder, SessionReplayer, request_key
+from jiuzhao.core.context import estimate_tokens
+from jiuzhao.utils.trace import get_current_span, span
+
+# A complete tool call. A response may contain several.
+TOOL_BLOCK_RE = re.compile(r'<TOOL name="(.*?)">\s*({.*?})\s*</TOOL>', re.DOTALL)
+# A model that goes on to write "Tool '...' output:" itself is inventing the result;
+# the stop sequence ends generation there and the stray header is trimmed.
+OUTPUT_STOP = "' output:"
+INVENTED_OUTPUT_RE = re.compile(r"\s*Tool '[^'\n]*(?:'\s*output:.*)?$", re.DOTALL)
+# After a tool call, this much text that does not start another call ends the stream.
+TOOL_TAIL_CHARS = 200
+
+
+def trim_invented_output(text: str) -> str:
+    """Cut a response where, after a tool call, the model starts writing a tool's output."""
+    first = TOOL_BLOCK_RE.search(text)
+    if not first:
+        return text
+    match = INVENTED_OUTPUT_RE.search(text, first.end())
+    return text[:match.start()] if match else text
+
 
 class LLMClient:
-    def __init__(self):
-        self.config = load_config()
-        self.model_name = self.config.get("current_model")
-        self.model_config = get_model_config(self.model_name)
-        self.gen_config = get_generation_config()
-        
+    def __init__(
+        self,
+        record_path: Optional[str] = None,
+        replay_path: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        model_config: Optional[Dict[str, Any]] = None
+    ):
+        settings = get_settings()
+        if model_config:
+            # An explicit endpoint, e.g. the benchmark's local stand-in server.
+            self.model_name = model_config["name"]
+            self.model_config = model_config
+        else:
+            self.model_name = settings.current_model
+            self.model_config = settings.model(self.model_name)
+        self.gen_config = dict(settings.generation)
+
+        self.recorder = SessionRecorder(record_path) if record_path else None
+        self.replayer = SessionReplayer(replay_path) if replay_path else None
+        # Caps in-flight requests when one client is shared by concurrent sessions.
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        # Clients for other models made by for_model(), shared by every copy.
+        self._variants: Dict[str, "LLMClient"] = {}
+        self._variants_lock = threading.Lock()
+        self.cache = None
+        if self.gen_config.get("cache", False):
+            self.cache = ResponseCache(max_mb=self.gen_config.get("cache_max_mb", 100))
+
+        if self.replayer:
+            # Replay never touches the network, so no endpoint needs to be configured.
+            self.endpoints = None
+            self.supports_stop = True
+            return
+
         if not self.model_config:
             raise ValueError(f"Model configuration for '{self.model_name}' not found. Please run 'jiuzhao config'.")
 
-        # API Key resolution: Config > Env Var > Default/Ollama
-        api_key = self.model_config.get("api_key")
-        if not api_key:
-            api_key = os.getenv("OPENAI_API_KEY", "ollama")
+        self.endpoints = get_endpoint_pool(self.model_name, self.model_config, self.gen_config)
+        # Some endpoints (e.g. reasoning models) reject `stop`; this flips off on the first refusal.
+        self.supports_stop = self.model_config.get("supports_stop", True)
 
-        self.client = OpenAI(
-            base_url=self.model_config.get("base_url"),
-            api_key=api_key,
-            timeout=self.gen_config.get("timeout", 60)
-        )
+    def for_model(self, name: str) -> "LLMClient":
+        """
+        A client for another configured model that shares this one's
+        generation settings, concurrency cap, cache, recorder and replayer.
+        """
+        if name == self.model_name:
+            return self
+        with self._variants_lock:
+            client = self._variants.get(name)
+            if client is None:
+                model_config = get_settings().model(name)
+                if not model_config and not self.replayer:
+                    raise ValueError(f"Model configuration for '{name}' not found. Please run 'jiuzhao config'.")
+                client = copy.copy(self)
+                client.model_name = name
+                client.model_config = model_config
+                if not self.replayer:
+                    client.endpoints = get_endpoint_pool(name, model_config, self.gen_config)
+                    client.supports_stop = model_config.get("supports_stop", True)
+                self._variants[name] = client
+            return client
 
     def chat(self, messages: List[Dict[str, str]]) -> str:
-        try:
-            response = self.client.chat.completions.create(
+        return self._complete(messages, stream=False)
+
+    def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """
+        Stream a completion, calling `on_delta` with the accumulated text as it
+        arrives. Once the response holds a tool call, generation ends when the
+        model starts writing a tool's output itself (a stop sequence where the
+        backend supports it), when `max_tool_calls` calls are complete, or when
+        it writes more than TOOL_TAIL_CHARS of text without opening another call.
+        """
+        return self._complete(messages, stream=True, on_delta=on_delta)
+
+    def _generation_params(self, stream: bool) -> Dict[str, Any]:
+        return {
+            "temperature": self.gen_config.get("temperature", 0.2),
+            "max_tokens": self.gen_config.get("max_tokens", 4096),
+            # Streaming stops early after tool calls, so it yields different text.
+            "stream": stream
+        }
+
+    def _complete(
+        self,
+        messages: List[Dict[str, str]],
+        stream: bool,
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """Serve a completion from replay, the response cache or the endpoint, in that order."""
+        with span("llm.chat", "llm", model=self.model_name, stream=stream) as s:
+            start = time.perf_counter()
+            if s.enabled:
+                s.set(tokens_in=sum(estimate_tokens(m["content"]) for m in messages))
+                if on_delta:
+                    on_delta = self._traced_delta(on_delta, s, start)
+
+            content, source = self._lookup(messages, stream, on_delta)
+            if s.enabled:
+                s.set(source=source, tokens_out=estimate_tokens(content))
+                s.args.setdefault("ttft_s", round(time.perf_counter() - start, 6))
+            return content
+
+    @staticmethod
+    def _traced_delta(on_delta: Callable[[str], None], s, start: float) -> Callable[[str], None]:
+        """Wrap a stream callback to record time-to-first-token and rendering time on the span."""
+        def traced(text: str):
+            before = time.perf_counter()
+            s.args.setdefault("ttft_s", round(before - start, 6))
+            on_delta(text)
+            s.args["render_s"] = s.args.get("render_s", 0.0) + time.perf_counter() - before
+        return traced
+
+    def _lookup(
+        self,
+        messages: List[Dict[str, str]],
+        stream: bool,
+        on_delta: Optional[Callable[[str], None]]
+    ) -> Tuple[str, str]:
+        key = request_key(self.model_name, self._generation_params(stream), messages)
+
+        if self.replayer:
+            source = "replay"
+            try:
+                content = self.replayer.next(key)
+            except ReplayExhaustedError as e:
+                raise LLMError(str(e)) from e
+            if on_delta:
+                on_delta(content)
+        else:
+            source = "cache"
+            content = self.cache.get(key) if self.cache else None
+            if content is None:
+                source = "network"
+                queued = time.perf_counter()
+                with self._slots or contextlib.nullcontext():
+                    s = get_current_span()
+                    if s.enabled:
+                        s.set(queue_s=round(time.perf_counter() - queued, 6))
+                    content = self._stream_uncached(messages, on_delta) if stream else self._chat_uncached(messages)
+                if self.cache:
+                    self.cache.put(key, self.model_name, content)
+            elif on_delta:
+                on_delta(content)
+
+        if self.recorder:
+            self.recorder.record(key, self.model_name, messages, content)
+        return content, source
+
+    def _chat_uncached(self, messages: List[Dict[str, str]]) -> str:
+        def request(client: OpenAI) -> str:
+            response = client.chat.completions.create(
                 model=self.model_name,
                 messages=messages,
                 temperature=self.gen_config.get("temperature", 0.2),
                 max_tokens=self.gen_config.get("max_tokens", 4096)
             )
-            content = response.choices[0].message.content
-            if not content:
-                return "Error: Empty response from LLM."
-            return content
+            return response.choices[0].message.content
+
+        return trim_invented_output(self._checked(self._call(request)))
+
+    def _stream_uncached(
+        self,
+        messages: List[Dict[str, str]],
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> str:
+        def request(client: OpenAI) -> str:
+            try:
+                stream = self._create_stream(client, messages)
+            except BadRequestError as e:
+                if not self.supports_stop or "stop" not in str(e).lower():
+                    raise
+                self.supports_stop = False
+                stream = self._create_stream(client, messages)
+
+            text = ""
+            calls = 0
+            # End of the last complete tool call; later text is scanned incrementally.
+            calls_end = 0
+            try:
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    delta = choice.delta.content if choice.delta else None
+                    if not delta:
+                        continue
+                    text += delta
+                    if on_delta:
+                        on_delta(text)
+                    match = TOOL_BLOCK_RE.search(text, calls_end)
+                    while match:
+                        calls += 1
+                        calls_end = match.end()
+                        match = TOOL_BLOCK_RE.search(text, calls_end)
+                    if calls and self._past_tool_calls(text[calls_end:], calls):
+                        break
+            finally:
+                stream.close()
+
+            trimmed = trim_invented_output(text)
+            if on_delta and trimmed != text:
+                on_delta(trimmed)
+            return trimmed
+
+        # The whole stream runs inside one attempt, so a retry restarts it from scratch.
+        return self._checked(self._call(request))
+
+    def _past_tool_calls(self, tail: str, calls: int) -> bool:
+        """Whether a response holding `calls` tool calls followed by `tail` can be cut off."""
+        if calls >= self.gen_config.get("max_tool_calls", 8) or OUTPUT_STOP in tail:
+            return True
+        return "<TOOL" not in tail and len(tail.strip()) > TOOL_TAIL_CHARS
+
+    def _call(self, request: Callable[[OpenAI], str]) -> str:
+        try:
+            return self.endpoints.call(request)
+        except LLMError:
+            raise
+        except Exception as e:
+            raise LLMError(str(e)) from e
+
+    @staticmethod
+    def _checked(content: Optional[str]) -> str:
+        if not content:
+            raise LLMError("Empty response from LLM.")
+        return content
+
+    def _create_stream(self, client: OpenAI, messages: List[Dict[str, str]]):
+        params: Dict[str, Any] = {
+            "model": self.model_name,
+            "messages": messages,
+            "temperature": self.gen_config.get("temperature", 0.2),
+            "max_tokens": self.gen_config.get("max_tokens", 4096),
+            "stream": True
+        }
+        if self.supports_stop:
+            params["stop"] = [OUTPUT_STOP]
+        return client.chat.completions.create(**params)
+
+    async def achat(self, messages: List[Dict[str, str]], temperature: Optional[float] = None) -> str:
+        """
+        Asynchronous, uncached completion for concurrent sampling. Independent
+        samples of one prompt must differ, so the response cache is bypassed;
+        a recording still captures them, and replay serves them in order.
+        """
+        temperature = self.gen_config.get("temperature", 0.2) if temperature is None else temperature
+        key = request_key(
+            self.model_name,
+            {"temperature": temperature, "max_tokens": self.gen_config.get("max_tokens", 4096), "sample": True},
+            messages
+        )
+        if self.replayer:
+            try:
+                return self.replayer.next(key)
+            except ReplayExhaustedError as e:
+                raise LLMError(str(e)) from e
+
+        async def request(client: AsyncOpenAI) -> str:
+            response = await client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=self.gen_config.get("max_tokens", 4096)
+            )
+            return response.choices[0].message.content
+
+        try:
+            content = await self.endpoints.acall(request)
+        except LLMError:
+            raise
         except Exception as e:
-            return f"LLM Connection Error: {str(e)}"
+            raise LLMError(str(e)) from e
+        content = self._checked(content)
+        if self.recorder:
+            self.recorder.record(key, self.model_name, messages, content)
+        return content
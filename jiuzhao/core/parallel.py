@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+from jiuzhao.config import get_generation_config, get_lean_config
+from jiuzhao.core.llm import LLMClient, LLMError
+from jiuzhao.tools.lean import CheckCancelled, cancel_checks, compile_lean_file
+from jiuzhao.utils.ui import console
+
+SCRATCH_DIR = os.path.join(".jiuzhao", "scratch")
+
+LEAN_BLOCK_RE = re.compile(r"```lean4?\s*\n(.*?)```", re.DOTALL)
+WRITE_CONTENT_RE = re.compile(r'"content"\s*:\s*"((?:[^"\\]|\\.)*)"', re.DOTALL)
+
+# Compiler output fed back per failed candidate is capped to keep round prompts small.
+MAX_FEEDBACK_CHARS = 1500
+MAX_FEEDBACK_CANDIDATES = 3
+
+SYSTEM_PROMPT = """
+You are Jiuzhao, an expert Lean 4 prover.
+Given a statement, reply with ONE complete Lean 4 file (imports included) that states and proves it.
+Put the whole file in a single ```lean code block. Do not use `sorry`.
+"""
+
+
+def extract_candidate(response: str) -> Optional[str]:
+    """Pull a Lean source out of a model response: the last ```lean block, or a file_system write."""
+    blocks = LEAN_BLOCK_RE.findall(response)
+    if blocks:
+        return blocks[-1].strip() + "\n"
+    match = WRITE_CONTENT_RE.search(response)
+    if match:
+        try:
+            return json.loads(f'"{match.group(1)}"')
+        except ValueError:
+            return None
+    return None
+
+
+class ParallelProver:
+    """
+    Best-of-N proving: each round samples N complete proofs concurrently, writes
+    every candidate to its own scratch file and checks them concurrently. The
+    first candidate that compiles cleanly cancels the rest of the round: checks
+    run on warm REPL workers, and only the workers still busy with losing
+    candidates are killed, on threads of the prover's own that are not waited
+    for. Otherwise a few of the round's compiler errors are fed into the next
+    round.
+    """
+
+    def __init__(self, llm: Optional[LLMClient] = None):
+        gen_config = get_generation_config()
+        self.llm = llm or LLMClient()
+        self.n = gen_config.get("best_of_n", 4)
+        self.rounds = gen_config.get("parallel_rounds", 3)
+        self.temperature = gen_config.get("sample_temperature", 0.8)
+        self.check_timeout = get_lean_config().get("request_timeout", 30)
+        self.llm_concurrency = gen_config.get("llm_concurrency", 4)
+        self.check_concurrency = gen_config.get("check_concurrency", 2)
+        self.stats: Dict[str, Any] = {"samples": 0, "checked": 0, "rounds": 0}
+
+    def run(self, statement: str) -> Optional[Dict[str, Any]]:
+        return asyncio.run(self.prove(statement))
+
+    async def prove(self, statement: str) -> Optional[Dict[str, Any]]:
+        os.makedirs(SCRATCH_DIR, exist_ok=True)
+        # Created here so they belong to the running loop (Python < 3.10 binds them at creation).
+        self.llm_slots = asyncio.Semaphore(self.llm_concurrency)
+        self.check_slots = asyncio.Semaphore(self.check_concurrency)
+        # Not the loop's default executor, which asyncio.run waits for on the way out.
+        self.checks = ThreadPoolExecutor(max_workers=self.check_concurrency, thread_name_prefix="jiuzhao-check")
+        start = time.monotonic()
+        feedback: List[Dict[str, str]] = []
+
+        try:
+            for round_no in range(1, self.rounds + 1):
+                self.stats["rounds"] = round_no
+                console.print(f"[dim]Round {round_no}/{self.rounds}: sampling {self.n} candidates...[/dim]")
+                messages = self._round_messages(statement, feedback)
+                cancel = threading.Event()
+                tasks = [asyncio.ensure_future(self._attempt(messages, round_no, i, cancel)) for i in range(self.n)]
+
+                failures = []
+                winner = None
+                try:
+                    for next_done in asyncio.as_completed(tasks):
+                        result = await next_done
+                        if result["status"] == "verified":
+                            winner = result
+                            break
+                        failures.append(result)
+                finally:
+                    cancel_checks(cancel)
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+
+                if winner:
+                    winner["elapsed"] = time.monotonic() - start
+                    winner["round"] = round_no
+                    return winner
+
+                feedback = [f for f in failures if f.get("source")][:MAX_FEEDBACK_CANDIDATES]
+            return None
+        finally:
+            self.checks.shutdown(wait=False, cancel_futures=True)
+
+    def _round_messages(self, statement: str, feedback: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": statement}
+        ]
+        if feedback:
+            parts = ["Previous attempts failed. Fix these errors:"]
+            for k, f in enumerate(feedback, 1):
+                parts.append(
+                    f"Attempt {k}:\n```lean\n{f['source']}```\nCompiler output:\n{f['output'][:MAX_FEEDBACK_CHARS]}"
+                )
+            messages.append({"role": "user", "content": "\n\n".join(parts)})
+        return messages
+
+    async def _attempt(
+        self,
+        messages: List[Dict[str, str]],
+        round_no: int,
+        index: int,
+        cancel: threading.Event
+    ) -> Dict[str, Any]:
+        try:
+            async with self.llm_slots:
+                response = await self.llm.achat(messages, temperature=self.temperature)
+        except LLMError as e:
+            console.print(f"[dim]   candidate {index + 1}: sampling failed ({e})[/dim]")
+            return {"status": "llm_error", "output": str(e)}
+        self.stats["samples"] += 1
+
+        source = extract_candidate(response)
+        if source is None:
+            console.print(f"[dim]   candidate {index + 1}: no Lean code in response[/dim]")
+            return {"status": "no_code", "output": response[:MAX_FEEDBACK_CHARS]}
+
+        path = os.path.join(SCRATCH_DIR, f"round{round_no}_cand{index + 1}.lean")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(source)
+
+        async with self.check_slots:
+            try:
+                returncode, output = await asyncio.get_running_loop().run_in_executor(
+                    self.checks, compile_lean_file, path, self.check_timeout, None, cancel
+                )
+            except CheckCancelled:
+                return {"status": "cancelled", "output": ""}
+            except subprocess.TimeoutExpired:
+                returncode, output = 1, f"Compilation timed out ({self.check_timeout}s)."
+            except FileNotFoundError:
+                returncode, output = 1, "'lean' executable not found."
+        self.stats["checked"] += 1
+
+        # A proof that still relies on `sorry` compiles but is not a proof.
+        verified = returncode == 0 and "sorry" not in output
+        console.print(f"[dim]   candidate {index + 1}: {'verified' if verified else 'failed'}[/dim]")
+        return {
+            "status": "verified" if verified else "failed",
+            "path": path,
+            "source": source,
+            "output": output
+        }
@@ -0,0 +1,327 @@
+import hashlib
+import heapq
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from jiuzhao.config import get_search_config, get_lean_config
+from jiuzhao.core.llm import LLMClient, LLMError
+from jiuzhao.tools.repl import LeanReplError, LeanReplPool, get_repl_pool, split_header
+
+LEAN_BLOCK_RE = re.compile(r"```(?:lean4?)?\s*\n(.*?)```", re.DOTALL)
+# Tactics that close goals without proving them.
+FORBIDDEN_TACTIC_RE = re.compile(r"\b(sorry|admit)\b")
+
+SYSTEM_PROMPT = """
+You are Jiuzhao, an expert Lean 4 prover.
+You are given the current goals of a proof. Suggest up to {k} different tactics
+that make progress on the first goal, most promising first.
+Reply with a single ```lean code block containing one tactic per line.
+Each tactic must fit on one line. Do not use `sorry` or `admit`.
+"""
+
+
+class SearchNode:
+    """
+    One proof state in the search tree. Slots keep per-node memory small.
+    `generation` is the REPL worker the proof state id belongs to.
+    """
+
+    __slots__ = ("proof_state", "goals", "parent", "tactic", "depth", "priority", "generation")
+
+    def __init__(
+        self,
+        proof_state: int,
+        goals: Tuple[str, ...],
+        parent: Optional["SearchNode"],
+        tactic: Optional[str],
+        depth: int,
+        priority: float
+    ):
+        self.proof_state = proof_state
+        self.goals = goals
+        self.parent = parent
+        self.tactic = tactic
+        self.depth = depth
+        self.priority = priority
+        self.generation = 0
+
+    def tactics(self) -> List[str]:
+        """The tactic script from the root to this node."""
+        script = []
+        node = self
+        while node.parent is not None:
+            script.append(node.tactic)
+            node = node.parent
+        return script[::-1]
+
+    def size_bytes(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self.goals) + sum(sys.getsizeof(g) for g in self.goals)
+
+
+def goals_key(goals: Tuple[str, ...]) -> bytes:
+    """Transposition key: identical goal lists are the same search state."""
+    normalized = "\x00".join(" ".join(g.split()) for g in goals)
+    return hashlib.sha1(normalized.encode("utf-8")).digest()
+
+
+def parse_tactics(response: str, limit: int) -> List[str]:
+    """Unique one-line tactics from a model response, in the order suggested."""
+    blocks = LEAN_BLOCK_RE.findall(response)
+    text = blocks[-1] if blocks else response
+    tactics: List[str] = []
+    for line in text.split("\n"):
+        tactic = line.strip()
+        if not tactic or tactic.startswith("--") or tactic.startswith("```"):
+            continue
+        if FORBIDDEN_TACTIC_RE.search(tactic) or tactic in tactics:
+            continue
+        tactics.append(tactic)
+        if len(tactics) >= limit:
+            break
+    return tactics
+
+
+def fill_sorry(source: str, line: int, column: int, tactics: List[str]) -> str:
+    """Replace the `sorry` at (1-based line, 0-based column) by a tactic block."""
+    lines = source.split("\n")
+    target = lines[line - 1]
+    before, after = target[:column], target[column + len("sorry"):]
+    if not before.strip():
+        # `sorry` alone on its line already sits inside a tactic block.
+        lines[line - 1] = "\n".join(before + t for t in tactics) + after
+        return "\n".join(lines)
+    indent = " " * (len(target) - len(target.lstrip()) + 2)
+    prefix = before.rstrip()
+    if not prefix.endswith("by"):
+        prefix += " by"
+    lines[line - 1] = prefix + "\n" + "\n".join(indent + t for t in tactics) + after
+    return "\n".join(lines)
+
+
+class ProofSearch:
+    """
+    Best-first search over Lean proof states.
+
+    The first `sorry` of a file is turned into a saved REPL proof state. Each
+    expansion asks the model for candidate tactics for the node's goals and
+    runs them against the saved state, so no tactic recompiles the file. New
+    states go into a priority queue ordered by depth and remaining goals.
+    States whose goal list was already reached are dropped through a
+    transposition table. The search stops at the first state without goals or
+    when a node, expansion, time or REPL memory limit is reached.
+
+    A tactic that times out or crashes the REPL counts as a failed tactic. The
+    worker is replaced; proof states of the old one are rebuilt on demand by
+    replaying a node's tactics from the root.
+    """
+
+    def __init__(self, llm: Optional[LLMClient] = None, pool: Optional[LeanReplPool] = None):
+        self.config = get_search_config()
+        self.llm = llm or LLMClient()
+        self.pool = pool or get_repl_pool()
+        self.k = self.config.get("tactics_per_node", 8)
+        self.max_expansions = self.config.get("max_expansions", 200)
+        self.max_nodes = self.config.get("max_nodes", 5000)
+        self.max_depth = self.config.get("max_depth", 30)
+        self.time_limit = self.config.get("time_limit", 600)
+        self.tactic_timeout = self.config.get("tactic_timeout", 10)
+        self.max_repl_rss_mb = self.config.get("max_repl_rss_mb", 8192)
+        self.depth_weight = self.config.get("depth_weight", 1.0)
+        self.goal_weight = self.config.get("goal_weight", 2.0)
+        self.stats: Dict[str, Any] = {
+            "expansions": 0,
+            "nodes": 0,
+            "duplicates": 0,
+            "tactics_run": 0,
+            "tactic_errors": 0,
+            "tactic_timeouts": 0,
+            "restarts": 0,
+            "llm_errors": 0,
+            "node_bytes": 0,
+            "elapsed": 0.0,
+            "stop_reason": ""
+        }
+
+    def _priority(self, goals: Tuple[str, ...], depth: int, rank: int) -> float:
+        # Lower is better: shallow proofs with few, short goals first; the
+        # model's own ordering breaks ties between siblings.
+        goal_chars = sum(len(g) for g in goals)
+        return self.depth_weight * depth + self.goal_weight * len(goals) + goal_chars / 500 + rank * 0.1
+
+    def run(self, path: str) -> Optional[Dict[str, Any]]:
+        """Search for a proof of the first `sorry` in `path`. Returns the filled source on success."""
+        if self.pool is None:
+            raise LeanReplError("Proof search needs the Lean REPL (lean.use_repl and a `repl` dependency).")
+        with open(path, "r", encoding="utf-8") as f:
+            source = f.read()
+        header, body, offset = split_header(source)
+
+        self.header, self.body = header, body
+        self.worker = self.pool.acquire(header)
+        self.generation = 0
+        try:
+            result = self._search(offset, source)
+        finally:
+            # The REPL never frees proof states, so a worker that searched is retired.
+            if self.worker is not None:
+                self.pool.release(self.worker, healthy=False)
+
+        if result:
+            # Tactic-mode success does not guarantee the spliced file parses; check it whole.
+            response, _ = self.pool.check(result["source"])
+            result["verified"] = "env" in response and not any(
+                m.get("severity") == "error" for m in response.get("messages", [])
+            )
+        return result
+
+    def _root_state(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """The first `sorry` of the file on the current worker, and its state after a no-op tactic."""
+        timeout = get_lean_config().get("request_timeout", 30)
+        sorries = self.worker.proof_states(self.body, timeout)
+        if not sorries:
+            raise LeanReplError("No `sorry` with a goal found in the file.")
+        # The REPL's goal list of the state; the `goal` text of a sorry joins
+        # goals with blank lines, which hypotheses can contain as well.
+        state = self.worker.run_tactic("skip", sorries[0]["proofState"], timeout)
+        if "proofState" not in state:
+            raise LeanReplError(state.get("message", "REPL returned no proof state."))
+        return sorries[0], state
+
+    def _search(self, offset: int, source: str) -> Optional[Dict[str, Any]]:
+        start = time.monotonic()
+        hole, state = self._root_state()
+        root = SearchNode(state["proofState"], tuple(state.get("goals", [])), None, None, 0, 0.0)
+        self.root = root
+
+        seen = {goals_key(root.goals)}
+        frontier: List[Tuple[float, int, SearchNode]] = [(root.priority, 0, root)]
+        counter = 1
+        self._count_node(root)
+
+        while frontier:
+            elapsed = time.monotonic() - start
+            self.stats["elapsed"] = elapsed
+            if self.stats["expansions"] >= self.max_expansions:
+                self.stats["stop_reason"] = "expansion limit"
+                return None
+            if elapsed > self.time_limit:
+                self.stats["stop_reason"] = "time limit"
+                return None
+            if self.stats["expansions"] % 10 == 0 and self.worker.rss_mb() > self.max_repl_rss_mb:
+                self.stats["stop_reason"] = "REPL memory limit"
+                return None
+
+            _, _, node = heapq.heappop(frontier)
+            self.stats["expansions"] += 1
+            for rank, tactic in enumerate(self._propose(node)):
+                child = self._apply(node, tactic, rank)
+                if child is None:
+                    continue
+                if not child.goals:
+                    self.stats["elapsed"] = time.monotonic() - start
+                    self.stats["stop_reason"] = "proved"
+                    script = child.tactics()
+                    pos = hole.get("pos", {})
+                    filled = fill_sorry(source, pos.get("line", 1) + offset, pos.get("column", 0), script)
+                    return {"tactics": script, "source": filled}
+
+                key = goals_key(child.goals)
+                if key in seen:
+                    self.stats["duplicates"] += 1
+                    continue
+                seen.add(key)
+                if child.depth >= self.max_depth:
+                    continue
+                if self.stats["nodes"] >= self.max_nodes:
+                    self.stats["stop_reason"] = "node limit"
+                    return None
+                self._count_node(child)
+                heapq.heappush(frontier, (child.priority, counter, child))
+                counter += 1
+
+        self.stats["elapsed"] = time.monotonic() - start
+        self.stats["stop_reason"] = "search space exhausted"
+        return None
+
+    def _count_node(self, node: SearchNode):
+        self.stats["nodes"] += 1
+        self.stats["node_bytes"] += node.size_bytes()
+
+    def _propose(self, node: SearchNode) -> List[str]:
+        goals = "\n\n".join(node.goals)
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT.format(k=self.k)},
+            {"role": "user", "content": f"Goals:\n{goals}"}
+        ]
+        try:
+            response = self.llm.chat(messages)
+        except LLMError:
+            self.stats["llm_errors"] += 1
+            return []
+        return parse_tactics(response, self.k)
+
+    def _restart(self):
+        """Replace a worker left busy or dead; proof states of the old one become stale."""
+        self.stats["restarts"] += 1
+        self.pool.release(self.worker, healthy=False)
+        self.worker = None
+        self.worker = self.pool.acquire(self.header)
+        self.generation += 1
+        self.root.proof_state = self._root_state()[1]["proofState"]
+        self.root.generation = self.generation
+
+    def _run_tactic(self, tactic: str, proof_state: int) -> Optional[Dict[str, Any]]:
+        """One tactic on the current worker; None when it timed out or took the worker down."""
+        self.stats["tactics_run"] += 1
+        try:
+            return self.worker.run_tactic(tactic, proof_state, self.tactic_timeout)
+        except (subprocess.TimeoutExpired, LeanReplError):
+            self.stats["tactic_timeouts"] += 1
+            self._restart()
+            return None
+
+    def _state(self, node: SearchNode) -> Optional[int]:
+        """The node's proof state on the current worker, replaying its tactics after a restart."""
+        if node.generation == self.generation:
+            return node.proof_state
+        parent = self._state(node.parent)
+        if parent is None:
+            return None
+        generation = self.generation
+        response = self._run_tactic(node.tactic, parent)
+        if response is None or "proofState" not in response or self.generation != generation:
+            return None
+        node.proof_state, node.generation = response["proofState"], generation
+        return node.proof_state
+
+    def _apply(self, node: SearchNode, tactic: str, rank: int) -> Optional[SearchNode]:
+        state = self._state(node)
+        if state is None:
+            return None
+        generation = self.generation
+        response = self._run_tactic(tactic, state)
+        if response is None:
+            self.stats["tactic_errors"] += 1
+            return None
+        errors = [m for m in response.get("messages", []) if m.get("severity") == "error"]
+        if "proofState" not in response or errors:
+            self.stats["tactic_errors"] += 1
+            return None
+        goals = tuple(response.get("goals", []))
+        depth = node.depth + 1
+        child = SearchNode(response["proofState"], goals, node, tactic, depth, self._priority(goals, depth, rank))
+        child.generation = generation
+        return child
+
+
+def format_search_stats(stats: Dict[str, Any]) -> str:
+    elapsed = max(stats["elapsed"], 1e-9)
+    per_node = stats["node_bytes"] / stats["nodes"] if stats["nodes"] else 0
+    return (
+        f"{stats['expansions']} expansions ({stats['expansions'] / elapsed:.1f}/s), "
+        f"{stats['nodes']} nodes (~{per_node:.0f} B/node), {stats['duplicates']} duplicate states, "
+        f"{stats['tactic_errors']}/{stats['tactics_run']} tactics failed "
+        f"({stats['tactic_timeouts']} timed out, {stats['restarts']} REPL restarts), {elapsed:.1f}s"
+    )
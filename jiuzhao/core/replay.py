@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+from jiuzhao.config import CONFIG_DIR
+
+LLM_CACHE_DIR = CONFIG_DIR / "cache" / "llm"
+
+
+def request_key(model: str, params: Dict[str, Any], messages: List[Dict[str, str]]) -> str:
+    """Deterministic hash of everything that determines a completion."""
+    payload = json.dumps(
+        {"model": model, "params": params, "messages": messages},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of LLM completions keyed by request_key.
+    Least recently used entries are evicted once the cache exceeds `max_mb`.
+    """
+
+    def __init__(self, directory: Path = LLM_CACHE_DIR, max_mb: float = 100):
+        self.directory = Path(directory)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.directory / f"{key}.json"
+        try:
+            with open(entry, "r", encoding="utf-8") as f:
+                content = json.load(f)["content"]
+            os.utime(entry)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return content
+
+    def put(self, key: str, model: str, content: str):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = self.directory / f"{key}.json"
+        tmp = entry.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"model": model, "content": content, "created": time.time()}, f, ensure_ascii=False)
+        os.replace(tmp, entry)
+        self._evict()
+
+    def _evict(self):
+        entries = [(p, p.stat()) for p in self.directory.glob("*.json")]
+        total = sum(st.st_size for _, st in entries)
+        if total <= self.max_bytes:
+            return
+        entries.sort(key=lambda e: e[1].st_mtime)
+        for p, st in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                p.unlink()
+                total -= st.st_size
+            except OSError:
+                pass
+
+
+class SessionRecorder:
+    """Appends every LLM exchange of a session to a JSONL file."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def record(self, key: str, model: str, messages: List[Dict[str, str]], content: str):
+        line = json.dumps({
+            "key": key,
+            "model": model,
+            "turn": len(messages),
+            "content": content
+        }, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class ReplayExhaustedError(Exception):
+    """Raised when a replayed session asks for more completions than were recorded."""
+
+
+class SessionReplayer:
+    """
+    Serves completions from a recording instead of the network.
+
+    Requests are matched by key first. If the prompt drifted (for example the
+    agent's prompt building changed since recording), the next unconsumed
+    exchange in recorded order is served instead and counted as a mismatch.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._order: deque = deque()
+        self._by_key: Dict[str, deque] = {}
+        self.mismatches = 0
+        self._lock = threading.Lock()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                exchange = json.loads(line)
+                exchange["used"] = False
+                self._order.append(exchange)
+                self._by_key.setdefault(exchange["key"], deque()).append(exchange)
+
+    def next(self, key: str) -> str:
+        with self._lock:
+            candidates = self._by_key.get(key)
+            while candidates and candidates[0]["used"]:
+                candidates.popleft()
+            if candidates:
+                exchange = candidates.popleft()
+            else:
+                while self._order and self._order[0]["used"]:
+                    self._order.popleft()
+                if not self._order:
+                    raise ReplayExhaustedError(f"Recording {self.path} has no more exchanges.")
+                exchange = self._order.popleft()
+                self.mismatches += 1
+            exchange["used"] = True
+            return exchange["content"]
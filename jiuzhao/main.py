@@ -1,20 +1,63 @@
 import typer
+from typing import Optional
 from rich.prompt import Prompt, IntPrompt, FloatPrompt
-from jiuzhao.core.agent import Agent
-from jiuzhao.config import load_config, save_config, load_default_models
-from jiuzhao.utils.ui import print_header, console, print_error
+from jiuzhao.config import get_settings, load_config, save_config
+from jiuzhao.utils.ui import print_header, console, print_error, print_success
 
 app = typer.Typer(help="Jiuzhao: Automated Formalization Agent for Lean 4")
 
+@app.callback()
+def main(
+    trace: Optional[str] = typer.Option(None, "--trace", help="Record timing spans and write them on exit (.jsonl, or Chrome trace JSON otherwise)")
+):
+    """
+    Jiuzhao: Automated Formalization Agent for Lean 4
+    """
+    # Heavy modules (the OpenAI SDK, NumPy, Markdown rendering) are imported
+    # inside the commands that use them so `--help` and `config` start fast.
+    for problem in get_settings().problems:
+        console.print(f"[warning]Config: {problem}[/warning]")
+    if trace:
+        import atexit
+        from jiuzhao.utils.trace import enable_tracing
+
+        tracer = enable_tracing()
+
+        def export():
+            tracer.export(trace)
+            console.print(f"[dim]Trace with {len(tracer.events)} spans written to {trace}[/dim]")
+
+        atexit.register(export)
+
 @app.command()
-def prove(statement: str = typer.Argument(..., help="The mathematical statement or request")):
+def prove(
+    statement: str = typer.Argument(..., help="The mathematical statement or request"),
+    record: Optional[str] = typer.Option(None, "--record", help="Save every LLM exchange of this session to a JSONL file"),
+    replay: Optional[str] = typer.Option(None, "--replay", help="Replay LLM exchanges from a recording instead of calling the model"),
+    parallel: bool = typer.Option(False, "--parallel", help="Sample and check best-of-N proofs concurrently instead of chatting")
+):
     """
     Start an interactive proving session.
     """
+    from jiuzhao.core.agent import Agent
+    from jiuzhao.core.llm import LLMClient
+
     print_header()
     
+    if parallel:
+        from jiuzhao.core.parallel import ParallelProver
+
+        prover = ParallelProver(LLMClient(record_path=record, replay_path=replay))
+        result = prover.run(statement)
+        if result:
+            print_success(f"Verified in round {result['round']} after {result['elapsed']:.1f}s: {result['path']}")
+            console.print(result["source"])
+        else:
+            print_error(f"No candidate verified after {prover.stats['rounds']} rounds ({prover.stats['samples']} samples).")
+        return
+
     try:
-        agent = Agent()
+        agent = Agent(LLMClient(record_path=record, replay_path=replay))
         agent.run(statement)
         
         while True:
@@ -34,13 +77,165 @@ def prove(statement: str = typer.Argument(..., help="The mathematical statement
         print_error(f"Failed to initialize agent: {str(e)}")
         console.print("[dim]Tip: Run 'jiuzhao config' to check your settings.[/dim]")
 
+@app.command()
+def batch(
+    input_path: str = typer.Argument(..., help="JSONL file with one {\"id\", \"statement\"} object per line"),
+    output: str = typer.Option("results.jsonl", "--output", "-o", help="JSONL file that result lines are appended to"),
+    workers: int = typer.Option(4, "--workers", "-w", help="Number of concurrent proving sessions"),
+    llm_concurrency: Optional[int] = typer.Option(None, "--llm-concurrency", help="Maximum in-flight model requests (default: one per worker)"),
+    workdir: str = typer.Option(".jiuzhao/batch", "--workdir", help="Directory holding one working directory per problem")
+):
+    """
+    Prove every statement of a JSONL file without interaction. Rerunning with the
+    same output file resumes after the last completed problem.
+    """
+    from jiuzhao.core.batch import BatchRunner, read_problems
+
+    try:
+        problems = list(read_problems(input_path))
+        runner = BatchRunner(output, workdir, workers=workers, llm_concurrency=llm_concurrency)
+    except Exception as e:
+        print_error(f"Failed to start batch: {str(e)}")
+        raise typer.Exit(1)
+
+    def report(result):
+        style = "success" if result["status"] == "proved" else "dim"
+        console.print(
+            f"[{style}]{result['id']}: {result['status']}[/{style}] "
+            f"[dim]({result['turns']} turns, {result['wall_time']:.1f}s)[/dim]"
+        )
+
+    console.print(f"[dim]{len(problems)} problems, {workers} workers, results in {output}[/dim]")
+    stats = runner.run(problems, on_result=report)
+    console.print(
+        f"[bold]Done:[/bold] {stats['proved']}/{stats['done']} proved, "
+        f"{stats['skipped']} skipped as already completed"
+    )
+    from jiuzhao.tools.scheduler import format_scheduler_stats, get_scheduler
+    scheduler_stats = get_scheduler().stats()
+    if scheduler_stats["jobs"]:
+        console.print(f"[dim]{format_scheduler_stats(scheduler_stats)}[/dim]")
+
+@app.command()
+def bench(
+    problems_path: Optional[str] = typer.Option(None, "--problems", help="JSONL problem set with canned model scripts (default: the bundled set)"),
+    latency: float = typer.Option(0.05, "--latency", help="Mock server delay before the first byte, in seconds"),
+    tokens_per_second: float = typer.Option(0, "--tps", help="Mock server generation speed (0 = unthrottled)"),
+    real_lean: bool = typer.Option(False, "--real-lean", help="Check proofs with Lean instead of the stub checker"),
+    lean_latency: float = typer.Option(0.0, "--lean-latency", help="Simulated stub checker time per check, in seconds"),
+    stream: bool = typer.Option(True, "--stream/--no-stream", help="Exercise the streaming or the blocking LLM path"),
+    repeat: int = typer.Option(1, "--repeat", help="Run the problem set this many times"),
+    save: Optional[str] = typer.Option(None, "--save", help="Write the report as JSON, e.g. to use as a baseline"),
+    baseline: Optional[str] = typer.Option(None, "--baseline", help="Compare against a report saved with --save"),
+    startup: int = typer.Option(0, "--startup", help="Instead, time N fresh processes each of `jiuzhao --help` and a first agent turn")
+):
+    """
+    Benchmark the agent loop against a local mock model server.
+    """
+    import json
+    from rich.table import Table
+    from jiuzhao.bench.runner import compare, load_problems, run_benchmark
+
+    if startup:
+        from jiuzhao.bench.startup import run_startup_benchmark
+
+        with console.status(f"[bold green]Starting {startup * 2} processes..."):
+            report = run_startup_benchmark(startup)
+        title = "Startup latency (ms)"
+    else:
+        problems = load_problems(problems_path)
+        with console.status(f"[bold green]Running {len(problems) * repeat} benchmark problems..."):
+            report = run_benchmark(
+                problems,
+                latency=latency,
+                tokens_per_second=tokens_per_second,
+                stub_lean=not real_lean,
+                lean_latency=lean_latency,
+                stream=stream,
+                repeat=repeat
+            )
+
+        console.print(
+            f"[bold]Problems:[/bold] {report['problems']}  [bold]Passed:[/bold] {report['passed']} "
+            f"({report['pass_rate'] * 100:.0f}%)  [bold]Throughput:[/bold] {report['throughput']:.2f} problems/s  "
+            f"[bold]Turns:[/bold] {report['turns']}"
+        )
+        console.print(
+            f"[bold]Tokens (estimated):[/bold] {report['tokens']['prompt']:,} prompt, "
+            f"{report['tokens']['completion']:,} completion"
+        )
+        title = "Per-stage latency (ms)"
+
+    table = Table(title=title)
+    for column in ("stage", "count", "p50", "p95", "total"):
+        table.add_column(column, justify="left" if column == "stage" else "right")
+    rows = [("problem", report["problem"])] if "problem" in report else []
+    for name, stats in rows + sorted(report["stages"].items()):
+        table.add_row(
+            name, str(stats["count"]),
+            f"{stats['p50'] * 1000:.2f}", f"{stats['p95'] * 1000:.2f}", f"{stats['total'] * 1000:.1f}"
+        )
+    console.print(table)
+
+    if baseline:
+        with open(baseline, "r", encoding="utf-8") as f:
+            rows = compare(report, json.load(f))
+        diff = Table(title=f"Against {baseline}")
+        for column in ("metric", "baseline", "current", "change"):
+            diff.add_column(column, justify="left" if column == "metric" else "right")
+        for metric, old, new, change in rows:
+            # Higher is better for throughput and pass rate, lower for timings.
+            worse = change < -0.1 if metric in ("throughput", "pass_rate") else change > 0.1
+            style = "danger" if worse else "dim"
+            diff.add_row(metric, f"{old:.4g}", f"{new:.4g}", f"[{style}]{change * 100:+.1f}%[/{style}]")
+        console.print(diff)
+
+    if save:
+        with open(save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        console.print(f"[dim]Report saved to {save}[/dim]")
+
+@app.command("search")
+def tree_search(
+    path: str = typer.Argument(..., help="Lean file whose first `sorry` should be proved"),
+    write: bool = typer.Option(False, "--write", help="Write the proof back into the file when it verifies")
+):
+    """
+    Best-first tactic search over Lean proof states for the first `sorry` in a file.
+    """
+    from jiuzhao.core.llm import LLMClient
+    from jiuzhao.core.proof_search import ProofSearch, format_search_stats
+
+    print_header()
+    try:
+        search = ProofSearch(LLMClient())
+        with console.status("[bold green]Searching proof states..."):
+            result = search.run(path)
+    except Exception as e:
+        print_error(f"Proof search failed: {str(e)}")
+        return
+
+    console.print(f"[dim]{format_search_stats(search.stats)}[/dim]")
+    if not result:
+        print_error(f"No proof found ({search.stats['stop_reason']}).")
+        return
+    if not result["verified"]:
+        print_error("Tactics closed the goal, but the filled-in file does not compile.")
+    else:
+        print_success(f"Proof found with {len(result['tactics'])} tactics.")
+    console.print("\n".join(result["tactics"]))
+    if write and result["verified"]:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(result["source"])
+        console.print(f"[dim]Updated {path}[/dim]")
+
 @app.command()
 def config():
     """
     Configure models and generation parameters.
     """
     print_header()
-    config_data = load_config()
+    config_data = load_config(apply_env=False)
     
     # --- Model Selection ---
     current = config_data.get("current_model", "None")
@@ -92,5 +287,67 @@ def config():
     save_config(config_data)
     console.print("\n[bold green]Configuration saved successfully![/bold green]")
 
+@app.command()
+def cache(clear: bool = typer.Option(False, "--clear", help="Delete all cached compile results")):
+    """
+    Show or clear the Lean compile result cache.
+    """
+    from jiuzhao.tools.cache import CompileCache
+
+    compile_cache = CompileCache()
+    if clear:
+        compile_cache.clear()
+        console.print("[bold green]Compile cache cleared.[/bold green]")
+        return
+
+    stats = compile_cache.stats()
+    lookups = stats["total_hits"] + stats["total_misses"]
+    hit_rate = (stats["total_hits"] / lookups * 100) if lookups else 0.0
+    console.print(f"Entries: [bold]{stats['entries']}[/bold] / {stats['max_entries']}")
+    console.print(f"Hits: [bold green]{stats['total_hits']}[/bold green]  Misses: [bold]{stats['total_misses']}[/bold]  Hit rate: {hit_rate:.1f}%")
+
+@app.command()
+def index(rebuild: bool = typer.Option(False, "--rebuild", help="Discard the index and rebuild it from scratch")):
+    """
+    Build or refresh the search index over project and dependency sources.
+    """
+    from jiuzhao.tools.index import SearchIndex
+    from jiuzhao.tools.symbols import build_symbol_tables
+    from jiuzhao.tools import retrieval
+
+    search_index = SearchIndex(".")
+    with console.status("[bold green]Indexing .lean sources...") as status:
+        def progress(count: int):
+            status.update(f"[bold green]Indexing .lean sources ({count} files scanned)...")
+
+        if rebuild:
+            stats = search_index.rebuild(progress)
+        else:
+            stats = search_index.refresh(include_dependencies=True, progress=progress)
+            if search_index.needs_compaction():
+                status.update("[bold green]Compacting the search index...")
+                search_index.rebuild(progress)
+
+        status.update("[bold green]Extracting declarations...")
+        project_symbols, dependency_symbols = build_symbol_tables(".")
+
+        if retrieval.numpy_available():
+            status.update("[bold green]Building premise retrieval index...")
+            retrieval.build_premise_indexes(".")
+
+    console.print(
+        f"[bold green]Index ready:[/bold green] {search_index.file_count()} files "
+        f"({stats['added']} added, {stats['updated']} updated, {stats['removed']} removed, "
+        f"{stats['unchanged']} unchanged)"
+    )
+    console.print(
+        f"[bold green]Symbol table ready:[/bold green] {project_symbols} project and "
+        f"{dependency_symbols} dependency declarations"
+    )
+    if not retrieval.numpy_available():
+        console.print("[dim]Premise retrieval index skipped: install the 'retrieval' extra (numpy).[/dim]")
+    console.print(f"[dim]{search_index.db_path}[/dim]")
+    search_index.close()
+
 if __name__ == "__main__":
     app()
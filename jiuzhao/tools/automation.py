@@ -0,0 +1,291 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from jiuzhao.config import CONFIG_DIR, get_search_config
+from .diagnostics import parse_diagnostics
+from .index import DEPENDENCY_DIRS
+from .repl import CheckCancelled, split_header
+from .scheduler import get_scheduler
+
+STATS_FILE = CONFIG_DIR / "automation_stats.json"
+SCRATCH_DIR = os.path.join(".jiuzhao", "automation")
+
+# A theorem statement in the user's request, up to its proof (or the end).
+LEAN_BLOCK_RE = re.compile(r"```lean4?\s*\n(.*?)```", re.DOTALL)
+STATEMENT_RE = re.compile(r"^[ \t]*(theorem|lemma|example)\b(.*?)(?::=|\Z)", re.DOTALL | re.MULTILINE)
+IMPORT_LINE_RE = re.compile(r"^import\s+\S.*$", re.MULTILINE)
+# `x y : ℕ` in a goal display; names with ✝ are inaccessible.
+HYPOTHESIS_RE = re.compile(r"^(\S+(?: \S+)*) : (.*)$", re.DOTALL)
+# Tactics that need Mathlib (or its Aesop/Batteries dependencies) to exist.
+MATHLIB_TACTICS = {"linarith", "norm_num", "aesop", "positivity", "nlinarith", "polyrith"}
+
+
+def extract_statement(text: str) -> Optional[Tuple[str, str]]:
+    """
+    The first theorem, lemma or example of a request as (imports, signature),
+    the signature without its proof. None for a statement in prose.
+    """
+    blocks = LEAN_BLOCK_RE.findall(text)
+    source = blocks[0] if blocks else text
+    match = STATEMENT_RE.search(source)
+    if not match or ":" not in match.group(2):
+        return None
+    # `lemma` is Mathlib syntax; `theorem` means the same everywhere.
+    keyword = "theorem" if match.group(1) == "lemma" else match.group(1)
+    signature = f"{keyword}{match.group(2).rstrip()}"
+    imports = "\n".join(IMPORT_LINE_RE.findall(source))
+    return imports, signature
+
+
+def _goal_blocks(message: str) -> List[str]:
+    """The goals of an `unsolved goals` error; Lean separates them with blank lines."""
+    first, _, rest = message.partition("\n")
+    if not first.startswith("unsolved goals"):
+        return []
+    return [block for block in re.split(r"\n\s*\n", rest) if "⊢" in block]
+
+
+def goal_to_example(goal: str) -> Optional[str]:
+    """
+    `x : ℕ\\nh : 0 < x\\n⊢ x ≠ 0` as `example (x : ℕ) (h : 0 < x) : x ≠ 0`. None when
+    the display is incomplete (hypotheses elided by truncation) or not understood.
+    """
+    entries: List[str] = []
+    for line in goal.split("\n"):
+        if not line.strip() or line.startswith("case "):
+            continue
+        if line[0].isspace() and entries:
+            entries[-1] += " " + line.strip()  # continuation of a long hypothesis or target
+        else:
+            entries.append(line.strip())
+    if not entries or not entries[-1].startswith("⊢") or any("…" in e for e in entries):
+        return None
+
+    binders = []
+    for entry in entries[:-1]:
+        match = HYPOTHESIS_RE.match(entry)
+        if not match:
+            return None
+        names, kind = match.group(1).split(), match.group(2)
+        kind = kind.split(" := ", 1)[0]  # a `let` value; the binder keeps its type
+        if all(n.startswith("inst") and "✝" in n for n in names):
+            binders.extend(f"[{kind}]" for _ in names)
+            continue
+        names = ["_" if "✝" in n else n for n in names]
+        binders.append(f"({' '.join(names)} : {kind})")
+    target = entries[-1][1:].strip()
+    return f"example {' '.join(binders)} : {target}".replace("example  :", "example :")
+
+
+def unsolved_goals(output: str) -> List[Dict[str, Any]]:
+    """
+    Each unsolved goal of compiler output as {"line", "goal", "example"},
+    `goal` counting from 1 within its error; goals not restatable are left out.
+    """
+    goals = []
+    for d in parse_diagnostics(output):
+        if d["severity"] != "error":
+            continue
+        for n, block in enumerate(_goal_blocks(d["message"]), 1):
+            example = goal_to_example(block)
+            if example:
+                goals.append({"line": d["line"], "goal": n, "example": example})
+    return goals
+
+
+def default_header(root: str) -> str:
+    """`import Mathlib` when the project has Mathlib as a dependency, nothing otherwise."""
+    for directory in DEPENDENCY_DIRS:
+        if os.path.isdir(os.path.join(root, directory, "mathlib")):
+            return "import Mathlib"
+    return ""
+
+
+class AutomationStats:
+    """Attempts and hits of the automation stage, per kind and per tactic, persisted across sessions."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pending: Dict[str, Any] = {}
+
+    def record(self, kind: str, tactic: Optional[str]):
+        with self._lock:
+            entry = self.pending.setdefault(kind, {"runs": 0, "hits": 0})
+            entry["runs"] += 1
+            if tactic:
+                entry["hits"] += 1
+                tactics = self.pending.setdefault("tactics", {})
+                tactics[tactic] = tactics.get(tactic, 0) + 1
+
+    def totals(self) -> Dict[str, Any]:
+        totals = load_stats()
+        with self._lock:
+            for key, counts in self.pending.items():
+                entry = totals.setdefault(key, {})
+                for name, value in counts.items():
+                    entry[name] = entry.get(name, 0) + value
+        return totals
+
+    def flush(self):
+        totals = self.totals()
+        with self._lock:
+            if not self.pending:
+                return
+            self.pending = {}
+        STATS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(STATS_FILE, "w") as f:
+            json.dump(totals, f, indent=2)
+
+
+def load_stats() -> Dict[str, Any]:
+    if STATS_FILE.exists():
+        try:
+            with open(STATS_FILE, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    return {}
+
+
+_stats: Optional[AutomationStats] = None
+_stats_lock = threading.Lock()
+
+
+def get_automation_stats() -> AutomationStats:
+    global _stats
+    with _stats_lock:
+        if _stats is None:
+            _stats = AutomationStats()
+            atexit.register(_stats.flush)
+        return _stats
+
+
+class Automation:
+    """
+    Tries to close a statement with decision procedures alone: one candidate
+    file per tactic (`simp`, `omega`, ...), all checked concurrently with the
+    given checker, the first that compiles without `sorry` wins. Checks share
+    a time budget and each gets at most `tactic_timeout` seconds. With a
+    `cancellable` checker (compile_lean_file), candidates run as `lean`
+    processes through the job scheduler rather than on the warm REPL pool,
+    so a slow tactic never recycles a pool worker, and the ones still
+    running when a candidate wins or the budget runs out are killed.
+    Otherwise they are abandoned.
+    """
+
+    def __init__(
+        self,
+        checker: Callable[[str, float, Optional[bool]], Tuple[int, str]],
+        root: str = ".",
+        tactics: Optional[List[str]] = None,
+        budget: Optional[float] = None,
+        header: Optional[str] = None,
+        tactic_timeout: Optional[float] = None,
+        cancellable: bool = False
+    ):
+        search_config = get_search_config()
+        self.checker = checker
+        self.root = root
+        self.tactics = tactics if tactics is not None else search_config.get("automation_tactics", [])
+        self.budget = budget if budget is not None else search_config.get("automation_budget", 15)
+        self.tactic_timeout = tactic_timeout if tactic_timeout is not None else search_config.get("automation_tactic_timeout", 10)
+        self.cancellable = cancellable
+        configured = search_config.get("automation_header", "")
+        self.header = header if header is not None else (configured or default_header(root))
+        self.stats = get_automation_stats()
+
+    def close(self, signature: str, imports: str = "", kind: str = "prepass", budget: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Race the tactics on `signature`; {"tactic", "path", "source",
+        "elapsed"} of the first that works, else None.
+        """
+        header = imports or self.header
+        tactics = [t for t in self.tactics if "Mathlib" in header or t not in MATHLIB_TACTICS]
+        if not tactics:
+            return None
+        budget = self.budget if budget is None else budget
+        digest = hashlib.sha256(f"{header}\n{signature}".encode("utf-8")).hexdigest()[:12]
+        directory = os.path.join(self.root, SCRATCH_DIR)
+        os.makedirs(directory, exist_ok=True)
+
+        candidates = {}
+        for tactic in tactics:
+            source = f"{header}\n\n{signature} := by\n  {tactic}\n".lstrip("\n")
+            path = os.path.join(directory, f"{digest}_{re.sub(r'[^A-Za-z0-9]+', '_', tactic)}.lean")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(source)
+            candidates[tactic] = (path, source)
+
+        start = time.monotonic()
+        winner = None
+        cancel = threading.Event() if self.cancellable else None
+        timeout = min(budget, self.tactic_timeout)
+        pool = ThreadPoolExecutor(max_workers=len(candidates))
+        try:
+            futures = {
+                pool.submit(self._check, path, timeout, cancel): tactic
+                for tactic, (path, _) in candidates.items()
+            }
+            pending = set(futures)
+            while pending and winner is None:
+                left = budget - (time.monotonic() - start)
+                if left <= 0:
+                    break
+                done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+                # Ties go to the earlier tactic in the list.
+                for future in sorted(done, key=lambda f: tactics.index(futures[f])):
+                    if future.result():
+                        winner = futures[future]
+                        break
+        finally:
+            if cancel is not None:
+                get_scheduler().cancel(cancel)
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        self.stats.record(kind, winner)
+        if winner is None:
+            return None
+        path, source = candidates[winner]
+        return {"tactic": winner, "path": path, "source": source, "elapsed": time.monotonic() - start}
+
+    def _check(self, path: str, timeout: float, cancel: Optional[threading.Event]) -> bool:
+        try:
+            if cancel is not None:
+                returncode, output = self.checker(path, timeout, False, cancel, repl=False)
+            else:
+                returncode, output = self.checker(path, timeout, False)
+        except (subprocess.TimeoutExpired, FileNotFoundError, CheckCancelled):
+            return False
+        return returncode == 0 and "sorry" not in output
+
+    def close_goals(self, output: str, path: str, budget: Optional[float] = None) -> List[str]:
+        """
+        After a failed compile of `path`, race the tactics on every unsolved
+        goal in `output`. Returns one hint line per goal that closed.
+        """
+        goals = unsolved_goals(output)
+        if not goals:
+            return []
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                imports = split_header(f.read())[0]
+        except OSError:
+            imports = ""
+        budget = self.budget if budget is None else budget
+        start = time.monotonic()
+        hints = []
+        for goal in goals:
+            left = budget - (time.monotonic() - start)
+            if left <= 0:
+                break
+            found = self.close(goal["example"], imports, kind="subgoal", budget=left)
+            if found:
+                hints.append(f"unsolved goal {goal['goal']} at line {goal['line']} closes with `{found['tactic']}`")
+        return hints
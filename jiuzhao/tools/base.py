@@ -1,7 +1,13 @@
+import time
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Callable, Dict, Any, Optional
 
 class BaseTool(ABC):
+    # Set by whoever displays a running call; receives short status lines.
+    progress: Optional[Callable[[str], None]] = None
+    # time.monotonic() by which the agent needs an answer; None for no limit.
+    deadline: Optional[float] = None
+
     @property
     @abstractmethod
     def name(self) -> str:
@@ -21,6 +27,21 @@ class BaseTool(ABC):
     def execute(self, args: Dict[str, Any]) -> str:
         pass
 
+    def report(self, message: str):
+        """Forward a progress line for a long-running call, if anyone is listening."""
+        if self.progress is not None:
+            self.progress(message)
+
+    def time_left(self, limit: float) -> float:
+        """`limit` seconds, or less if the deadline comes first (never negative)."""
+        if self.deadline is None:
+            return limit
+        return max(0.0, min(limit, self.deadline - time.monotonic()))
+
+    def is_read_only(self, args: Dict[str, Any]) -> bool:
+        """Whether this call only reads, so it may run concurrently with other reads."""
+        return False
+
     def get_definition(self) -> str:
         return f"""Name: {self.name}
 Description: {self.description}
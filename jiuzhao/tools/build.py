@@ -0,0 +1,269 @@
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, Any, Iterable, List, Optional, Set
+from .cache import IMPORT_RE
+from .diagnostics import LOG_DIR
+from .index import walk_sources
+from .scheduler import JobScheduler, get_scheduler
+
+# Lake progress lines: `✔ [12/40] Built Foo.Bar (1.2s)`, `✖ [3/40] Building Foo`, `[7/40] Running ...`.
+PROGRESS_RE = re.compile(r"^(\S*)\s*\[(\d+)/(\d+)\]\s+(.*)$")
+# The step of a progress line that names a module, with its time when Lake prints one.
+STEP_RE = re.compile(r"^(?:Built|Building|Replayed|Compiling)\s+(\S+)(?:\s+\((\d+(?:\.\d+)?)(ms|s)\))?")
+# Lake's closing list of failed jobs, after `Some required builds logged failures:`.
+FAILED_ITEM_RE = re.compile(r"^- (\S+)$")
+
+
+def module_name(path: str) -> str:
+    """`Foo/Bar.lean` -> `Foo.Bar`."""
+    return os.path.splitext(os.path.normpath(path))[0].replace(os.sep, ".")
+
+
+def import_graph(root: str = ".") -> Dict[str, Set[str]]:
+    """Every project module and the project modules it imports directly."""
+    imports: Dict[str, Set[str]] = {}
+    for relative, _ in walk_sources(root, include_project=True, include_dependencies=False):
+        if relative == "lakefile.lean":
+            continue
+        with open(os.path.join(root, relative), "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        imports[module_name(relative)] = {m for line in IMPORT_RE.findall(text) for m in line.split()}
+    return {module: deps & imports.keys() for module, deps in imports.items()}
+
+
+def affected_modules(graph: Dict[str, Set[str]], changed: Iterable[str]) -> Set[str]:
+    """The changed modules and every module importing one of them, directly or not."""
+    dependents: Dict[str, Set[str]] = {}
+    for module, deps in graph.items():
+        for dep in deps:
+            dependents.setdefault(dep, set()).add(module)
+    affected: Set[str] = set()
+    pending = list(changed)
+    while pending:
+        module = pending.pop()
+        if module not in affected:
+            affected.add(module)
+            pending.extend(dependents.get(module, ()))
+    return affected
+
+
+def dependency_closure(graph: Dict[str, Set[str]], module: str) -> Set[str]:
+    """Every project module `module` imports, directly or not."""
+    seen: Set[str] = set()
+    pending = list(graph.get(module, ()))
+    while pending:
+        current = pending.pop()
+        if current not in seen:
+            seen.add(current)
+            pending.extend(graph.get(current, ()))
+    return seen
+
+
+class LakeBuilder:
+    """
+    Builds project modules with a single `lake build +A +B ...` process, so
+    Lake loads the workspace and checks traces once and builds every stale
+    module exactly once, shared dependencies included. Per-module results are
+    read from its progress lines: modules that failed, targets skipped because
+    a module they import failed, the rest ok. `jobs` caps Lake's parallelism
+    through LEAN_NUM_THREADS (0 keeps its default). `timeout` limits each
+    module: Lake reports every finished module, so once none has finished for
+    `timeout` seconds every module still building has run at least that long,
+    and the build is stopped; modules done by then keep their results. The
+    process goes through the memory-aware job scheduler.
+    """
+
+    def __init__(
+        self,
+        root: str = ".",
+        timeout: float = 300,
+        progress: Optional[Callable[[str], None]] = None,
+        scheduler: Optional[JobScheduler] = None,
+        deadline: Optional[float] = None,
+        jobs: int = 0
+    ):
+        self.root = root
+        self.timeout = timeout
+        self.progress = progress
+        self.scheduler = scheduler or get_scheduler()
+        # Absolute time.monotonic() limit for the build, on top of the timeout.
+        self.deadline = deadline
+        self.jobs = jobs
+
+    def _report(self, message: str):
+        if self.progress is not None:
+            self.progress(message)
+
+    def build(self, targets: List[str], graph: Dict[str, Set[str]]) -> List[Dict[str, Any]]:
+        """
+        Build `targets` and return one result per target, plus one per other
+        module that failed: module, status, elapsed (None when unknown),
+        peak_rss_mb of the whole build, output and blocked_by.
+        """
+        built: Dict[str, Optional[float]] = {}
+        finished: Dict[str, float] = {}
+        failed: Set[str] = set()
+        sections: Dict[str, List[str]] = {}
+        current: List[Optional[str]] = [None]
+
+        def on_line(line: str):
+            match = PROGRESS_RE.match(line)
+            if match:
+                self._report(f"[{match.group(2)}/{match.group(3)}] {match.group(4)[:80]}")
+                step = STEP_RE.match(match.group(4))
+                current[0] = step.group(1) if step else None
+                if step is None:
+                    return
+                if match.group(1) == "✖":
+                    failed.add(step.group(1))
+                    finished[step.group(1)] = time.monotonic()
+                elif step.group(1) not in failed and not step.group(0).startswith("Building"):
+                    seconds = step.group(2)
+                    if seconds is not None:
+                        seconds = float(seconds) / (1000 if step.group(3) == "ms" else 1)
+                    built[step.group(1)] = seconds
+                    finished[step.group(1)] = time.monotonic()
+                return
+            item = FAILED_ITEM_RE.match(line)
+            if item:
+                failed.add(item.group(1))
+            elif current[0] is not None:
+                sections.setdefault(current[0], []).append(line)
+
+        start = time.monotonic()
+        result = self._run(["lake", "build"] + [f"+{t}" for t in targets], "targets", on_line)
+        peak = result["peak_rss_mb"]
+        output = result["stdout"].rstrip("\n")
+        if result["timed_out"] or result["cancelled"]:
+            return self._unfinished(targets, graph, built, finished, failed, sections, start, result, peak)
+        if result["returncode"] == 0:
+            return [self._result(t, "ok", built.get(t), peak, "") for t in targets]
+
+        results = []
+        for target in targets:
+            if target in failed:
+                results.append(self._result(target, "failed", built.get(target), peak, "\n".join(sections.get(target, []))))
+                continue
+            blocked = sorted(dependency_closure(graph, target) & failed)
+            if blocked:
+                entry = self._result(target, "skipped", None, peak, "")
+                entry["blocked_by"] = blocked
+                results.append(entry)
+            elif failed:
+                results.append(self._result(target, "ok", built.get(target), peak, ""))
+            else:
+                # Nothing to attribute the failure to (a lakefile or target error): report it on every target.
+                results.append(self._result(target, "failed", None, peak, output))
+        for module in sorted(failed - set(targets)):
+            results.append(self._result(module, "failed", None, peak, "\n".join(sections.get(module, []))))
+        return results
+
+    def _unfinished(
+        self,
+        targets: List[str],
+        graph: Dict[str, Set[str]],
+        built: Dict[str, Optional[float]],
+        finished: Dict[str, float],
+        failed: Set[str],
+        sections: Dict[str, List[str]],
+        start: float,
+        result: Dict[str, Any],
+        peak: float
+    ) -> List[Dict[str, Any]]:
+        """
+        Results of a build stopped early. Of the modules not done, those whose
+        imports were all done were still building: they timed out, after the
+        time since their last import finished. Modules importing one of them,
+        or a failed one, are skipped.
+        """
+        stopped = start + result["wait"] + result["elapsed"]
+        modules = set(targets)
+        for target in targets:
+            modules |= dependency_closure(graph, target)
+        pending = {m for m in modules if m not in finished}
+        building = {m for m in pending if not (dependency_closure(graph, m) & pending)}
+        unfinished = "timeout" if result["timed_out"] else "cancelled"
+        results = []
+        for target in targets:
+            if target in failed:
+                results.append(self._result(target, "failed", built.get(target), peak, "\n".join(sections.get(target, []))))
+            elif target in finished:
+                results.append(self._result(target, "ok", built.get(target), peak, ""))
+            elif target in building:
+                ready = max([finished.get(d, 0.0) for d in graph.get(target, ())] + [start + result["wait"]])
+                results.append(self._result(target, unfinished, stopped - ready, peak, ""))
+            else:
+                entry = self._result(target, "skipped", None, peak, "")
+                entry["blocked_by"] = sorted(dependency_closure(graph, target) & (building | failed))
+                results.append(entry)
+        for module in sorted(failed - set(targets)):
+            results.append(self._result(module, "failed", None, peak, "\n".join(sections.get(module, []))))
+        return results
+
+    @staticmethod
+    def _result(module: str, status: str, elapsed: Optional[float], peak: float, output: str) -> Dict[str, Any]:
+        return {"module": module, "status": status, "elapsed": elapsed, "peak_rss_mb": peak, "output": output}
+
+    def build_one(self, target: Optional[str]) -> Dict[str, Any]:
+        """Run `lake build` for one module (or the whole project) and collect its output."""
+        label = target or "lake build"
+
+        def on_line(line: str):
+            match = PROGRESS_RE.match(line)
+            if match:
+                self._report(f"{label}: [{match.group(2)}/{match.group(3)}] {match.group(4)[:80]}")
+
+        result = self._run(["lake", "build"] + ([f"+{target}"] if target else []), target or "all", on_line)
+        if result["timed_out"]:
+            status = "timeout"
+        elif result["cancelled"]:
+            status = "cancelled"
+        else:
+            status = "ok" if result["returncode"] == 0 else "failed"
+        return self._result(label, status, result["elapsed"], result["peak_rss_mb"], result["stdout"].rstrip("\n"))
+
+    def _run(self, command: List[str], log_name: str, on_line: Callable[[str], None]) -> Dict[str, Any]:
+        """
+        Run `command` through the scheduler, stopping it once no module has
+        finished for `timeout` seconds; that sets "timed_out" in the result.
+        """
+        log_path = os.path.join(self.root, LOG_DIR, f"lake_build__{log_name}.stream.log")
+        handle = threading.Event()
+        done = threading.Event()
+        stalled = threading.Event()
+        # Time of the latest finished module; None while the build waits for admission.
+        last_progress: List[Optional[float]] = [None]
+
+        def started():
+            last_progress[0] = time.monotonic()
+
+        def watch(line: str):
+            if PROGRESS_RE.match(line):
+                last_progress[0] = time.monotonic()
+            on_line(line)
+
+        def watchdog():
+            while not done.wait(1.0):
+                if last_progress[0] is not None and time.monotonic() - last_progress[0] > self.timeout:
+                    stalled.set()
+                    self.scheduler.cancel(handle)
+                    return
+
+        env = {"LEAN_NUM_THREADS": str(self.jobs)} if self.jobs > 0 else None
+        watcher = threading.Thread(target=watchdog, daemon=True)
+        try:
+            watcher.start()
+            result = self.scheduler.run(
+                "lake", command, session=os.path.abspath(self.root), cwd=self.root, deadline=self.deadline,
+                on_line=watch, log_path=log_path, handle=handle, env=env, on_start=started
+            )
+        except KeyboardInterrupt:
+            self.scheduler.cancel_all()
+            raise
+        finally:
+            done.set()
+        if stalled.is_set():
+            result["timed_out"], result["cancelled"] = True, False
+        return result
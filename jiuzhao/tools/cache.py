@@ -0,0 +1,234 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+from jiuzhao.config import CONFIG_DIR, get_lean_config
+
+CACHE_DIR = CONFIG_DIR / "cache" / "compile"
+STATS_FILE = CONFIG_DIR / "cache" / "compile_stats.json"
+
+IMPORT_RE = re.compile(r"^\s*import\s+(.+)$", re.MULTILINE)
+
+# Failures caused by the build state rather than the source: a missing or stale
+# .olean, an unknown package, a header that does not load. `lake build` fixes
+# them without changing any key, so they are never stored.
+ENVIRONMENT_ERROR_RE = re.compile(
+    r"object file .* does not exist"
+    r"|unknown (package|module prefix)"
+    r"|Failed to load imports"
+    r"|\.olean.*(invalid|incompatible|compiled with)"
+)
+
+PROJECT_MARKERS = ("lakefile.lean", "lakefile.toml", "lean-toolchain")
+
+# Stored outputs mention the checked path; it is swapped for this marker so an
+# identical file under another name still hits.
+PATH_MARKER = "\x00PATH\x00"
+
+
+def _hash_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def project_root(path: str) -> str:
+    """The nearest directory above `path` holding a Lake project, else the working directory."""
+    directory = os.path.dirname(os.path.abspath(path))
+    while True:
+        if any(os.path.exists(os.path.join(directory, m)) for m in PROJECT_MARKERS):
+            return directory
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return os.getcwd()
+        directory = parent
+
+
+def _path_re(path: str) -> "re.Pattern[str]":
+    """`path` where it starts a `path:line:col:` location, not wherever it occurs as a substring."""
+    return re.compile(rf"^{re.escape(path)}(?=:)", re.MULTILINE)
+
+
+def toolchain_fingerprint(root: str = ".") -> str:
+    """Identify the Lean toolchain and the pinned revisions of all Lake dependencies."""
+    parts = []
+    toolchain = os.path.join(root, "lean-toolchain")
+    if os.path.exists(toolchain):
+        with open(toolchain, "r") as f:
+            parts.append(f.read().strip())
+
+    manifest = os.path.join(root, "lake-manifest.json")
+    if os.path.exists(manifest):
+        try:
+            with open(manifest, "r") as f:
+                packages = json.load(f).get("packages", [])
+            parts.extend(f"{p.get('name')}@{p.get('rev')}" for p in packages)
+        except (OSError, ValueError):
+            parts.append(_hash_file(manifest))
+    return "|".join(parts)
+
+
+def resolve_imports(source: str, root: str = ".") -> List[Tuple[str, str]]:
+    """
+    Return (module, content_hash) for every project-local module imported by
+    `source`, transitively. Modules from Lake dependencies are covered by the
+    manifest revisions in toolchain_fingerprint instead.
+    """
+    resolved: Dict[str, str] = {}
+    pending = [m for line in IMPORT_RE.findall(source) for m in line.split()]
+    while pending:
+        module = pending.pop()
+        if module in resolved:
+            continue
+        path = os.path.join(root, *module.split(".")) + ".lean"
+        if not os.path.exists(path):
+            resolved[module] = ""
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        resolved[module] = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        pending.extend(m for line in IMPORT_RE.findall(text) for m in line.split())
+    return sorted(resolved.items())
+
+
+class CompileCache:
+    """
+    Content-addressed, on-disk cache of compile results.
+
+    Entries are JSON files named after the cache key. File mtimes double as
+    the LRU clock: hits touch the entry, and the oldest entries are evicted
+    once the cache holds more than `max_entries`.
+    """
+
+    def __init__(self, directory: Path = CACHE_DIR, max_entries: int = 2000):
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._fingerprints: Dict[str, str] = {}
+
+    def key(self, source: str, root: str = ".") -> str:
+        """Key of `source` checked in the project at `root`, whose imports it resolves against."""
+        root = os.path.abspath(root)
+        fingerprint = self._fingerprints.get(root)
+        if fingerprint is None:
+            fingerprint = self._fingerprints[root] = toolchain_fingerprint(root)
+        digest = hashlib.sha256()
+        digest.update(fingerprint.encode("utf-8"))
+        for module, content_hash in resolve_imports(source, root):
+            digest.update(f"\n{module}={content_hash}".encode("utf-8"))
+        digest.update(b"\n\x00")
+        digest.update(source.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str, path: str) -> Optional[Tuple[int, str]]:
+        entry = self.directory / f"{key}.json"
+        try:
+            with open(entry, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(entry)
+        except (OSError, ValueError):
+            self._count(hit=False)
+            return None
+        self._count(hit=True)
+        return data["returncode"], data["output"].replace(PATH_MARKER, path)
+
+    def put(self, key: str, path: str, returncode: int, output: str):
+        if ENVIRONMENT_ERROR_RE.search(output):
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = self.directory / f"{key}.json"
+        tmp = entry.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "returncode": returncode,
+                "output": _path_re(path).sub(PATH_MARKER, output),
+                "created": time.time()
+            }, f)
+        os.replace(tmp, entry)
+        self._evict()
+
+    def _evict(self):
+        entries = list(self.directory.glob("*.json"))
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda p: p.stat().st_mtime)
+        for p in entries[:len(entries) - self.max_entries]:
+            try:
+                p.unlink()
+            except OSError:
+                pass
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for this process plus the totals persisted across sessions."""
+        totals = load_stats()
+        entries = len(list(self.directory.glob("*.json")))
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_hits": totals.get("hits", 0) + self.hits,
+            "total_misses": totals.get("misses", 0) + self.misses,
+            "entries": entries,
+            "max_entries": self.max_entries
+        }
+
+    def flush_stats(self):
+        """Fold this process's counters into the persisted totals."""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = 0
+        if not hits and not misses:
+            return
+        totals = load_stats()
+        totals["hits"] = totals.get("hits", 0) + hits
+        totals["misses"] = totals.get("misses", 0) + misses
+        STATS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(STATS_FILE, "w") as f:
+            json.dump(totals, f)
+
+    def clear(self):
+        for p in self.directory.glob("*.json"):
+            try:
+                p.unlink()
+            except OSError:
+                pass
+        self.hits = self.misses = 0
+
+
+def load_stats() -> Dict[str, int]:
+    if STATS_FILE.exists():
+        try:
+            with open(STATS_FILE, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    return {}
+
+
+_cache: Optional[CompileCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_compile_cache() -> Optional[CompileCache]:
+    """Return the process-wide compile cache, or None if caching is disabled."""
+    global _cache
+    lean_config = get_lean_config()
+    if not lean_config.get("cache", True):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = CompileCache(max_entries=lean_config.get("cache_max_entries", 2000))
+            atexit.register(_cache.flush_stats)
+    return _cache
@@ -0,0 +1,208 @@
+import os
+import re
+from typing import Dict, Any, List, Optional, Tuple
+
+# `path:line:col: severity: message` as printed by `lean` and format_messages;
+# Lake prints `severity: path:line:col: message` instead.
+HEADER_RE = re.compile(
+    r"^(?:(?P<prefix>error|warning|info): )?(?P<path>[^\s:][^:\n]*\.lean):(?P<line>\d+):(?P<column>\d+): "
+    r"(?:(?P<severity>error|warning|information|info)(?:\([^)\n]*\))?: ?)?(?P<message>.*)$"
+)
+# Lake progress and summary lines; they end a message but are not diagnostics.
+LAKE_NOISE_RE = re.compile(
+    r"^(?:[✖⚠✔ℹ] \[\d+/\d+\]|trace: |Build completed|Some required builds|- \S+$|error: (?:Lean exited|build failed))"
+)
+# A located-less Lake or toolchain error, e.g. `error: unknown package 'Mathlib'`.
+BARE_ERROR_RE = re.compile(r"^error: (?P<message>.+)$")
+
+SEVERITY_RANK = {"error": 0, "warning": 1, "info": 2}
+LINE_WIDTH = 160
+MAX_GOALS = 3
+# Budget of every diagnostic after the first error; they are usually consequences of it.
+FOLLOWUP_CHARS = 300
+LOG_DIR = os.path.join(".jiuzhao", "logs")
+
+
+def parse_diagnostics(output: str) -> List[Dict[str, Any]]:
+    """
+    Split compiler output into {"path", "line", "column", "severity",
+    "message"} records. Continuation lines (goal states, expected types)
+    belong to the message above them.
+    """
+    diagnostics: List[Dict[str, Any]] = []
+    current: Optional[Dict[str, Any]] = None
+    for raw in output.splitlines():
+        match = HEADER_RE.match(raw)
+        if match:
+            severity = match.group("severity") or match.group("prefix") or "error"
+            current = {
+                "path": match.group("path"),
+                "line": int(match.group("line")),
+                "column": int(match.group("column")),
+                "severity": "info" if severity == "information" else severity,
+                "message": match.group("message")
+            }
+            diagnostics.append(current)
+        elif LAKE_NOISE_RE.match(raw):
+            current = None
+        elif BARE_ERROR_RE.match(raw):
+            current = {"path": None, "line": 0, "column": 0, "severity": "error", "message": BARE_ERROR_RE.match(raw).group("message")}
+            diagnostics.append(current)
+        elif current is not None:
+            current["message"] += "\n" + raw
+    for d in diagnostics:
+        d["message"] = d["message"].rstrip()
+    return diagnostics
+
+
+def _shorten_line(line: str, width: int = LINE_WIDTH) -> str:
+    if len(line) <= width:
+        return line
+    head = (width - 1) * 2 // 3
+    return line[:head] + "…" + line[len(line) - (width - 1 - head):]
+
+
+def truncate_goals(message: str, limit: int) -> str:
+    """
+    Fit a message into `limit` characters, keeping what a repair needs: the
+    first line, every `case` and `⊢` line of the first MAX_GOALS goals, and
+    as many hypotheses as fit, the ones nearest each target first.
+    """
+    lines = [_shorten_line(line) for line in message.split("\n")]
+    targets = [i for i, line in enumerate(lines) if line.lstrip().startswith("⊢")]
+    if len(targets) > MAX_GOALS:
+        more = len(targets) - MAX_GOALS
+        lines = lines[:targets[MAX_GOALS - 1] + 1] + [f"… {more} more goal{'s' if more > 1 else ''}"]
+    text = "\n".join(lines)
+    if len(text) <= limit:
+        return text
+
+    keep = [True] * len(lines)
+    # Hypotheses are dropped from the top of each goal: later ones (from `intro`,
+    # `obtain`, ...) are the ones the current step is about.
+    droppable = [
+        i for i, line in enumerate(lines)
+        if i > 0 and line.strip() and not line.lstrip().startswith(("⊢", "case ", "…"))
+    ]
+    size = len(text)
+    for i in droppable:
+        if size <= limit:
+            break
+        keep[i] = False
+        size -= len(lines[i]) + 1
+
+    kept: List[str] = []
+    omitted = 0
+    for line, k in zip(lines, keep):
+        if not k:
+            omitted += 1
+            continue
+        if omitted:
+            kept.append(f"  … {omitted} hypothes{'es' if omitted > 1 else 'is'} omitted")
+            omitted = 0
+        kept.append(line)
+    if omitted:
+        kept.append(f"  … {omitted} lines omitted")
+    text = "\n".join(kept)
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def _group(diagnostics: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], List[int]]]:
+    """
+    Collapse identical diagnostics (same severity, path and whole message, up
+    to whitespace); keeps the first and lists every line. Messages that only
+    share a first line, such as two `unsolved goals` with different goals,
+    stay apart.
+    """
+    groups: Dict[Tuple[str, str, str], Tuple[Dict[str, Any], List[int]]] = {}
+    for d in diagnostics:
+        key = (d["severity"], d["path"] or "", " ".join(d["message"].split()))
+        if key in groups:
+            groups[key][1].append(d["line"])
+        else:
+            groups[key] = (d, [d["line"]])
+    return sorted(groups.values(), key=lambda g: (SEVERITY_RANK.get(g[0]["severity"], 3), g[0]["line"], g[0]["column"]))
+
+
+def _display_path(path: str, root: str) -> str:
+    """Paths inside `root` are shown the way the model names them, relative to it."""
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+    return os.path.normpath(path) if relative.startswith("..") else relative
+
+
+def _count(n: int, noun: str) -> str:
+    return f"{n} {noun}{'s' if n != 1 else ''}"
+
+
+def format_report(
+    diagnostics: List[Dict[str, Any]],
+    root: str = ".",
+    max_chars: int = 4000,
+    goal_chars: int = 1500
+) -> Tuple[str, str]:
+    """
+    Rank and compact parsed diagnostics. Returns (summary line, body): errors
+    first in source order, the first error with up to `goal_chars` of goal
+    state, later ones shorter, repeats folded into one entry, and the whole
+    body cut at `max_chars`.
+    """
+    counts: Dict[str, int] = {}
+    for d in diagnostics:
+        counts[d["severity"]] = counts.get(d["severity"], 0) + 1
+    summary = ", ".join(_count(counts[s], s) for s in ("error", "warning", "info") if counts.get(s))
+
+    entries: List[str] = []
+    size = 0
+    groups = _group(diagnostics)
+    for n, (d, lines) in enumerate(groups):
+        location = f"{_display_path(d['path'], root)}:{d['line']}:{d['column']}: " if d["path"] else ""
+        unique = sorted(set(lines))
+        shown = ", ".join(map(str, unique[:8])) + (", …" if len(unique) > 8 else "")
+        repeats = f" (×{len(lines)}, lines {shown})" if len(lines) > 1 else ""
+        budget = goal_chars if n == 0 else FOLLOWUP_CHARS
+        entry = f"{location}{d['severity']}: {truncate_goals(d['message'], budget)}{repeats}"
+        if entries and size + len(entry) > max_chars:
+            entries.append(f"… {len(groups) - n} more (see the full log)")
+            break
+        entries.append(entry)
+        size += len(entry) + 1
+    return summary, "\n".join(entries)
+
+
+def write_log(root: str, display_path: str, output: str) -> str:
+    """Save full compiler output under `root` and return its root-relative path, readable with file_system."""
+    name = display_path.replace("/", "__").replace(os.sep, "__") + ".log"
+    relative = os.path.join(LOG_DIR, name)
+    full = os.path.join(root, relative)
+    os.makedirs(os.path.dirname(full), exist_ok=True)
+    with open(full, "w", encoding="utf-8") as f:
+        f.write(output)
+    return relative
+
+
+def compact_output(
+    output: str,
+    root: str,
+    display_path: str,
+    max_chars: int = 4000,
+    goal_chars: int = 1500
+) -> str:
+    """
+    The text sent to the model for failed compiler output: a count line naming
+    the full log, then the ranked diagnostics. Output that does not parse into
+    diagnostics is cut in the middle instead.
+    """
+    diagnostics = parse_diagnostics(output)
+    try:
+        log = write_log(root, display_path, output)
+    except OSError:
+        log = None
+    where = f"full log: {log}" if log else "full log unavailable"
+    if not diagnostics:
+        lines = _count(len(output.splitlines()), "line")
+        if len(output) > max_chars:
+            half = max_chars // 2
+            output = f"{output[:half]}\n…\n{output[-half:]}"
+        return f"{lines} of unrecognized output ({where})\n{output}"
+    summary, body = format_report(diagnostics, root, max_chars, goal_chars)
+    return f"{summary} ({where})\n{body}"
@@ -1,26 +1,46 @@
 import os
-from typing import Dict, Any
+from typing import Callable, Dict, Any, Optional
 from .base import BaseTool
+from .patch import PatchConflict, apply_hunks, atomic_write, join_lines, parse_unified_diff, split_lines, unified_diff
+
+# Lines returned by one read_lines call when no end is given.
+DEFAULT_READ_LINES = 200
 
 class FileSystemTool(BaseTool):
+    def __init__(self, root: str = "."):
+        # Relative paths from the model resolve against this directory.
+        self.root = root
+        # Called with (path, content) after every successful write or edit.
+        self.on_write: Optional[Callable[[str, str], None]] = None
+
     @property
     def name(self) -> str:
         return "file_system"
 
     @property
     def description(self) -> str:
-        return "Read, write, or list files in the project directory."
+        return (
+            "Read (whole files or line ranges), write, edit or list files in the project directory. "
+            "To change an existing file prefer `replace` or `patch` over rewriting it; edits return only the changed hunks."
+        )
 
     @property
     def usage(self) -> str:
         return """<TOOL name="file_system">
 {
-  "action": "read" | "write" | "list",
+  "action": "read" | "read_lines" | "write" | "replace" | "patch" | "list",
   "path": "path/to/file_or_dir",
-  "content": "content to write (only for write action)"
+  "content": "content to write (only for write action)",
+  "start": 10, "end": 40 (read_lines: 1-based, inclusive; output is numbered),
+  "old": "exact text to replace", "new": "replacement text",
+  "count": 1 (replace, optional: how many occurrences of 'old' are expected),
+  "diff": "@@ -12,3 +12,3 @@ unified diff hunks (patch)"
 }
 </TOOL>"""
 
+    def is_read_only(self, args: Dict[str, Any]) -> bool:
+        return args.get("action") in ("read", "read_lines", "list")
+
     def execute(self, args: Dict[str, Any]) -> str:
         action = args.get("action")
         path = args.get("path", ".")
@@ -28,31 +48,51 @@ class FileSystemTool(BaseTool):
         # Basic security check
         if ".." in path or path.startswith("/"):
             return "Error: Access denied. Please use relative paths within the project."
+        display_path = path
+        path = os.path.normpath(os.path.join(self.root, path))
 
         if action == "write":
             content = args.get("content", "")
             try:
-                # Ensure directory exists
-                os.makedirs(os.path.dirname(path) if os.path.dirname(path) else ".", exist_ok=True)
-                with open(path, "w", encoding="utf-8") as f:
-                    f.write(content)
-                return f"Successfully wrote to {path}."
+                atomic_write(path, content)
+                self._written(path, content)
+                return f"Successfully wrote to {display_path}."
             except Exception as e:
                 return f"Write failed: {str(e)}"
         
         elif action == "read":
             if not os.path.exists(path):
-                return f"Error: File {path} does not exist."
+                return f"Error: File {display_path} does not exist."
             try:
                 with open(path, "r", encoding="utf-8") as f:
                     return f.read()
             except Exception as e:
                 return f"Read failed: {str(e)}"
+
+        elif action == "read_lines":
+            if not os.path.exists(path):
+                return f"Error: File {display_path} does not exist."
+            try:
+                return self._read_lines(path, display_path, args)
+            except (TypeError, ValueError):
+                return "Error: 'start' and 'end' must be line numbers."
+            except Exception as e:
+                return f"Read failed: {str(e)}"
+
+        elif action in ("replace", "patch"):
+            if not os.path.exists(path):
+                return f"Error: File {display_path} does not exist."
+            try:
+                return self._edit(path, display_path, action, args)
+            except PatchConflict as e:
+                return f"Error: Edit not applied to {display_path}: {e}"
+            except Exception as e:
+                return f"Edit failed: {str(e)}"
         
         elif action == "list":
             try:
                 if not os.path.exists(path):
-                    return f"Error: Directory {path} does not exist."
+                    return f"Error: Directory {display_path} does not exist."
                 
                 files = []
                 for item in os.listdir(path):
@@ -64,4 +104,61 @@ class FileSystemTool(BaseTool):
             except Exception as e:
                 return f"List failed: {str(e)}"
         
-        return "Error: Invalid action. Use 'read', 'write', or 'list'."
+        return "Error: Invalid action. Use 'read', 'read_lines', 'write', 'replace', 'patch', or 'list'."
+
+    def _read_lines(self, path: str, display_path: str, args: Dict[str, Any]) -> str:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        start = max(1, int(args.get("start", 1)))
+        end = min(len(lines), int(args.get("end", start + DEFAULT_READ_LINES - 1)))
+        if start > len(lines):
+            return f"{display_path} has only {len(lines)} lines."
+        width = len(str(end))
+        numbered = [f"{n:>{width}}| {lines[n - 1]}" for n in range(start, end + 1)]
+        return f"{display_path} lines {start}-{end} of {len(lines)}:\n" + "\n".join(numbered)
+
+    def _written(self, path: str, content: str):
+        if self.on_write is not None:
+            self.on_write(path, content)
+
+    def _edit(self, path: str, display_path: str, action: str, args: Dict[str, Any]) -> str:
+        """Apply a replace or patch edit in one atomic write and return the resulting diff."""
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, "r", encoding="utf-8") as f:
+            old = f.read()
+
+        if action == "replace":
+            target, replacement = args.get("old"), args.get("new")
+            if not target or replacement is None:
+                return "Error: 'old' and 'new' are required for replace."
+            expected = int(args.get("count", 1))
+            found = old.count(target)
+            if found != expected:
+                raise PatchConflict(self._replace_mismatch(old, target, found, expected))
+            new = old.replace(target, replacement)
+        else:
+            if not args.get("diff"):
+                return "Error: 'diff' is required for patch."
+            hunks = parse_unified_diff(args["diff"])
+            lines, trailing_newline = split_lines(old)
+            new = join_lines(apply_hunks(lines, hunks), trailing_newline)
+
+        if new == old:
+            return f"No changes: the edit leaves {display_path} as it was."
+        atomic_write(path, new, expected_mtime=mtime)
+        self._written(path, new)
+        diff = unified_diff(display_path, old, new)
+        added = sum(1 for line in diff.splitlines() if line.startswith("+") and not line.startswith("+++"))
+        removed = sum(1 for line in diff.splitlines() if line.startswith("-") and not line.startswith("---"))
+        return f"Successfully edited {display_path} (+{added} -{removed}):\n{diff}"
+
+    @staticmethod
+    def _replace_mismatch(text: str, target: str, found: int, expected: int) -> str:
+        if found:
+            return f"'old' occurs {found} times, expected {expected}; include more surrounding text or set 'count'"
+        # Say where a near miss is, e.g. a difference only in indentation or trailing spaces.
+        first = target.strip().splitlines()[0].strip() if target.strip() else ""
+        for n, line in enumerate(text.splitlines(), 1):
+            if first and line.strip() == first:
+                return f"'old' not found; its first line appears at line {n} but the text differs (check indentation and spacing)"
+        return "'old' not found; read the file again for its current text"
@@ -2,6 +2,8 @@ import os
 import subprocess
 import json
 from typing import Dict, Any
+from jiuzhao.config import get_lean_config
+from jiuzhao.tools.lean import compile_lean_file
 
 class ToolRegistry:
     def __init__(self):
@@ -66,20 +68,12 @@ class ToolRegistry:
         if not os.path.exists(path):
             return f"Error: File {path} not found."
 
-        cmd = ["lean", path]
-        
         try:
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
+            returncode, output = compile_lean_file(path, timeout=get_lean_config().get("request_timeout", 30))
             
-            if result.returncode == 0:
+            if returncode == 0:
                 return "SUCCESS: Proof Verified."
             else:
-                output = (result.stderr + "\n" + result.stdout).strip()
                 return f"COMPILER ERROR:\n{output}"
                 
         except subprocess.TimeoutExpired:
@@ -0,0 +1,541 @@
+import hashlib
+import heapq
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from array import array
+from pathlib import Path
+from typing import Callable, Dict, Any, Iterable, List, Optional, Set, Tuple
+from jiuzhao.config import CONFIG_DIR
+
+INDEX_DIR = CONFIG_DIR / "index"
+
+# Directories never worth indexing, besides hidden ones. `.lake/packages` and
+# `lake-packages` are walked separately as dependency sources.
+SKIP_DIRS = {"lake-packages", "build", "__pycache__"}
+DEPENDENCY_DIRS = (os.path.join(".lake", "packages"), "lake-packages")
+
+DECL_RE = re.compile(
+    r"^\s*(?:@\[[^\]]*\]\s*)*(?:(?:private|protected|noncomputable|partial|unsafe)\s+)*"
+    r"(?:theorem|lemma|def|abbrev|instance|structure|class|inductive|axiom|opaque)\s+([^\s:({\[]+)"
+)
+IDENT_CHARS = r"\w'."
+
+# Bumped whenever the schema changes; an older index is dropped and rebuilt.
+SCHEMA_VERSION = 2
+# Files written per transaction, so a long indexing run never holds the write lock for long.
+BATCH_FILES = 500
+# Candidate ids fetched per query while scanning stored contents.
+FETCH_CHUNK = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    dependency INTEGER NOT NULL,
+    live INTEGER NOT NULL DEFAULT 1,
+    content BLOB
+);
+CREATE INDEX IF NOT EXISTS files_live_path ON files (live, path);
+CREATE TABLE IF NOT EXISTS postings (
+    trigram TEXT PRIMARY KEY,
+    ids BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS decls (
+    file_id INTEGER NOT NULL,
+    line INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS decls_file ON decls (file_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def default_index_path(root: str = ".") -> Path:
+    digest = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:16]
+    return INDEX_DIR / f"{digest}.db"
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# A `{m}`, `{m,}`, `{,n}` or `{m,n}` quantifier.
+REPEAT_RE = re.compile(r"\{(\d*)(?:,(\d*))?\}")
+
+
+def _optional_quantifier(pattern: str, i: int) -> Optional[bool]:
+    """Whether the quantifier at `i` allows zero repetitions; None for `{` that is not a quantifier."""
+    if pattern[i] in "?*":
+        return True
+    if pattern[i] == "+":
+        return False
+    match = REPEAT_RE.match(pattern, i)
+    if not match or match.group(0) == "{,}":
+        return None
+    return match.group(1) in ("", "0") or int(match.group(1)) == 0
+
+
+def required_literals(pattern: str) -> List[str]:
+    """
+    Extract literal runs that every match of `pattern` must contain, for
+    trigram prefiltering. Returns [] when no safe prefilter exists, so the
+    query falls back to a full scan.
+
+    >>> required_literals("foo(bar)?baz")
+    ['foo', 'baz']
+    >>> required_literals("a{2,3}bcdef")
+    ['bcdef']
+    >>> required_literals("x{3}yz")
+    []
+    >>> required_literals("Nat.succ_le(_of)+_lt")
+    ['Nat', 'succ_le', '_of', '_lt']
+    """
+    if "|" in pattern:
+        return []
+    # Finished runs per open group, innermost last; a group's runs count once it closes un-optional.
+    groups: List[List[str]] = [[]]
+    current = ""
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\" and i + 1 < len(pattern):
+            nxt = pattern[i + 1]
+            if nxt.isalnum():
+                groups[-1].append(current)
+                current = ""
+            else:
+                current += nxt
+            i += 2
+            continue
+        if ch in "?*+{":
+            optional = _optional_quantifier(pattern, i)
+            if optional is None:
+                return []
+            if ch == "{":
+                i = REPEAT_RE.match(pattern, i).end() - 1
+            if optional:
+                # The preceding atom is optional, so it cannot be required.
+                current = current[:-1]
+            groups[-1].append(current)
+            current = ""
+            if i + 1 < len(pattern) and pattern[i + 1] in "?+":
+                i += 1  # lazy or possessive
+        elif ch == "(":
+            if pattern.startswith("(?", i):
+                if not pattern.startswith("(?:", i):
+                    return []  # lookaround, flags or named groups
+                i += 2
+            groups[-1].append(current)
+            current = ""
+            groups.append([])
+        elif ch == ")":
+            if len(groups) == 1:
+                return []
+            groups[-1].append(current)
+            current = ""
+            inner = groups.pop()
+            optional = _optional_quantifier(pattern, i + 1) if i + 1 < len(pattern) and pattern[i + 1] in "?*+{" else False
+            if optional is None:
+                return []
+            if not optional:
+                groups[-1].extend(inner)
+        elif ch == "[":
+            j = i + 1
+            if pattern.startswith("^", j):
+                j += 1
+            if pattern.startswith("]", j):
+                j += 1
+            while j < len(pattern) and pattern[j] != "]":
+                j += 2 if pattern[j] == "\\" else 1
+            if j >= len(pattern):
+                return []
+            i = j
+            groups[-1].append(current)
+            current = ""
+        elif ch in ".^$":
+            groups[-1].append(current)
+            current = ""
+        else:
+            current += ch
+        i += 1
+    if len(groups) != 1:
+        return []
+    groups[0].append(current)
+    return [r for r in groups[0] if len(r) >= 3]
+
+
+def walk_sources(
+    root: str = ".",
+    include_project: bool = True,
+    include_dependencies: bool = True
+) -> Iterable[Tuple[str, bool]]:
+    """Yield (relative_path, is_dependency) for every `.lean` source under `root`."""
+    if include_project:
+        for dirpath, dirs, files in os.walk(root):
+            dirs[:] = [d for d in dirs if not d.startswith(".") and d not in SKIP_DIRS]
+            for name in files:
+                if name.endswith(".lean"):
+                    yield os.path.relpath(os.path.join(dirpath, name), root), False
+
+    if not include_dependencies:
+        return
+    for dep_dir in DEPENDENCY_DIRS:
+        base = os.path.join(root, dep_dir)
+        if not os.path.isdir(base):
+            continue
+        for dirpath, dirs, files in os.walk(base):
+            dirs[:] = [d for d in dirs if d not in (".git", ".lake", "build")]
+            for name in files:
+                if name.endswith(".lean"):
+                    yield os.path.relpath(os.path.join(dirpath, name), root), True
+
+
+class SearchIndex:
+    """
+    Persistent trigram index over the `.lean` sources of a project and its Lake
+    dependencies, stored in SQLite.
+
+    Postings map each trigram to the ids of files containing it. Each file's
+    text is stored compressed alongside, and its declaration lines in a table
+    of their own, so queries never touch the source tree. Updates are
+    incremental on (mtime, size): a changed file gets a fresh id and its old id
+    is tombstoned rather than removed from every posting list; `jiuzhao index`
+    rebuilds the postings once tombstones outnumber a quarter of the live files.
+    """
+
+    def __init__(self, root: str = ".", db_path: Optional[Path] = None):
+        self.root = root
+        self.db_path = Path(db_path or default_index_path(root))
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Transactions are explicit; a background writer may hold the database for one batch.
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            for table in ("files", "postings", "decls", "meta"):
+                self._conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._background: Optional[threading.Thread] = None
+
+    def close(self):
+        self._conn.close()
+
+    # --- Building ---
+
+    def refresh(
+        self,
+        include_dependencies: bool = True,
+        progress: Optional[Callable[[int], None]] = None,
+        include_project: bool = True
+    ) -> Dict[str, int]:
+        """
+        Bring the index up to date with the files on disk. Files outside the
+        included scopes are left as indexed.
+        """
+        scope = []
+        if not include_project:
+            scope.append("dependency = 1")
+        if not include_dependencies:
+            scope.append("dependency = 0")
+        with self._lock:
+            known = {
+                path: (file_id, mtime, size)
+                for file_id, path, mtime, size in self._conn.execute(
+                    "SELECT id, path, mtime, size FROM files WHERE live = 1"
+                    + "".join(f" AND {condition}" for condition in scope)
+                )
+            }
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        batch: List[Tuple[str, bool, os.stat_result, str, Optional[int]]] = []
+        seen = set()
+
+        for count, (path, dependency) in enumerate(walk_sources(self.root, include_project, include_dependencies)):
+            seen.add(path)
+            try:
+                st = os.stat(os.path.join(self.root, path))
+            except OSError:
+                continue
+            previous = known.get(path)
+            if previous and previous[1] == st.st_mtime and previous[2] == st.st_size:
+                stats["unchanged"] += 1
+                continue
+
+            try:
+                with open(os.path.join(self.root, path), "r", encoding="utf-8") as f:
+                    text = f.read()
+            except (OSError, UnicodeDecodeError):
+                continue
+
+            stats["updated" if previous else "added"] += 1
+            batch.append((path, dependency, st, text, previous[0] if previous else None))
+            if len(batch) >= BATCH_FILES:
+                self._write_batch(batch, [])
+                batch = []
+            if progress and count % 500 == 0:
+                progress(count)
+
+        removed = [file_id for path, (file_id, _, _) in known.items() if path not in seen]
+        stats["removed"] = len(removed)
+        self._write_batch(batch, removed)
+        if include_dependencies:
+            self._set_meta("dependencies_indexed", "1")
+        return stats
+
+    def _write_batch(self, batch: List[Tuple[str, bool, os.stat_result, str, Optional[int]]], removed: List[int]):
+        """Store one batch of read files and tombstone replaced or removed ones, in a single transaction."""
+        if not batch and not removed:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                stale = removed + [previous for *_, previous in batch if previous is not None]
+                for file_id in stale:
+                    self._tombstone(file_id)
+                new_postings: Dict[str, array] = {}
+                for path, dependency, st, text, _ in batch:
+                    file_id = self._conn.execute(
+                        "INSERT INTO files (path, mtime, size, dependency, content) VALUES (?, ?, ?, ?, ?)",
+                        (path, st.st_mtime, st.st_size, int(dependency), zlib.compress(text.encode("utf-8")))
+                    ).lastrowid
+                    self._conn.executemany(
+                        "INSERT INTO decls (file_id, line, text) VALUES (?, ?, ?)",
+                        [(file_id, i + 1, line) for i, line in enumerate(text.split("\n")) if DECL_RE.match(line)]
+                    )
+                    for tri in trigrams(text):
+                        new_postings.setdefault(tri, array("I")).append(file_id)
+                self._merge_postings(new_postings)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _tombstone(self, file_id: int):
+        self._conn.execute("UPDATE files SET live = 0, content = NULL WHERE id = ?", (file_id,))
+        self._conn.execute("DELETE FROM decls WHERE file_id = ?", (file_id,))
+
+    def _merge_postings(self, new_postings: Dict[str, array]):
+        for tri, ids in new_postings.items():
+            row = self._conn.execute("SELECT ids FROM postings WHERE trigram = ?", (tri,)).fetchone()
+            if row:
+                merged = array("I")
+                merged.frombytes(row[0])
+                merged.extend(ids)
+                ids = merged
+            self._conn.execute(
+                "INSERT OR REPLACE INTO postings (trigram, ids) VALUES (?, ?)", (tri, ids.tobytes())
+            )
+
+    def _set_meta(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def needs_compaction(self) -> bool:
+        with self._lock:
+            live, dead = self._conn.execute(
+                "SELECT SUM(live = 1), SUM(live = 0) FROM files"
+            ).fetchone()
+        return bool(dead) and dead > max(live or 0, 1) / 4
+
+    def rebuild(self, progress: Optional[Callable[[int], None]] = None) -> Dict[str, int]:
+        """Drop everything and index the tree from scratch."""
+        with self._lock:
+            for table in ("files", "postings", "decls", "meta"):
+                self._conn.execute(f"DELETE FROM {table}")
+        stats = self.refresh(include_dependencies=True, progress=progress)
+        with self._lock:
+            self._conn.execute("VACUUM")
+        return stats
+
+    def file_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files WHERE live = 1").fetchone()[0]
+
+    def index_dependencies_in_background(self) -> bool:
+        """
+        Index the dependency sources on a background thread, with a connection
+        of its own, unless they have been indexed before. Returns whether
+        indexing is (still) running.
+        """
+        with self._lock:
+            if self._background is not None:
+                return self._background.is_alive()
+        if self._get_meta("dependencies_indexed"):
+            return False
+
+        def run():
+            index = SearchIndex(self.root, self.db_path)
+            try:
+                index.refresh(include_dependencies=True, include_project=False)
+            except sqlite3.Error:
+                pass  # left for `jiuzhao index`
+            finally:
+                index.close()
+
+        with self._lock:
+            if self._background is None:
+                self._background = threading.Thread(target=run, name="jiuzhao-index", daemon=True)
+                self._background.start()
+            return self._background.is_alive()
+
+    # --- Querying ---
+
+    def _candidates(self, literals: List[str]) -> Optional[Set[int]]:
+        """Ids of files containing every trigram of every literal, or None for 'all files'."""
+        needed = set()
+        for literal in literals:
+            needed |= trigrams(literal)
+        if not needed:
+            return None
+
+        lists = []
+        for tri in needed:
+            row = self._conn.execute("SELECT ids FROM postings WHERE trigram = ?", (tri,)).fetchone()
+            if not row:
+                return set()
+            ids = array("I")
+            ids.frombytes(row[0])
+            lists.append(ids)
+        lists.sort(key=len)
+        result = set(lists[0])
+        for ids in lists[1:]:
+            result.intersection_update(ids)
+            if not result:
+                break
+        return result
+
+    def search(self, query: str, mode: str = "substring", limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Search indexed sources. `mode` is "substring", "prefix" (identifier or
+        name-component prefix) or "regex". Returns ranked match records.
+
+        Declaration lines always outrank other lines, so they are ranked first
+        from the declaration table; other lines are scanned only when fewer
+        than `limit` declarations match. A query without a trigram to filter
+        on (shorter than three characters, or a regex without a literal) only
+        matches declaration lines.
+        """
+        if mode == "regex":
+            matcher = re.compile(query)
+            literals = required_literals(query)
+        elif mode == "prefix":
+            matcher = re.compile(rf"(?<![\w']){re.escape(query)}")
+            literals = [query]
+        else:
+            matcher = None
+            literals = [query]
+
+        def locate(line: str) -> int:
+            if matcher is None:
+                return line.find(query)
+            found = matcher.search(line)
+            return found.start() if found else -1
+
+        word_re = re.compile(rf"(?<![{IDENT_CHARS}]){re.escape(query)}(?![\w'])") if mode != "regex" else None
+        matches: List[Dict[str, Any]] = []
+
+        def offer(path: str, line_no: int, line: str, dependency: int, start: int):
+            matches.append({
+                "path": path,
+                "line": line_no,
+                "text": line.strip(),
+                "dependency": bool(dependency),
+                "score": self._score(line, start, query, word_re, dependency)
+            })
+            if len(matches) >= 4 * limit:
+                matches[:] = self._top(matches, limit)
+
+        with self._lock:
+            candidates = self._candidates(literals)
+            if candidates is not None and not candidates:
+                return []
+            sql = (
+                "SELECT d.file_id, f.path, f.dependency, d.line, d.text FROM decls d "
+                "JOIN files f ON f.id = d.file_id WHERE f.live = 1"
+            )
+            if mode == "regex":
+                declarations = self._conn.execute(sql).fetchall()
+            else:
+                declarations = self._conn.execute(sql + " AND instr(d.text, ?) > 0", (query,)).fetchall()
+
+        for file_id, path, dependency, line_no, line in declarations:
+            if candidates is not None and file_id not in candidates:
+                continue
+            start = locate(line)
+            if start != -1:
+                offer(path, line_no, line, dependency, start)
+        if candidates is None or len(matches) >= limit:
+            return self._top(matches, limit)
+
+        ids = sorted(candidates)
+        for i in range(0, len(ids), FETCH_CHUNK):
+            chunk = ids[i:i + FETCH_CHUNK]
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT path, dependency, content FROM files WHERE live = 1 AND id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+            for path, dependency, content in rows:
+                if content is None:
+                    continue
+                for line_no, line in enumerate(zlib.decompress(content).decode("utf-8").split("\n"), 1):
+                    if DECL_RE.match(line):
+                        continue  # ranked above
+                    start = locate(line)
+                    if start != -1:
+                        offer(path, line_no, line, dependency, start)
+        return self._top(matches, limit)
+
+    @staticmethod
+    def _top(matches: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+        return heapq.nsmallest(limit, matches, key=lambda m: (-m["score"], m["path"], m["line"]))
+
+    @staticmethod
+    def _score(line: str, start: int, query: str, word_re, dependency: int) -> float:
+        # A declaration line scores above 3 and any other line at most 3.
+        score = 0.0
+        decl = DECL_RE.match(line)
+        if decl:
+            score += 4
+            name = decl.group(1)
+            if name == query or name.endswith("." + query):
+                score += 4
+            elif decl.start(1) <= start < decl.end(1):
+                score += 2
+        if word_re is not None and word_re.search(line):
+            score += 2
+        if not dependency:
+            score += 1
+        return score - min(len(line), 400) / 500
+
+
+_indexes: Dict[str, SearchIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_search_index(root: str = ".") -> SearchIndex:
+    """
+    Return the shared index for `root`. Dependency sources never indexed
+    before are indexed in the background; `jiuzhao index` does it up front.
+    """
+    key = os.path.abspath(root)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = SearchIndex(root)
+            _indexes[key] = index
+    index.index_dependencies_in_background()
+    return index
@@ -1,9 +1,127 @@
+import json
 import os
 import subprocess
-from typing import Dict, Any
+import threading
+import time
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from jiuzhao.config import get_lean_config, get_search_config
 from .base import BaseTool
+from .automation import Automation
+from .build import LakeBuilder, affected_modules, import_graph, module_name
+from .cache import get_compile_cache, project_root
+from .diagnostics import LOG_DIR, compact_output
+from .repl import CheckCancelled, LeanHeaderError, LeanReplError, format_messages, get_repl_pool
+from .scheduler import get_scheduler
+from .speculative import SpeculativeChecker
+
+
+def compile_lean_file(
+    path: str,
+    timeout: float,
+    incremental: Optional[bool] = None,
+    cancel: Optional[threading.Event] = None,
+    repl: bool = True
+) -> Tuple[int, str]:
+    """
+    Compile a single Lean file and return (returncode, output).
+
+    Uses a warm REPL worker when one is available (and `repl` is set) and
+    falls back to a fresh `lean <path>` process otherwise. In incremental mode
+    the REPL only re-elaborates declarations from the first changed one
+    onward; it defaults to the `lean.incremental` setting. cancel_checks
+    (`cancel`) stops the check: the REPL worker serving it or its `lean`
+    process is killed. Raises subprocess.TimeoutExpired and FileNotFoundError
+    like subprocess.run does, and CheckCancelled.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        source = f.read()
+
+    cache = get_compile_cache()
+    key = None
+    if cache is not None:
+        key = cache.key(source, project_root(path))
+        cached = cache.get(key, path)
+        if cached is not None:
+            return cached
+
+    if incremental is None:
+        incremental = get_lean_config().get("incremental", True)
+    returncode, output = _compile_source(path, source, timeout, incremental, cancel, repl)
+    if key is not None:
+        cache.put(key, path, returncode, output)
+    return returncode, output
+
+
+def _compile_source(
+    path: str,
+    source: str,
+    timeout: float,
+    incremental: bool,
+    cancel: Optional[threading.Event] = None,
+    repl: bool = True
+) -> Tuple[int, str]:
+    pool = get_repl_pool() if repl else None
+    if pool is not None:
+        try:
+            response, offset = pool.check(source, timeout, incremental, cancel)
+            has_errors, output = format_messages(response, path, offset)
+            return (1 if has_errors else 0), output
+        except LeanHeaderError as e:
+            return 1, f"{path}:1:0: error: {e}"
+        except (LeanReplError, FileNotFoundError):
+            pass  # REPL unavailable in this project, use the plain compiler
+
+    # Sessions are told apart by their working directory, one per problem in batch runs.
+    session = os.path.dirname(os.path.abspath(path))
+    log_path = os.path.join(session, LOG_DIR, os.path.basename(path) + ".stream.log")
+    result = get_scheduler().run(
+        "lean", ["lean", "--json", path], session=session, timeout=timeout, log_path=log_path, handle=cancel
+    )
+    if result["timed_out"]:
+        raise subprocess.TimeoutExpired(["lean", "--json", path], timeout)
+    if cancel is not None and cancel.is_set():
+        raise CheckCancelled(path)
+    if result["cancelled"]:
+        raise KeyboardInterrupt
+    return result["returncode"], _render_json_output(result["stdout"], result["stderr"], path)
+
+
+def cancel_checks(handle: threading.Event):
+    """Stop every compile_lean_file run with `handle`, queued or running, on the REPL pool or not."""
+    pool = get_repl_pool()
+    if pool is not None:
+        pool.cancel(handle)
+    get_scheduler().cancel(handle)
+
+
+def _render_json_output(stdout: str, stderr: str, path: str) -> str:
+    """`lean --json` prints one message object per line; render them like the REPL's, keep anything else."""
+    messages, other = [], []
+    for line in stdout.splitlines():
+        try:
+            message = json.loads(line)
+        except ValueError:
+            message = None
+        if isinstance(message, dict) and "severity" in message:
+            messages.append(message)
+        elif line.strip():
+            other.append(line)
+    _, rendered = format_messages({"messages": messages}, path)
+    return "\n".join(part for part in (stderr.strip(), rendered, "\n".join(other)) if part)
 
 class LeanTool(BaseTool):
+    def __init__(
+        self,
+        root: str = ".",
+        checker: Callable[[str, float, Optional[bool]], Tuple[int, str]] = compile_lean_file
+    ):
+        # Relative paths from the model resolve against this directory.
+        self.root = root
+        # Same contract as compile_lean_file; replaceable for benchmarks.
+        self.checker = checker
+        self._automation: Optional[Automation] = None
+        self._speculator: Optional[SpeculativeChecker] = None
+
     @property
     def name(self) -> str:
         return "lean_tool"
@@ -17,10 +135,116 @@ class LeanTool(BaseTool):
         return """<TOOL name="lean_tool">
 {
   "command": "check_file" | "lake_build",
-  "path": "filename.lean" (required for check_file)
+  "path": "filename.lean" (required for check_file; for lake_build, rebuild only the modules affected by this file),
+  "targets": ["My.Module", ...] (optional, lake_build: modules to build; none and no path builds the whole project),
+  "incremental": true | false (optional, re-check only from the first edited declaration)
 }
 </TOOL>"""
 
+    def _compact(self, output: str, log_name: str) -> str:
+        """Ranked, deduplicated diagnostics for the model; the full output is saved as a log under the root."""
+        lean_config = get_lean_config()
+        return compact_output(
+            output,
+            self.root,
+            log_name,
+            max_chars=lean_config.get("diagnostics_max_chars", 4000),
+            goal_chars=lean_config.get("diagnostics_goal_chars", 1500)
+        )
+
+    def automation(self) -> Optional[Automation]:
+        """The decision-procedure stage, checked with this tool's checker; None when disabled."""
+        if not get_search_config().get("automation", True):
+            return None
+        if self._automation is None:
+            # Only compile_lean_file takes a cancel handle; benchmark checkers are raced without one.
+            self._automation = Automation(self.checker, self.root, cancellable=self.checker is compile_lean_file)
+        return self._automation
+
+    def speculator(self) -> Optional[SpeculativeChecker]:
+        """Background checks of freshly written files; None when disabled."""
+        lean_config = get_lean_config()
+        if not lean_config.get("speculative", True):
+            return None
+        if self._speculator is None:
+            self._speculator = SpeculativeChecker(
+                self.checker,
+                timeout=lean_config.get("request_timeout", 30),
+                workers=lean_config.get("speculative_workers", 1)
+            )
+        return self._speculator
+
+    def speculate(self, path: str, source: str):
+        """Hook for file_system writes: start checking a written .lean file right away."""
+        if path.endswith(".lean"):
+            speculator = self.speculator()
+            if speculator is not None:
+                speculator.submit(path, source)
+
+    def _lake_build(self, args: Dict[str, Any]) -> str:
+        lean_config = get_lean_config()
+        if self._speculator is not None:
+            self._speculator.invalidate()
+        builder = LakeBuilder(
+            self.root,
+            timeout=lean_config.get("build_timeout", 300),
+            jobs=lean_config.get("build_jobs", 0),
+            progress=self.report,
+            deadline=self.deadline
+        )
+        targets = list(args.get("targets") or [])
+        if not targets and not args.get("path"):
+            # Run 'lake build' for the whole project
+            result = builder.build_one(None)
+            if result["status"] == "ok":
+                return "SUCCESS: Project built successfully."
+            if result["status"] == "timeout":
+                return f"Error: Build timed out, no module finished for {builder.timeout:.0f}s ({result['elapsed']:.0f}s in total)."
+            if result["status"] == "cancelled":
+                return "Error: Build cancelled."
+            return f"BUILD ERROR: {self._compact(result['output'], 'lake_build')}"
+
+        graph = import_graph(self.root)
+        if args.get("path"):
+            changed = module_name(args["path"])
+            if changed not in graph:
+                return f"Error: {args['path']} is not a module of this project."
+            targets = sorted(affected_modules(graph, [changed]) | set(targets))
+        start = time.monotonic()
+        results = builder.build(targets, graph)
+        return self._build_report(results, time.monotonic() - start)
+
+    def _build_report(self, results: List[Dict[str, Any]], elapsed: float) -> str:
+        """One status line, one line per module, then diagnostics of the failed modules."""
+        ok = [r for r in results if r["status"] == "ok"]
+        if len(ok) == len(results):
+            return f"SUCCESS: Built {len(ok)} module{'s' if len(ok) != 1 else ''} ({elapsed:.1f}s): {', '.join(r['module'] for r in ok)}"
+
+        counts = {}
+        for r in results:
+            counts[r["status"]] = counts.get(r["status"], 0) + 1
+        details = ", ".join(
+            f"{counts[s]} {label}"
+            for s, label in (("failed", "failed"), ("timeout", "timed out"), ("cancelled", "cancelled"), ("skipped", "skipped"))
+            if s in counts
+        )
+        peak = max(r["peak_rss_mb"] for r in results)
+        lines = [f"BUILD ERROR: {details} of {len(results)} modules ({elapsed:.1f}s, peak {peak:.0f} MB)"]
+        for r in results:
+            if r["status"] == "skipped":
+                lines.append(f"- {r['module']}: skipped, depends on {', '.join(r['blocked_by'])}")
+            elif r["status"] == "timeout":
+                lines.append(f"✖ {r['module']}: timed out after {r['elapsed']:.0f}s")
+            elif r["status"] == "cancelled":
+                lines.append(f"- {r['module']}: cancelled")
+            else:
+                took = f" ({r['elapsed']:.1f}s)" if r["elapsed"] is not None else ""
+                lines.append(f"{'✔' if r['status'] == 'ok' else '✖'} {r['module']}: {r['status']}{took}")
+        failed_output = "\n".join(r["output"] for r in results if r["status"] in ("failed", "timeout") and r["output"])
+        if failed_output:
+            lines.append(self._compact(failed_output, "lake_build"))
+        return "\n".join(lines)
+
     def execute(self, args: Dict[str, Any]) -> str:
         command = args.get("command")
         
@@ -28,34 +252,34 @@ class LeanTool(BaseTool):
             path = args.get("path")
             if not path:
                 return "Error: 'path' is required for check_file."
+            path = os.path.normpath(os.path.join(self.root, path))
             if not os.path.exists(path):
                 return f"Error: File {path} not found."
             
-            # Using 'lean' directly to check a single file
-            cmd = ["lean", path]
+            timeout = self.time_left(get_lean_config().get("request_timeout", 30))
+            if timeout <= 0:
+                return "Error: Time limit reached; the file was not checked."
             try:
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-                if result.returncode == 0:
+                speculator = self.speculator()
+                check = speculator.check if speculator is not None else self.checker
+                returncode, output = check(path, timeout, args.get("incremental"))
+                if returncode == 0:
                     return "SUCCESS: Proof Verified (No output from compiler)."
-                else:
-                    output = (result.stderr + "\n" + result.stdout).strip()
-                    return f"COMPILER ERROR:\n{output}"
+                report = f"COMPILER ERROR: {self._compact(output, args['path'])}"
+                automation = self.automation()
+                if automation is not None:
+                    hints = automation.close_goals(output, path, budget=self.time_left(automation.budget))
+                    if hints:
+                        report += "\nAUTOMATION: " + "; ".join(hints)
+                return report
             except subprocess.TimeoutExpired:
-                return "Error: Compilation timed out (30s)."
+                return f"Error: Compilation timed out ({timeout}s)."
             except FileNotFoundError:
                 return "Error: 'lean' executable not found."
 
         elif command == "lake_build":
-            # Run 'lake build' for the whole project
             try:
-                result = subprocess.run(["lake", "build"], capture_output=True, text=True, timeout=120)
-                if result.returncode == 0:
-                    return "SUCCESS: Project built successfully."
-                else:
-                    output = (result.stderr + "\n" + result.stdout).strip()
-                    return f"BUILD ERROR:\n{output}"
-            except subprocess.TimeoutExpired:
-                return "Error: Build timed out (120s)."
+                return self._lake_build(args)
             except FileNotFoundError:
                 return "Error: 'lake' executable not found."
         
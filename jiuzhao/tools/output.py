@@ -0,0 +1,76 @@
+import os
+from collections import deque
+from typing import IO, Iterable, List, Optional
+
+
+class OutputBuffer:
+    """
+    Keeps the first `head_chars` and the last `tail_chars` of a stream of
+    lines, so a runaway process costs bounded memory. Once the head is full,
+    everything (head included) is also spilled to `spill_path`, which the
+    truncated text then points to.
+    """
+
+    def __init__(self, head_chars: int = 20000, tail_chars: int = 20000, spill_path: Optional[str] = None):
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.spill_path = spill_path
+        self.head: List[str] = []
+        self.head_size = 0
+        self.tail: "deque[str]" = deque()
+        self.tail_size = 0
+        self.lines = 0
+        self.dropped = 0
+        self.clipped = False
+        self._spill: Optional[IO[str]] = None
+
+    def write(self, line: str):
+        self.lines += 1
+        if self._spill is not None:
+            self._spill.write(line)
+        if self.head_size + len(line) <= self.head_chars and not self.tail:
+            self.head.append(line)
+            self.head_size += len(line)
+            return
+        if self._spill is None and self.spill_path:
+            self._open_spill()
+            if self._spill is not None:
+                self._spill.write(line)
+        # A single giant line (minified JSON, a dumped term) keeps only its end.
+        if len(line) > self.tail_chars:
+            line = line[-self.tail_chars:]
+            self.clipped = True
+        self.tail.append(line)
+        self.tail_size += len(line)
+        while self.tail_size > self.tail_chars and len(self.tail) > 1:
+            self.tail_size -= len(self.tail.popleft())
+            self.dropped += 1
+
+    def writelines(self, lines: Iterable[str]):
+        for line in lines:
+            self.write(line)
+
+    def _open_spill(self):
+        try:
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            self._spill = open(self.spill_path, "w", encoding="utf-8")
+            self._spill.writelines(self.head)
+        except OSError:
+            self.spill_path = None
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def text(self) -> str:
+        """The kept output; a marker line stands for the dropped middle."""
+        if not self.dropped and not self.clipped:
+            return "".join(self.head) + "".join(self.tail)
+        where = f"full log: {self.spill_path}" if self.spill_path else "full log not kept"
+        what = f"{self.dropped} lines omitted" if self.dropped else "output truncated"
+        marker = f"… {what} ({where}) …\n"
+        head = "".join(self.head)
+        if head and not head.endswith("\n"):
+            head += "\n"
+        return head + marker + "".join(self.tail)
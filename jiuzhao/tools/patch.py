@@ -0,0 +1,141 @@
+import difflib
+import os
+import re
+import tempfile
+from typing import Dict, Any, List, Optional, Tuple
+
+HUNK_RE = re.compile(r"^@@ -(\d+)(?:,\d+)? \+\d+(?:,\d+)? @@")
+DIFF_CONTEXT = 2
+
+
+class PatchConflict(Exception):
+    """An edit that does not match the current file; nothing has been written."""
+
+
+def split_lines(text: str) -> Tuple[List[str], bool]:
+    """Lines without terminators, and whether the text ended with a newline."""
+    return text.splitlines(), text.endswith("\n")
+
+
+def join_lines(lines: List[str], trailing_newline: bool) -> str:
+    return "\n".join(lines) + ("\n" if trailing_newline and lines else "")
+
+
+def parse_unified_diff(diff: str) -> List[Dict[str, Any]]:
+    """
+    Hunks of a single-file unified diff as {"start", "before", "after"}.
+    `start` is the old-file line from the `@@` header, None if the header
+    has no numbers. File headers are only recognised before the first hunk,
+    since a removed Lean comment also starts with `---`.
+    """
+    hunks: List[Dict[str, Any]] = []
+    current: Optional[Dict[str, Any]] = None
+    for line in diff.splitlines():
+        if line.startswith("@@"):
+            match = HUNK_RE.match(line)
+            current = {"start": int(match.group(1)) if match else None, "before": [], "after": []}
+            hunks.append(current)
+            continue
+        if current is None or line.startswith("\\"):
+            continue  # file headers, "\ No newline at end of file"
+        tag, text = (line[0], line[1:]) if line else (" ", "")
+        if tag == "-":
+            current["before"].append(text)
+        elif tag == "+":
+            current["after"].append(text)
+        else:
+            # Context; models often drop the leading space of blank or unchanged lines.
+            text = text if tag == " " else line
+            current["before"].append(text)
+            current["after"].append(text)
+    if not hunks:
+        raise PatchConflict("no @@ hunks found in the diff")
+    return hunks
+
+
+def _find_block(lines: List[str], block: List[str], lo: int, near: Optional[int]) -> Optional[int]:
+    """Index of `block` in `lines[lo:]`, nearest to `near`; trailing whitespace is ignored as a fallback."""
+    n = len(block)
+    for normalize in (lambda s: s, str.rstrip):
+        wanted = [normalize(s) for s in block]
+        first = wanted[0]
+        hits = [
+            i for i in range(lo, len(lines) - n + 1)
+            if normalize(lines[i]) == first and [normalize(s) for s in lines[i:i + n]] == wanted
+        ]
+        if hits:
+            if near is None:
+                if len(hits) > 1:
+                    raise PatchConflict(f"context matches {len(hits)} places; add line numbers or more context")
+                return hits[0]
+            return min(hits, key=lambda i: abs(i - near))
+    return None
+
+
+def apply_hunks(lines: List[str], hunks: List[Dict[str, Any]]) -> List[str]:
+    """
+    Apply hunks in order. Each one is located by its context and removed
+    lines, nearest to the line its header names (adjusted for the hunks
+    before it), so slightly wrong line numbers still apply. Raises
+    PatchConflict when a hunk's context is not in the file.
+    """
+    result = list(lines)
+    offset = 0
+    lo = 0
+    for number, hunk in enumerate(hunks, 1):
+        before, after = hunk["before"], hunk["after"]
+        start = hunk["start"]
+        near = start - 1 + offset if start is not None else None
+        if not before:
+            if start is None:
+                raise PatchConflict(f"hunk {number} only adds lines and has no line number to insert at")
+            # `@@ -N,0 ... @@` inserts after old line N.
+            index = max(0, min(start + offset, len(result)))
+        else:
+            index = _find_block(result, before, lo, near)
+            if index is None:
+                where = f" near line {start}" if start is not None else ""
+                raise PatchConflict(f"hunk {number} does not match the file{where}: {before[0].strip()[:80]!r}")
+        result[index:index + len(before)] = after
+        offset += len(after) - len(before)
+        lo = index + len(after)
+    return result
+
+
+def unified_diff(display_path: str, old: str, new: str) -> str:
+    """The changed hunks between two versions, with DIFF_CONTEXT lines of context."""
+    return "\n".join(difflib.unified_diff(
+        old.splitlines(), new.splitlines(),
+        fromfile=f"a/{display_path}", tofile=f"b/{display_path}",
+        n=DIFF_CONTEXT, lineterm=""
+    ))
+
+
+def atomic_write(path: str, content: str, expected_mtime: Optional[int] = None):
+    """
+    Replace `path` through a temporary file in the same directory and a
+    rename, so readers see the old or the new file, never a partial one. With
+    `expected_mtime` (st_mtime_ns from when the file was read), a file
+    modified in the meantime raises PatchConflict instead of being overwritten.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        try:
+            st = os.stat(path)
+            os.chmod(tmp, st.st_mode & 0o7777)
+        except FileNotFoundError:
+            st = None
+            os.chmod(tmp, 0o644)
+        if expected_mtime is not None and (st is None or st.st_mtime_ns != expected_mtime):
+            raise PatchConflict("the file changed while the edit was being applied; read it again")
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
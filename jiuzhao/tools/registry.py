@@ -1,30 +1,91 @@
-from typing import Dict, Any
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Tuple
 from .base import BaseTool
 from .file_system import FileSystemTool
 from .lean import LeanTool
 from .search import SearchTool
+from .symbols import SymbolTool
+from . import retrieval
+from jiuzhao.utils.trace import span
 
 class ToolRegistry:
-    def __init__(self):
+    def __init__(self, root: str = "."):
         self.tools: Dict[str, BaseTool] = {}
+        self.root = root
         self._register_defaults()
 
     def _register_defaults(self):
-        self.register(FileSystemTool())
-        self.register(LeanTool())
+        self.register(FileSystemTool(self.root))
+        self.register(LeanTool(self.root))
         self.register(SearchTool())
+        self.register(SymbolTool())
+        if retrieval.numpy_available():
+            self.register(retrieval.PremiseSearchTool())
+
+    def set_progress(self, callback: Optional[Callable[[str], None]]):
+        """Route progress lines of every tool to `callback` (None to stop)."""
+        for tool in self.tools.values():
+            tool.progress = callback
+
+    def set_deadline(self, deadline: Optional[float]):
+        """Give every tool the time.monotonic() deadline of the current run (None for none)."""
+        for tool in self.tools.values():
+            tool.deadline = deadline
 
     def register(self, tool: BaseTool):
         self.tools[tool.name] = tool
+        file_system, lean = self.tools.get("file_system"), self.tools.get("lean_tool")
+        if file_system is not None and lean is not None:
+            # Written .lean files start compiling before the model asks for a check.
+            file_system.on_write = lean.speculate
 
     def get_tool_definitions(self) -> str:
         defs = [t.get_definition() for t in self.tools.values()]
         return "\n---\n".join(defs)
 
+    def is_read_only(self, tool_name: str, args: Dict[str, Any]) -> bool:
+        tool = self.tools.get(tool_name)
+        return tool is not None and tool.is_read_only(args)
+
+    def execute_all(self, calls: List[Tuple[str, Dict[str, Any]]], max_workers: int = 4) -> List[str]:
+        """
+        Execute calls and return their results in call order. Runs of
+        consecutive read-only calls execute concurrently; any other call waits
+        for everything before it and runs alone, so reads always see earlier writes.
+        """
+        results: List[Optional[str]] = [None] * len(calls)
+        batch: List[int] = []
+
+        def flush(pool: Optional[ThreadPoolExecutor]):
+            if len(batch) == 1 or pool is None:
+                for i in batch:
+                    results[i] = self.execute(*calls[i])
+            else:
+                for i, result in zip(batch, pool.map(lambda i: self.execute(*calls[i]), batch)):
+                    results[i] = result
+            batch.clear()
+
+        reads = sum(1 for name, args in calls if self.is_read_only(name, args))
+        workers = min(max_workers, reads)
+        with ThreadPoolExecutor(max_workers=workers) if workers > 1 else contextlib.nullcontext() as pool:
+            for i, (name, args) in enumerate(calls):
+                if self.is_read_only(name, args):
+                    batch.append(i)
+                    continue
+                flush(pool)
+                results[i] = self.execute(name, args)
+            flush(pool)
+        return results
+
     def execute(self, tool_name: str, args: Dict[str, Any]) -> str:
         if tool_name not in self.tools:
             return f"Error: Tool '{tool_name}' not found."
-        try:
-            return self.tools[tool_name].execute(args)
-        except Exception as e:
-            return f"Error executing {tool_name}: {str(e)}"
+        with span(f"tool.{tool_name}", "tool", action=args.get("action") or args.get("command"), path=args.get("path")) as s:
+            try:
+                result = self.tools[tool_name].execute(args)
+            except Exception as e:
+                result = f"Error executing {tool_name}: {str(e)}"
+            if s.enabled:
+                s.set(output_chars=len(result), ok=not result.startswith(("Error", "COMPILER ERROR", "BUILD ERROR")))
+            return result
@@ -0,0 +1,620 @@
+import atexit
+import hashlib
+import json
+import os
+import queue
+import re
+import signal
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from jiuzhao.config import get_lean_config
+from jiuzhao.utils.trace import span
+
+
+class LeanReplError(Exception):
+    """Raised when a REPL worker cannot be started or stops responding."""
+
+
+class LeanHeaderError(LeanReplError):
+    """Raised when the imports of a file fail to elaborate."""
+
+
+class CheckCancelled(Exception):
+    """Raised when a check is stopped through its cancel handle."""
+
+
+def split_header(source: str) -> Tuple[str, str, int]:
+    """
+    Split a Lean source into its import header and the remaining body.
+    Returns (header, body, line_offset) where line_offset is the number of
+    source lines consumed by the header, used to map positions back. Comments
+    before and between the imports, such as a `/- Copyright ... -/` block,
+    are part of the header; a `/--` doc comment starts the body.
+
+    >>> split_header("/-\\nCopyright\\n-/\\nimport Mathlib\\n\\ntheorem x : True := trivial")
+    ('import Mathlib', 'theorem x : True := trivial', 5)
+    """
+    lines = source.split("\n")
+    imports = []
+    offset = 0
+    depth = 0  # open `/-` block comments; they nest
+    for line in lines:
+        rest = line
+        code = ""
+        while rest:
+            if depth:
+                opening, closing = rest.find("/-"), rest.find("-/")
+                if closing == -1 and opening == -1:
+                    rest = ""
+                elif opening != -1 and (closing == -1 or opening < closing):
+                    depth += 1
+                    rest = rest[opening + 2:]
+                else:
+                    depth -= 1
+                    rest = rest[closing + 2:]
+            else:
+                opening, comment = rest.find("/-"), rest.find("--")
+                if comment != -1 and (opening == -1 or comment < opening):
+                    code += rest[:comment]
+                    rest = ""
+                elif opening != -1 and not rest.startswith("/--", opening):
+                    code += rest[:opening]
+                    depth += 1
+                    rest = rest[opening + 2:]
+                else:
+                    code += rest
+                    rest = ""
+        stripped = code.strip()
+        if stripped.startswith("import "):
+            imports.append(stripped)
+        elif stripped:
+            break
+        offset += 1
+    return "\n".join(imports), "\n".join(lines[offset:]), offset
+
+
+# A top-level command starts at column 0, optionally behind attributes and modifiers.
+DECL_START_RE = re.compile(
+    r"^(@\[[^\]]*\]\s*)*"
+    r"((private|protected|noncomputable|partial|unsafe|nonrec|scoped|local)\s+)*"
+    r"(theorem|lemma|def|abbrev|instance|example|structure|class|inductive|axiom|opaque"
+    r"|namespace|section|end|open|variable|universe|set_option|attribute|mutual"
+    r"|macro|macro_rules|syntax|notation|infix|infixl|infixr|prefix|postfix|elab|deriving"
+    r"|#\w+)\b"
+)
+
+
+def split_declarations(body: str) -> List[Tuple[int, str]]:
+    """
+    Split a file body into top-level commands.
+    Returns (start_line, text) pairs, start_line being 0-based within `body`.
+    Doc comments and attribute lines directly above a command stay with it.
+    """
+    lines = body.split("\n")
+    starts = [0]
+    depth = 0
+    for i, line in enumerate(lines):
+        if i > 0 and depth == 0 and DECL_START_RE.match(line):
+            start = i
+            j = i - 1
+            while j > starts[-1] and lines[j].strip() and not DECL_START_RE.match(lines[j]):
+                if lines[j].startswith(("/--", "@[")):
+                    start = j
+                j -= 1
+            if start > starts[-1]:
+                starts.append(start)
+        depth = max(0, depth + line.count("/-") - line.count("-/"))
+
+    bounds = starts + [len(lines)]
+    return [(bounds[k], "\n".join(lines[bounds[k]:bounds[k + 1]])) for k in range(len(starts))]
+
+
+def _process_tree(pid: int) -> List[int]:
+    """A process and all of its descendants (Linux only; empty elsewhere)."""
+    children: Dict[int, List[int]] = {}
+    try:
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "r") as f:
+                    # The command name may contain spaces; ppid follows the closing paren.
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+                children.setdefault(ppid, []).append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    except OSError:
+        return []
+
+    tree = []
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def _process_tree_rss_kb(pid: int) -> int:
+    """Sum the resident set size of a process and all of its descendants (Linux only)."""
+    total = 0
+    for current in _process_tree(pid):
+        try:
+            with open(f"/proc/{current}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def _process_tree_cpu_seconds(pid: int) -> float:
+    """User plus system CPU time consumed so far by a process tree (Linux only)."""
+    ticks = 0
+    for current in _process_tree(pid):
+        try:
+            with open(f"/proc/{current}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            # utime and stime are fields 14 and 15 of stat, counted from the pid.
+            ticks += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError, ValueError):
+            continue
+    return ticks / os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 0.0
+
+
+class LeanReplWorker:
+    """
+    A long-lived Lean REPL process with a fixed import header already elaborated.
+    Talks the JSON protocol of `leanprover-community/repl`: one JSON command per
+    request, answered by one JSON object terminated by a blank line.
+    """
+
+    def __init__(
+        self,
+        header: str,
+        command: List[str],
+        cwd: Optional[str] = None,
+        max_snapshots: int = 2000
+    ):
+        self.header = header
+        self.command = command
+        self.cwd = cwd
+        self.process: Optional[subprocess.Popen] = None
+        self.header_env: Optional[int] = None
+        self.requests = 0
+        self.last_used = time.monotonic()
+        # prefix hash -> (env after that prefix, messages of its last command)
+        self.snapshots: "OrderedDict[str, Tuple[int, List[Dict[str, Any]]]]" = OrderedDict()
+        self.max_snapshots = max_snapshots
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._stderr = deque(maxlen=50)
+        self.ticket = None
+
+    def start(self, timeout: float):
+        from .scheduler import get_scheduler, limit_resources  # here: the scheduler imports this module
+        # The worker holds a scheduler ticket for its whole life, so Lean jobs and
+        # other workers are only admitted while its memory is accounted for.
+        scheduler = get_scheduler()
+        deadline = time.monotonic() + timeout
+        self.ticket = scheduler.hold("repl", session=os.path.abspath(self.cwd or "."), deadline=deadline)
+        if self.ticket is None:
+            raise subprocess.TimeoutExpired(self.command, timeout)
+        try:
+            self.process = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                bufsize=1,
+                cwd=self.cwd,
+                start_new_session=True
+            )
+        except BaseException:
+            scheduler.release(self.ticket)
+            self.ticket = None
+            raise
+        scheduler.attach(self.ticket, self.process.pid)
+        # Workers live for many requests, so only the memory limit applies, not the CPU one.
+        limit_resources(self.process.pid, memory_mb=get_lean_config().get("job_memory_mb", 0))
+        threading.Thread(target=self._read_stdout, daemon=True).start()
+        threading.Thread(target=self._read_stderr, daemon=True).start()
+
+        # Elaborate the imports once; every later check starts from this environment.
+        response = self.send({"cmd": self.header}, max(0.0, deadline - time.monotonic()))
+        errors = [m for m in response.get("messages", []) if m.get("severity") == "error"]
+        if "env" not in response or errors:
+            detail = errors[0].get("data") if errors else response.get("message", response)
+            self.stop()
+            raise LeanHeaderError(f"Failed to load imports: {detail}")
+        self.header_env = response["env"]
+
+    def _read_stdout(self):
+        for line in self.process.stdout:
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def _read_stderr(self):
+        for line in self.process.stderr:
+            self._stderr.append(line.rstrip())
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def rss_mb(self) -> float:
+        if not self.alive:
+            return 0.0
+        return _process_tree_rss_kb(self.process.pid) / 1024
+
+    def cpu_seconds(self) -> float:
+        if not self.alive:
+            return 0.0
+        return _process_tree_cpu_seconds(self.process.pid)
+
+    def send(self, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        if not self.alive:
+            raise LeanReplError("REPL worker is not running.")
+
+        self.requests += 1
+        self.last_used = time.monotonic()
+        try:
+            self.process.stdin.write(json.dumps(payload) + "\n\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise LeanReplError(f"REPL worker closed its input: {e}")
+
+        deadline = time.monotonic() + timeout
+        buffer: List[str] = []
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.command, timeout)
+            try:
+                line = self._lines.get(timeout=remaining)
+            except queue.Empty:
+                raise subprocess.TimeoutExpired(self.command, timeout)
+
+            if line is None:
+                stderr = "\n".join(self._stderr)
+                raise LeanReplError(f"REPL worker exited unexpectedly.\n{stderr}".strip())
+            if line.strip():
+                buffer.append(line)
+            elif buffer:
+                break
+
+        try:
+            return json.loads("".join(buffer))
+        except json.JSONDecodeError as e:
+            raise LeanReplError(f"Malformed REPL response: {e}")
+
+    def check(self, body: str, timeout: float) -> Dict[str, Any]:
+        return self.send({"cmd": body, "env": self.header_env}, timeout)
+
+    def check_incremental(self, body: str, timeout: float) -> Tuple[Dict[str, Any], int]:
+        """
+        Elaborate `body` one top-level command at a time, resuming from the
+        environment snapshot of the longest prefix this worker has already seen.
+        Returns a response shaped like `check` and the number of reused commands.
+        """
+        deadline = time.monotonic() + timeout
+        digest = hashlib.sha256(self.header.encode("utf-8"))
+        env = self.header_env
+        messages: List[Dict[str, Any]] = []
+        reused = 0
+
+        for start, text in split_declarations(body):
+            digest.update(b"\x00" + text.encode("utf-8"))
+            key = digest.hexdigest()
+            snapshot = self.snapshots.get(key)
+            if snapshot is not None:
+                self.snapshots.move_to_end(key)
+                reused += 1
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(self.command, timeout)
+                response = self.send({"cmd": text, "env": env}, remaining)
+                if "env" not in response:
+                    raise LeanReplError(response.get("message", "REPL returned no environment."))
+                snapshot = (response["env"], response.get("messages", []))
+                self.snapshots[key] = snapshot
+                if len(self.snapshots) > self.max_snapshots:
+                    self.snapshots.popitem(last=False)
+
+            env = snapshot[0]
+            for msg in snapshot[1]:
+                shifted = dict(msg)
+                for field in ("pos", "endPos"):
+                    if msg.get(field):
+                        shifted[field] = dict(msg[field], line=msg[field].get("line", 0) + start)
+                messages.append(shifted)
+
+        return {"env": env, "messages": messages}, reused
+
+    def proof_states(self, body: str, timeout: float) -> List[Dict[str, Any]]:
+        """
+        Elaborate `body` and return its `sorry` holes, each with the goal text
+        and the proof state id the REPL saved for it.
+        """
+        response = self.check(body, timeout)
+        if "env" not in response:
+            raise LeanReplError(response.get("message", "REPL returned no environment."))
+        return response.get("sorries", [])
+
+    def run_tactic(self, tactic: str, proof_state: int, timeout: float) -> Dict[str, Any]:
+        """
+        Run one tactic against a saved proof state. The REPL answers with a new
+        proof state and its remaining goals, or with an error message.
+        """
+        return self.send({"tactic": tactic, "proofState": proof_state}, timeout)
+
+    def stop(self):
+        if self.process is None:
+            return
+        # Taken first: a cancel may stop a worker while its own thread does too.
+        ticket, self.ticket = self.ticket, None
+        # The size of a worker about to be stopped is the best guess for the next one.
+        peak_mb = self.rss_mb() if ticket is not None else 0.0
+        if self.process.poll() is None:
+            try:
+                if hasattr(os, "killpg"):
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                else:
+                    self.process.kill()
+            except OSError:
+                pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+        if ticket is not None:
+            from .scheduler import get_scheduler
+            get_scheduler().release(ticket, peak_mb)
+
+
+class LeanReplPool:
+    """
+    Pool of warm REPL workers keyed by import header.
+
+    Workers are reused across checks so `import Mathlib` is paid once per worker
+    instead of once per check. A worker is recycled when it crashes, times out,
+    exceeds its memory budget or has served `max_requests` checks. When the pool
+    is full, the least recently used idle worker of another header is evicted.
+    Checks given a cancel handle are stopped by cancel(handle): waiting ones
+    never get a worker, and only the workers busy with them are killed.
+    """
+
+    def __init__(
+        self,
+        command: List[str],
+        size: int = 2,
+        request_timeout: float = 30,
+        startup_timeout: float = 300,
+        max_rss_mb: float = 8192,
+        max_requests: int = 500,
+        cwd: Optional[str] = None
+    ):
+        self.command = command
+        self.size = max(1, size)
+        self.request_timeout = request_timeout
+        self.startup_timeout = startup_timeout
+        self.max_rss_mb = max_rss_mb
+        self.max_requests = max_requests
+        self.cwd = cwd
+        self.available = True
+        self._idle: Dict[str, List[LeanReplWorker]] = {}
+        # worker -> cancel handle of the request it is serving
+        self._busy: Dict[LeanReplWorker, threading.Event] = {}
+        self._total = 0
+        self._cond = threading.Condition()
+
+    def _evict_idle(self, keep_header: str) -> Optional[LeanReplWorker]:
+        candidates = [w for h, ws in self._idle.items() if h != keep_header for w in ws]
+        if not candidates:
+            return None
+        victim = min(candidates, key=lambda w: w.last_used)
+        self._idle[victim.header].remove(victim)
+        return victim
+
+    def acquire(self, header: str, cancel: Optional[threading.Event] = None) -> LeanReplWorker:
+        victim = None
+        with self._cond:
+            while True:
+                if cancel is not None and cancel.is_set():
+                    raise CheckCancelled(header)
+                idle = self._idle.get(header)
+                if idle:
+                    return idle.pop()
+                if self._total < self.size:
+                    self._total += 1
+                    break
+                victim = self._evict_idle(header)
+                if victim:
+                    break
+                self._cond.wait()
+
+        if victim:
+            victim.stop()
+
+        worker = LeanReplWorker(header, self.command, self.cwd)
+        try:
+            worker.start(self.startup_timeout)
+        except FileNotFoundError:
+            self.available = False
+            self._discard()
+            raise
+        except LeanHeaderError:
+            self._discard()
+            raise
+        except LeanReplError:
+            # A REPL that dies on startup (e.g. `repl` is not a dependency of
+            # this project) will not get better by retrying.
+            self.available = False
+            worker.stop()
+            self._discard()
+            raise
+        except BaseException:
+            worker.stop()
+            self._discard()
+            raise
+        return worker
+
+    def _discard(self):
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    def release(self, worker: LeanReplWorker, healthy: bool = True):
+        recycle = (
+            not healthy
+            or not worker.alive
+            or worker.requests >= self.max_requests
+            or worker.rss_mb() > self.max_rss_mb
+        )
+        if recycle:
+            worker.stop()
+            self._discard()
+            return
+        with self._cond:
+            self._idle.setdefault(worker.header, []).append(worker)
+            self._cond.notify()
+
+    def check(
+        self,
+        source: str,
+        timeout: Optional[float] = None,
+        incremental: bool = False,
+        cancel: Optional[threading.Event] = None
+    ) -> Tuple[Dict[str, Any], int]:
+        """
+        Elaborate `source` on a warm worker.
+        Returns the raw REPL response and the line offset of the body within `source`.
+        In incremental mode only the commands after the first changed one are
+        re-elaborated. Raises CheckCancelled once cancel(`cancel`) stops it.
+        """
+        header, body, offset = split_header(source)
+        timeout = timeout or self.request_timeout
+        if incremental:
+            return self._run(header, lambda w: w.check_incremental(body, timeout)[0], cancel), offset
+        return self._run(header, lambda w: w.check(body, timeout), cancel), offset
+
+    def cancel(self, handle: threading.Event):
+        """Set `handle` and stop the checks run with it, killing the workers busy with them."""
+        with self._cond:
+            handle.set()
+            busy = [w for w, h in self._busy.items() if h is handle]
+            self._cond.notify_all()
+        for worker in busy:
+            worker.stop()  # the request fails at once; _run recycles the worker
+
+    def _run(
+        self,
+        header: str,
+        request: Callable[[LeanReplWorker], Dict[str, Any]],
+        cancel: Optional[threading.Event] = None
+    ) -> Dict[str, Any]:
+        for attempt in range(2):
+            with span("lean.repl", "lean", attempt=attempt) as s:
+                start = time.perf_counter()
+                worker = self.acquire(header, cancel)
+                if s.enabled:
+                    # Reading /proc for the whole worker tree is only worth it when traced.
+                    s.set(queue_s=round(time.perf_counter() - start, 6), worker_pid=worker.process.pid)
+                    cpu = worker.cpu_seconds()
+                if cancel is not None and not self._mark_busy(worker, cancel):
+                    self.release(worker)  # cancelled before the request; the worker stays warm
+                    raise CheckCancelled(header)
+                try:
+                    response = request(worker)
+                except (subprocess.TimeoutExpired, KeyboardInterrupt):
+                    # The worker is still busy elaborating; it cannot be interrupted, only killed.
+                    self._release_busy(worker, healthy=False)
+                    raise
+                except LeanReplError:
+                    self._release_busy(worker, healthy=False)
+                    if cancel is not None and cancel.is_set():
+                        raise CheckCancelled(header)  # cancel() killed the worker
+                    if attempt == 1:
+                        raise
+                    continue
+                if s.enabled:
+                    s.set(worker_cpu_s=round(worker.cpu_seconds() - cpu, 3), worker_rss_mb=round(worker.rss_mb(), 1))
+                self._release_busy(worker)
+                return response
+
+    def _mark_busy(self, worker: LeanReplWorker, cancel: threading.Event) -> bool:
+        """Record that `worker` serves a request with `cancel`; False if it is already cancelled."""
+        with self._cond:
+            if cancel.is_set():
+                return False
+            self._busy[worker] = cancel
+            return True
+
+    def _release_busy(self, worker: LeanReplWorker, healthy: bool = True):
+        with self._cond:
+            self._busy.pop(worker, None)
+        self.release(worker, healthy)
+
+    def shutdown(self):
+        with self._cond:
+            workers = [w for ws in self._idle.values() for w in ws]
+            self._idle.clear()
+            self._total -= len(workers)
+        for worker in workers:
+            worker.stop()
+
+
+def format_messages(response: Dict[str, Any], path: str, line_offset: int = 0) -> Tuple[bool, str]:
+    """
+    Render REPL messages in the same `file:line:col: severity: message` shape the
+    `lean` executable prints. Returns (has_errors, text).
+    """
+    if "message" in response and "messages" not in response:
+        return True, f"{path}: error: {response['message']}"
+
+    has_errors = False
+    rendered = []
+    for msg in response.get("messages", []):
+        severity = msg.get("severity", "error")
+        if severity == "error":
+            has_errors = True
+        pos = msg.get("pos") or {}
+        line = pos.get("line", 0) + line_offset
+        column = pos.get("column", 0)
+        rendered.append(f"{path}:{line}:{column}: {severity}: {msg.get('data', '')}")
+    return has_errors, "\n".join(rendered)
+
+
+_pool: Optional[LeanReplPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_repl_pool() -> Optional[LeanReplPool]:
+    """Return the process-wide REPL pool, or None if the REPL is disabled or unavailable."""
+    global _pool
+    lean_config = get_lean_config()
+    if not lean_config.get("use_repl", True):
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = LeanReplPool(
+                command=lean_config.get("repl_command", ["lake", "exe", "repl"]),
+                size=lean_config.get("pool_size", 2),
+                request_timeout=lean_config.get("request_timeout", 30),
+                startup_timeout=lean_config.get("startup_timeout", 300),
+                max_rss_mb=lean_config.get("max_worker_rss_mb", 8192),
+                max_requests=lean_config.get("max_requests_per_worker", 500),
+                cwd=os.getcwd()
+            )
+            atexit.register(_pool.shutdown)
+            from .scheduler import get_scheduler  # here: the scheduler imports this module
+            # Idle workers give their memory back when it keeps a Lean job from starting.
+            get_scheduler().on_memory_pressure(_pool.shutdown)
+    return _pool if _pool.available else None
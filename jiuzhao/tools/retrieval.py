@@ -0,0 +1,277 @@
+import hashlib
+import importlib.util
+import os
+import re
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+from .base import BaseTool
+from .index import INDEX_DIR, walk_sources
+from .symbols import extract_declarations, sources_digest
+
+# Optional dependency (the `retrieval` extra), imported on first use by
+# _require_numpy() because it is slow to import and most sessions never rank premises.
+np = None
+
+# Tokens are hashed into a fixed number of buckets so no vocabulary has to be
+# stored or loaded; collisions at this size are negligible for ranking.
+HASH_BITS = 20
+NUM_BUCKETS = 1 << HASH_BITS
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Name tokens are the strongest signal for premise selection.
+NAME_WEIGHT = 3
+
+TOKEN_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Za-z][a-z0-9]*|\d+|[^\sA-Za-z0-9_.,:()\[\]{}'`\"]")
+STOPWORDS = {"the", "a", "an", "of", "is", "to", "in", "and", "or", "for", "that", "if", "on", "be", "by", "as", "with", "this", "we"}
+FORMAT_VERSION = 1
+
+
+def tokenize(text: str) -> List[str]:
+    """Split identifiers on `.`, `_` and camelCase and keep math symbols as tokens."""
+    tokens = []
+    for tok in TOKEN_RE.findall(text):
+        tok = tok.lower()
+        if tok not in STOPWORDS:
+            tokens.append(tok)
+    return tokens
+
+
+def _bucket(token: str) -> int:
+    return zlib.crc32(token.encode("utf-8")) & (NUM_BUCKETS - 1)
+
+
+def numpy_available() -> bool:
+    """Whether numpy can be imported, without importing it."""
+    return np is not None or importlib.util.find_spec("numpy") is not None
+
+
+def _require_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("premise_search requires numpy. Install it with `pip install jiuzhao[retrieval]`.")
+        np = numpy
+
+
+class PremiseIndex:
+    """
+    BM25 ranking over declaration names, statements and docstrings.
+
+    The index is an inverted file over hashed tokens kept as three NumPy
+    arrays: `indptr` (per bucket offsets), `docs` and precomputed BM25
+    `weights` per posting. Scoring a batch of queries is a single weighted
+    bincount over the gathered postings followed by a row-wise argpartition.
+    """
+
+    def __init__(self, arrays: Dict[str, Any]):
+        _require_numpy()
+        self.indptr = arrays["indptr"]
+        self.docs = arrays["docs"]
+        self.weights = arrays["weights"]
+        self.lines = arrays["lines"]
+        self.digest = bytes(arrays["digest"])
+        self.num_docs = len(self.lines)
+        # name, kind, signature and path for every document, one field per line
+        self.meta = bytes(arrays["meta"]).decode("utf-8").split("\n")
+
+    @classmethod
+    def build(cls, root: str, include_project: bool, include_dependencies: bool) -> Dict[str, Any]:
+        _require_numpy()
+        digest = sources_digest(root, include_project, include_dependencies)
+        meta: List[str] = []
+        lines: List[int] = []
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        doc_lengths: List[int] = []
+
+        for path, _ in walk_sources(root, include_project, include_dependencies):
+            try:
+                with open(os.path.join(root, path), "r", encoding="utf-8") as f:
+                    text = f.read()
+            except (OSError, UnicodeDecodeError):
+                continue
+            for name, kind, signature, line, doc in extract_declarations(text):
+                tokens = tokenize(name) * NAME_WEIGHT + tokenize(signature) + tokenize(doc)
+                doc_id = len(lines)
+                term_ids.extend(_bucket(t) for t in tokens)
+                doc_ids.extend([doc_id] * len(tokens))
+                doc_lengths.append(len(tokens))
+                lines.append(line)
+                meta.extend(field.replace("\n", " ") for field in (name, kind, signature, path))
+
+        num_docs = len(lines)
+        terms = np.asarray(term_ids, dtype=np.int64)
+        docs = np.asarray(doc_ids, dtype=np.int64)
+
+        # Term frequencies: collapse duplicate (term, doc) pairs.
+        pair = terms * max(num_docs, 1) + docs
+        unique_pairs, tf = np.unique(pair, return_counts=True)
+        terms = unique_pairs // max(num_docs, 1)
+        docs = unique_pairs % max(num_docs, 1)
+
+        lengths = np.asarray(doc_lengths, dtype=np.float32)
+        avg_length = float(lengths.mean()) if num_docs else 1.0
+        df = np.bincount(terms, minlength=NUM_BUCKETS)
+        idf = np.log1p((num_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[docs] / avg_length) if num_docs else np.zeros(0)
+        weights = idf[terms] * tf * (BM25_K1 + 1) / (tf + norm)
+
+        # np.unique sorted the pairs by term, so postings are already grouped by bucket.
+        indptr = np.zeros(NUM_BUCKETS + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        return {
+            "version": np.asarray([FORMAT_VERSION]),
+            "digest": np.frombuffer(digest, dtype=np.uint8),
+            "indptr": indptr,
+            "docs": docs.astype(np.int32),
+            "weights": weights.astype(np.float32),
+            "lines": np.asarray(lines, dtype=np.int32),
+            "meta": np.frombuffer("\n".join(meta).encode("utf-8"), dtype=np.uint8)
+        }
+
+    def search(self, queries: List[str], k: int = 10) -> List[List[Tuple[float, int]]]:
+        """Score every query against every declaration at once; returns (score, doc) lists."""
+        if self.num_docs == 0:
+            return [[] for _ in queries]
+
+        rows, postings = [], []
+        for qi, query in enumerate(queries):
+            for bucket in {_bucket(t) for t in tokenize(query)}:
+                start, end = self.indptr[bucket], self.indptr[bucket + 1]
+                if end > start:
+                    rows.append(np.full(end - start, qi, dtype=np.int64))
+                    postings.append(np.arange(start, end))
+        if not postings:
+            return [[] for _ in queries]
+
+        rows = np.concatenate(rows)
+        postings = np.concatenate(postings)
+        flat = rows * self.num_docs + self.docs[postings]
+        scores = np.bincount(flat, weights=self.weights[postings], minlength=len(queries) * self.num_docs)
+        scores = scores.reshape(len(queries), self.num_docs)
+
+        k = min(k, self.num_docs)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for qi in range(len(queries)):
+            order = top[qi][np.argsort(-scores[qi, top[qi]])]
+            results.append([(float(scores[qi, d]), int(d)) for d in order if scores[qi, d] > 0])
+        return results
+
+    def entry(self, doc: int) -> Dict[str, Any]:
+        name, kind, signature, path = self.meta[4 * doc:4 * doc + 4]
+        return {"name": name, "kind": kind, "signature": signature, "path": path, "line": int(self.lines[doc])}
+
+
+def premise_index_paths(root: str = ".") -> Tuple[Path, Path]:
+    digest = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:16]
+    return INDEX_DIR / f"{digest}.project.bm25.npz", INDEX_DIR / f"{digest}.deps.bm25.npz"
+
+
+def build_premise_index(root: str, out_path: Path, include_project: bool, include_dependencies: bool) -> int:
+    """Build and save a premise index. Returns the number of indexed declarations."""
+    arrays = PremiseIndex.build(root, include_project, include_dependencies)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(f"{out_path.name}.{os.getpid()}.tmp.npz")
+    np.savez(tmp, **arrays)
+    os.replace(tmp, out_path)
+    return len(arrays["lines"])
+
+
+def build_premise_indexes(root: str = ".") -> Tuple[int, int]:
+    project_path, deps_path = premise_index_paths(root)
+    return (
+        build_premise_index(root, project_path, include_project=True, include_dependencies=False),
+        build_premise_index(root, deps_path, include_project=False, include_dependencies=True)
+    )
+
+
+_indexes: Dict[str, PremiseIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _load(path: Path, root: str, include_project: bool, include_dependencies: bool, check: bool) -> PremiseIndex:
+    index = _indexes.get(str(path))
+    digest = sources_digest(root, include_project, include_dependencies) if check else None
+    if index is not None and (digest is None or index.digest == digest):
+        return index
+
+    index = None
+    if path.exists():
+        with np.load(path) as data:
+            arrays = {key: data[key] for key in data.files}
+        if int(arrays["version"][0]) == FORMAT_VERSION and (digest is None or bytes(arrays["digest"]) == digest):
+            index = PremiseIndex(arrays)
+    if index is None:
+        build_premise_index(root, path, include_project, include_dependencies)
+        with np.load(path) as data:
+            index = PremiseIndex({key: data[key] for key in data.files})
+    _indexes[str(path)] = index
+    return index
+
+
+def get_premise_indexes(root: str = ".") -> List[PremiseIndex]:
+    """Return the (project, dependencies) indexes; same refresh policy as the symbol tables."""
+    _require_numpy()
+    project_path, deps_path = premise_index_paths(root)
+    with _indexes_lock:
+        return [
+            _load(project_path, root, True, False, check=True),
+            _load(deps_path, root, False, True, check=False)
+        ]
+
+
+class PremiseSearchTool(BaseTool):
+    @property
+    def name(self) -> str:
+        return "premise_search"
+
+    @property
+    def description(self) -> str:
+        return "Rank the most relevant lemmas/definitions (project and Mathlib) for a natural-language or Lean-syntax description. Several queries can be sent at once."
+
+    @property
+    def usage(self) -> str:
+        return """<TOOL name="premise_search">
+{
+  "query": "sum of two even numbers is even",
+  "queries": ["...", "..."] (optional, instead of "query"),
+  "k": 8 (optional)
+}
+</TOOL>"""
+
+    def is_read_only(self, args: Dict[str, Any]) -> bool:
+        return True
+
+    def execute(self, args: Dict[str, Any]) -> str:
+        queries = args.get("queries") or ([args["query"]] if args.get("query") else [])
+        if not queries:
+            return "Error: 'query' or 'queries' argument is required."
+        k = min(int(args.get("k", 8)), 30)
+
+        try:
+            indexes = get_premise_indexes()
+            merged: List[List[Tuple[float, PremiseIndex, int]]] = [[] for _ in queries]
+            for index in indexes:
+                for qi, hits in enumerate(index.search(queries, k)):
+                    merged[qi].extend((score, index, doc) for score, doc in hits)
+        except Exception as e:
+            return f"Premise search failed: {str(e)}"
+
+        sections = []
+        for query, hits in zip(queries, merged):
+            hits.sort(key=lambda h: -h[0])
+            lines = [f"Query: {query}"]
+            for score, index, doc in hits[:k]:
+                e = index.entry(doc)
+                lines.append(f"  {e['kind']} {e['name']} {e['signature'][:200]}  -- {e['path']}:{e['line']}")
+            if len(lines) == 1:
+                lines.append("  (no matches)")
+            sections.append("\n".join(lines))
+        return "Premises:\n" + "\n".join(sections)
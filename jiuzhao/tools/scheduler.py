@@ -0,0 +1,602 @@
+import itertools
+import json
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Iterator, List, Optional
+from jiuzhao.config import CONFIG_DIR, get_lean_config
+from jiuzhao.utils.trace import get_current_span
+from .output import OutputBuffer
+from .repl import _process_tree_rss_kb
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Assumed peak RSS of a job kind before any job of that kind has finished.
+DEFAULT_ESTIMATES_MB = {"lean": 2048, "lake": 4096, "repl": 4096}
+UNKNOWN_ESTIMATE_MB = 2048
+# Per kind, the estimate is the largest of the last few observed peaks.
+PEAK_HISTORY = 20
+# Waiting jobs re-check free memory this often while nothing finishes.
+ADMISSION_POLL = 0.5
+# Jobs of every jiuzhao process on this machine, see SharedAdmission.
+SHARED_STATE_FILE = CONFIG_DIR / "jobs.json"
+
+
+def mem_available_mb() -> Optional[float]:
+    """MemAvailable from /proc/meminfo; None where the kernel does not report it."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def limit_resources(pid: int, memory_mb: int = 0, cpu_seconds: int = 0):
+    """
+    Apply per-process limits to a just-started child: RLIMIT_DATA (heap and
+    anonymous mappings; the mmapped .olean files do not count) and
+    RLIMIT_CPU, both inherited by the processes it starts. 0 leaves a limit
+    unset. Uses prlimit rather than a preexec_fn, which is unsafe in a
+    threaded parent; a no-op where prlimit is unavailable (non-Linux).
+    """
+    if resource is None or not hasattr(resource, "prlimit"):
+        return
+    try:
+        if memory_mb:
+            limit = memory_mb * 1024 * 1024
+            resource.prlimit(pid, resource.RLIMIT_DATA, (limit, limit))
+        if cpu_seconds:
+            # SIGXCPU at the soft limit, SIGKILL a little later.
+            resource.prlimit(pid, resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 5))
+    except (OSError, ValueError):
+        pass  # already exited, or the limit is above the hard limit we inherited
+
+
+def _kill_group(pid: int):
+    """SIGKILL a process started with start_new_session=True and everything it started."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedAdmission:
+    """
+    The running jobs and waiting processes of every jiuzhao process on this
+    machine, kept in a JSON file under ~/.jiuzhao and only touched under an
+    flock, so sessions run by separate processes share one memory budget and
+    one job limit. Processes take turns: the waiting process admitted least
+    recently goes first. Entries of processes that have exited are dropped.
+    """
+
+    def __init__(self, path: str = str(SHARED_STATE_FILE)):
+        self.path = path
+        self.owner = os.getpid()
+
+    @contextmanager
+    def state(self) -> Iterator[Optional[Dict[str, Any]]]:
+        """Lock the file and yield its state for reading and updating; None if it cannot be used."""
+        if fcntl is None:
+            yield None
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            lock = open(self.path + ".lock", "a")
+        except OSError:
+            yield None
+            return
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+            if not isinstance(state, dict):
+                state = {}
+            alive: Dict[str, bool] = {}
+
+            def live(key: str) -> bool:
+                owner = key.split(":")[0]
+                if owner not in alive:
+                    alive[owner] = owner.isdigit() and _process_alive(int(owner))
+                return alive[owner]
+
+            # running: "owner:ticket" -> job; waiting and served: "owner" -> time.time()
+            for key in ("running", "waiting", "served"):
+                entries = state.get(key)
+                state[key] = {k: v for k, v in entries.items() if live(k)} if isinstance(entries, dict) else {}
+            yield state
+            try:
+                with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(state, f)
+                os.replace(self.path + ".tmp", self.path)
+            except OSError:
+                pass
+
+    def others(self, state: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Running jobs of the other processes."""
+        return [job for key, job in state["running"].items() if int(key.split(":")[0]) != self.owner]
+
+    def my_turn(self, state: Dict[str, Any]) -> bool:
+        """Whether no other waiting process was served less recently than this one."""
+        def order(owner: str):
+            return state["served"].get(owner, 0.0), state["waiting"][owner]
+
+        me = str(self.owner)
+        state["waiting"].setdefault(me, time.time())
+        return all(order(me) <= order(owner) for owner in state["waiting"])
+
+
+class _Ticket:
+    __slots__ = ("kind", "session", "estimate", "admitted", "cancelled", "pid", "handle", "resident", "id", "wait")
+
+    _ids = itertools.count(1)
+
+    def __init__(self, kind: str, session: str, handle: Optional[threading.Event] = None, resident: bool = False):
+        self.kind = kind
+        self.session = session
+        self.estimate = 0.0
+        self.admitted = False
+        self.cancelled = False
+        self.pid: Optional[int] = None
+        self.handle = handle
+        # Held for the lifetime of a long-running process (a REPL worker) rather than one job.
+        self.resident = resident
+        self.id = next(self._ids)
+        self.wait = 0.0
+
+    def stopped(self) -> bool:
+        if self.handle is not None and self.handle.is_set():
+            self.cancelled = True
+        return self.cancelled
+
+
+class JobScheduler:
+    """
+    Runs Lean and Lake subprocesses under memory admission control. A job is
+    admitted when MemAvailable, minus `reserve_mb` and the growth still
+    expected from running jobs, covers the peak RSS observed for its kind;
+    a job is always admitted when nothing else runs. Waiting jobs are served
+    round-robin across sessions, FIFO within one, and a job that does not fit
+    is not overtaken, so large jobs cannot starve. Each child gets
+    RLIMIT_DATA / RLIMIT_CPU limits and is reaped with os.wait4 to record its
+    peak RSS, children included. REPL workers hold a resident ticket for their
+    whole life: it counts against the memory budget but not against
+    `max_jobs`. When only resident tickets stand in the way of a job, the
+    callbacks registered with on_memory_pressure() (the REPL pool's idle
+    worker eviction) run to free memory. With `shared`, the budget and the
+    job limit cover the jobs of every jiuzhao process on the machine.
+    """
+
+    def __init__(
+        self,
+        max_jobs: int = 4,
+        reserve_mb: int = 1024,
+        job_memory_mb: int = 0,
+        job_cpu_seconds: int = 0,
+        head_chars: int = 20000,
+        tail_chars: int = 20000,
+        memory_probe: Callable[[], Optional[float]] = mem_available_mb,
+        shared: Optional[SharedAdmission] = None
+    ):
+        self.max_jobs = max(1, max_jobs)
+        self.reserve_mb = reserve_mb
+        self.job_memory_mb = job_memory_mb
+        self.job_cpu_seconds = job_cpu_seconds
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.memory_probe = memory_probe
+        self.shared = shared
+        self._cond = threading.Condition()
+        # session -> waiting tickets; the order of sessions is the round-robin order.
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._running: List[_Ticket] = []
+        self._peaks: Dict[str, deque] = {}
+        self._stats: Dict[str, Any] = {"jobs": 0, "max_queue_depth": 0, "total_wait": 0.0, "max_wait": 0.0, "kinds": {}}
+        self._reclaimers: List[Callable[[], None]] = []
+        self._reclaiming = False
+
+    def estimate_mb(self, kind: str) -> float:
+        peaks = self._peaks.get(kind)
+        return max(peaks) if peaks else DEFAULT_ESTIMATES_MB.get(kind, UNKNOWN_ESTIMATE_MB)
+
+    def _queue_depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def _headroom_mb(self, others: List[Dict[str, Any]]) -> Optional[float]:
+        available = self.memory_probe()
+        if available is None:
+            return None
+        # Running jobs still grow towards their estimates; that memory is spoken for.
+        running = [(t.pid, t.estimate) for t in self._running] + [(job["pid"], job["estimate"]) for job in others]
+        growth = 0.0
+        for pid, estimate in running:
+            rss = _process_tree_rss_kb(pid) / 1024 if pid else 0.0
+            growth += max(0.0, estimate - rss)
+        return available - self.reserve_mb - growth
+
+    @contextmanager
+    def _shared_state(self) -> Iterator[Optional[Dict[str, Any]]]:
+        if self.shared is None:
+            yield None
+        else:
+            with self.shared.state() as state:
+                yield state
+
+    def _dispatch(self, finished: Optional[_Ticket] = None):
+        """Admit waiting tickets in round-robin order while they fit. Called with the lock held."""
+        with self._shared_state() as state:
+            if state is not None:
+                owner = str(self.shared.owner)
+                if finished is not None:
+                    state["running"].pop(f"{owner}:{finished.id}", None)
+                self._dispatch_locked(state)
+                if not self._queues:
+                    state["waiting"].pop(owner, None)
+            else:
+                self._dispatch_locked(None)
+        self._cond.notify_all()
+
+    def _dispatch_locked(self, state: Optional[Dict[str, Any]]):
+        others = self.shared.others(state) if state is not None else []
+        headroom = None
+        while self._queues:
+            session, queue = next(iter(self._queues.items()))
+            ticket = queue[0]
+            if state is not None and not self.shared.my_turn(state):
+                return
+            jobs = [t for t in self._running if not t.resident] + [job for job in others if not job["resident"]]
+            if not ticket.resident and len(jobs) >= self.max_jobs:
+                return
+            # Peaks observed while the ticket waited are better estimates than the one it queued with.
+            ticket.estimate = self.estimate_mb(ticket.kind)
+            if self._running or others:
+                if headroom is None:
+                    headroom = self._headroom_mb(others)
+                if headroom is not None and ticket.estimate > headroom:
+                    if not jobs:
+                        self._start_reclaim()  # only long-lived processes hold the memory
+                    return
+            queue.popleft()
+            self._queues.pop(session)
+            if queue:
+                self._queues[session] = queue  # to the back of the rotation
+            ticket.admitted = True
+            self._running.append(ticket)
+            if headroom is not None:
+                headroom -= ticket.estimate
+            if state is not None:
+                owner = str(self.shared.owner)
+                state["running"][f"{owner}:{ticket.id}"] = {
+                    "pid": None, "estimate": ticket.estimate, "resident": ticket.resident
+                }
+                state["served"][owner] = time.time()
+
+    def on_memory_pressure(self, reclaim: Callable[[], None]):
+        """Register a callback that frees resident processes when they keep a job from starting."""
+        with self._cond:
+            self._reclaimers.append(reclaim)
+
+    def _start_reclaim(self):
+        """Run the reclaim callbacks on a thread of their own. Called with the lock held."""
+        if self._reclaiming or not self._reclaimers:
+            return
+        self._reclaiming = True
+        threading.Thread(target=self._reclaim, args=(list(self._reclaimers),), daemon=True).start()
+
+    def _reclaim(self, reclaimers: List[Callable[[], None]]):
+        try:
+            for reclaim in reclaimers:
+                reclaim()
+        finally:
+            with self._cond:
+                self._reclaiming = False
+                self._dispatch()
+
+    def attach(self, ticket: _Ticket, pid: int):
+        """Record the process an admitted ticket runs, for the growth estimate of later admissions."""
+        ticket.pid = pid
+        if self.shared is None:
+            return
+        with self.shared.state() as state:
+            job = state["running"].get(f"{self.shared.owner}:{ticket.id}") if state is not None else None
+            if job is not None:
+                job["pid"] = pid
+
+    def _admit(
+        self,
+        kind: str,
+        session: str,
+        deadline: Optional[float],
+        handle: Optional[threading.Event],
+        resident: bool = False
+    ) -> Optional[_Ticket]:
+        """Block until admitted; None if `deadline` passes or the job is cancelled first."""
+        ticket = _Ticket(kind, session, handle, resident)
+        with self._cond:
+            self._queues.setdefault(session, deque()).append(ticket)
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queue_depth())
+            self._dispatch()
+            while not ticket.admitted:
+                remaining = deadline - time.monotonic() if deadline is not None else ADMISSION_POLL
+                if remaining <= 0 or ticket.stopped():
+                    queue = self._queues.get(session)
+                    if queue is not None and ticket in queue:
+                        queue.remove(ticket)
+                        if not queue:
+                            del self._queues[session]
+                    self._dispatch()
+                    return None
+                self._cond.wait(min(remaining, ADMISSION_POLL))
+                if not ticket.admitted:
+                    self._dispatch()
+        return ticket
+
+    def cancel_all(self):
+        """Kill every running job's process tree and drop every waiting job, e.g. on Ctrl-C. REPL workers are left alone."""
+        self._cancel(lambda ticket: not ticket.resident)
+
+    def cancel(self, handle: threading.Event):
+        """
+        Set `handle` and cancel the jobs run with it: waiting ones never start,
+        running ones are killed. Jobs submitted with it later do not start either.
+        """
+        handle.set()
+        self._cancel(lambda ticket: ticket.handle is handle)
+
+    def _cancel(self, selected: Callable[[_Ticket], bool]):
+        with self._cond:
+            tickets = list(self._running) + [t for q in self._queues.values() for t in q]
+            for ticket in tickets:
+                if not selected(ticket):
+                    continue
+                ticket.cancelled = True
+                if ticket.pid:
+                    _kill_group(ticket.pid)
+            self._cond.notify_all()
+
+    def _finish(self, ticket: _Ticket, wait: float, peak_mb: float):
+        with self._cond:
+            self._running.remove(ticket)
+            if peak_mb > 0:
+                self._peaks.setdefault(ticket.kind, deque(maxlen=PEAK_HISTORY)).append(peak_mb)
+            kind = self._stats["kinds"].setdefault(ticket.kind, {"jobs": 0, "max_peak_rss_mb": 0.0, "total_wait": 0.0})
+            kind["jobs"] += 1
+            kind["max_peak_rss_mb"] = max(kind["max_peak_rss_mb"], peak_mb)
+            kind["total_wait"] += wait
+            self._stats["jobs"] += 1
+            self._stats["total_wait"] += wait
+            self._stats["max_wait"] = max(self._stats["max_wait"], wait)
+            self._dispatch(ticket)
+
+    def hold(self, kind: str, session: str = "", deadline: Optional[float] = None) -> Optional[_Ticket]:
+        """
+        Admit a long-lived process such as a REPL worker and return its ticket,
+        or None if `deadline` passes first. Give the ticket the process with
+        attach() and hand it back with release() once the process has exited.
+        """
+        start = time.monotonic()
+        ticket = self._admit(kind, session, deadline, None, resident=True)
+        if ticket is not None:
+            ticket.wait = time.monotonic() - start
+        return ticket
+
+    def release(self, ticket: _Ticket, peak_mb: float = 0.0):
+        self._finish(ticket, ticket.wait, peak_mb)
+
+    def run(
+        self,
+        kind: str,
+        command: List[str],
+        session: str = "",
+        cwd: Optional[str] = None,
+        timeout: Optional[float] = None,
+        deadline: Optional[float] = None,
+        on_line: Optional[Callable[[str], None]] = None,
+        log_path: Optional[str] = None,
+        handle: Optional[threading.Event] = None,
+        env: Optional[Dict[str, str]] = None,
+        on_start: Optional[Callable[[], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Wait for admission, run `command` and return {"returncode", "stdout",
+        "stderr", "timed_out", "cancelled", "wait", "elapsed", "peak_rss_mb"}.
+        Output is streamed into bounded head/tail buffers; once stdout outgrows
+        them it is spilled in full to `log_path`. With `on_line`, stderr is
+        merged into stdout and every line is passed on as it arrives. The
+        process group is killed `timeout` seconds after it starts or at the
+        absolute time.monotonic() `deadline`, whichever is first; a job still
+        queued at the deadline never starts. cancel(`handle`) stops the job
+        wherever it is. `env` adds to the inherited environment; `on_start`
+        is called once the process is running, after any wait for admission. Raises FileNotFoundError like subprocess.run does.
+        """
+        start = time.monotonic()
+        skip = (deadline is not None and start >= deadline) or (handle is not None and handle.is_set())
+        ticket = None if skip else self._admit(kind, session, deadline, handle)
+        wait = time.monotonic() - start
+        if ticket is None:
+            timed_out = deadline is not None and time.monotonic() >= deadline
+            return {
+                "returncode": None, "stdout": "", "stderr": "", "timed_out": timed_out,
+                "cancelled": not timed_out, "wait": wait, "elapsed": 0.0, "peak_rss_mb": 0.0
+            }
+        if deadline is not None:
+            left = max(0.0, deadline - time.monotonic())
+            timeout = min(timeout, left) if timeout else left
+        peak_mb = 0.0
+        try:
+            result = self._execute(ticket, command, cwd, timeout, on_line, log_path, env, on_start)
+            peak_mb = result["peak_rss_mb"]
+        finally:
+            self._finish(ticket, wait, peak_mb)
+        result["wait"] = wait
+        get_current_span().set(queue_wait_s=round(wait, 3), peak_rss_mb=round(peak_mb, 1))
+        return result
+
+    def _execute(
+        self,
+        ticket: _Ticket,
+        command: List[str],
+        cwd: Optional[str],
+        timeout: Optional[float],
+        on_line: Optional[Callable[[str], None]],
+        log_path: Optional[str],
+        env: Optional[Dict[str, str]] = None,
+        on_start: Optional[Callable[[], None]] = None
+    ) -> Dict[str, Any]:
+        start = time.monotonic()
+        process = subprocess.Popen(
+            command, cwd=cwd, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if on_line else subprocess.PIPE,
+            text=True, errors="replace", start_new_session=True,
+            env={**os.environ, **env} if env else None
+        )
+        limit_resources(process.pid, self.job_memory_mb, self.job_cpu_seconds)
+        self.attach(ticket, process.pid)
+        if ticket.stopped():
+            _kill_group(process.pid)  # cancelled between admission and the spawn
+        if on_start:
+            on_start()
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            _kill_group(process.pid)
+
+        stdout = OutputBuffer(self.head_chars, self.tail_chars, log_path)
+        stderr = OutputBuffer(self.head_chars, self.tail_chars)
+        reader = None
+        if not on_line:
+            reader = threading.Thread(target=lambda: stderr.writelines(process.stderr), daemon=True)
+            reader.start()
+        timer = threading.Timer(timeout, kill) if timeout is not None else None
+        if timer:
+            timer.start()
+        returncode, peak_mb = None, 0.0
+        try:
+            for line in process.stdout:
+                stdout.write(line)
+                if on_line:
+                    on_line(line.rstrip("\n"))
+            if reader:
+                reader.join()
+            returncode, peak_mb = self._reap(process)
+        finally:
+            if timer:
+                timer.cancel()
+            if returncode is None:
+                # Interrupted (Ctrl-C in this thread): take the whole tree down before unwinding.
+                _kill_group(process.pid)
+                self._reap(process)
+            stdout.close()
+            process.stdout.close()
+            if process.stderr:
+                process.stderr.close()
+        return {
+            "returncode": returncode,
+            "stdout": stdout.text(),
+            "stderr": stderr.text(),
+            "timed_out": timed_out.is_set(),
+            "cancelled": ticket.cancelled,
+            "elapsed": time.monotonic() - start,
+            "peak_rss_mb": peak_mb
+        }
+
+    @staticmethod
+    def _reap(process: subprocess.Popen):
+        """Wait for the child with os.wait4 to get its peak RSS, which covers the children it reaped."""
+        if not hasattr(os, "wait4"):
+            return process.wait(), 0.0
+        while True:
+            try:
+                _, status, usage = os.wait4(process.pid, 0)
+                break
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                return process.wait(), 0.0
+        # Tell Popen the child is gone so it does not try to wait for it again.
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return process.returncode, usage.ru_maxrss / 1024
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            jobs = self._stats["jobs"]
+            return {
+                "running": len(self._running),
+                "queued": self._queue_depth(),
+                "max_queue_depth": self._stats["max_queue_depth"],
+                "jobs": jobs,
+                "mean_wait": self._stats["total_wait"] / jobs if jobs else 0.0,
+                "max_wait": self._stats["max_wait"],
+                "kinds": {
+                    kind: {
+                        "jobs": values["jobs"],
+                        "estimate_mb": round(self.estimate_mb(kind), 1),
+                        "max_peak_rss_mb": round(values["max_peak_rss_mb"], 1),
+                        "mean_wait": values["total_wait"] / values["jobs"]
+                    }
+                    for kind, values in self._stats["kinds"].items()
+                }
+            }
+
+
+def format_scheduler_stats(stats: Dict[str, Any]) -> str:
+    parts = [
+        f"{stats['jobs']} Lean jobs, queue depth max {stats['max_queue_depth']}, "
+        f"admission wait mean {stats['mean_wait']:.2f}s max {stats['max_wait']:.2f}s"
+    ]
+    for kind, values in sorted(stats["kinds"].items()):
+        parts.append(f"{kind}: {values['jobs']} jobs, peak RSS {values['max_peak_rss_mb']:.0f} MB")
+    return "; ".join(parts)
+
+
+_scheduler: Optional[JobScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> JobScheduler:
+    """The process-wide scheduler, created from the `lean` settings on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            lean_config = get_lean_config()
+            _scheduler = JobScheduler(
+                max_jobs=lean_config.get("max_jobs", 4),
+                reserve_mb=lean_config.get("memory_reserve_mb", 1024),
+                job_memory_mb=lean_config.get("job_memory_mb", 0),
+                job_cpu_seconds=lean_config.get("job_cpu_seconds", 0),
+                head_chars=lean_config.get("output_head_chars", 20000),
+                tail_chars=lean_config.get("output_tail_chars", 20000),
+                shared=SharedAdmission() if lean_config.get("shared_admission", True) else None
+            )
+        return _scheduler
@@ -1,6 +1,6 @@
-import os
 from typing import Dict, Any
 from .base import BaseTool
+from .index import get_search_index
 
 class SearchTool(BaseTool):
     @property
@@ -9,48 +9,47 @@ class SearchTool(BaseTool):
 
     @property
     def description(self) -> str:
-        return "Search for a string or keyword in all .lean files in the project."
+        return "Search .lean files in the project and its dependencies (including Mathlib). Results are ranked, declarations first."
 
     @property
     def usage(self) -> str:
         return """<TOOL name="project_search">
 {
-  "query": "theorem_name_or_keyword"
+  "query": "theorem_name_or_keyword",
+  "mode": "substring" | "prefix" | "regex" (optional, default substring),
+  "limit": 20 (optional)
 }
 </TOOL>"""
 
+    def is_read_only(self, args: Dict[str, Any]) -> bool:
+        return True
+
     def execute(self, args: Dict[str, Any]) -> str:
         query = args.get("query")
         if not query:
             return "Error: 'query' argument is required."
         
-        results = []
+        mode = args.get("mode", "substring")
+        if mode not in ("substring", "prefix", "regex"):
+            return "Error: Invalid mode. Use 'substring', 'prefix', or 'regex'."
+        
         try:
-            # Simple recursive search
-            for root, dirs, files in os.walk("."):
-                # Skip common ignore dirs
-                if ".git" in dirs: dirs.remove(".git")
-                if ".lake" in dirs: dirs.remove(".lake")
-                if "lake-packages" in dirs: dirs.remove("lake-packages")
-                
-                for file in files:
-                    if file.endswith(".lean"):
-                        path = os.path.join(root, file)
-                        try:
-                            with open(path, "r", encoding="utf-8") as f:
-                                lines = f.readlines()
-                                for i, line in enumerate(lines):
-                                    if query in line:
-                                        # Truncate line if too long
-                                        content = line.strip()[:100]
-                                        results.append(f"{path}:{i+1}: {content}")
-                        except Exception:
-                            continue # Skip unreadable files
+            index = get_search_index()
+            # Project files change during a session; dependencies only on `lake update`
+            # and are refreshed by `jiuzhao index`.
+            index.refresh(include_dependencies=False)
+            indexing = index.index_dependencies_in_background()
+            # Limit results to prevent context overflow
+            results = index.search(query, mode=mode, limit=min(int(args.get("limit", 20)), 50))
             
+            note = "\n(Dependency sources are still being indexed; results may be incomplete.)" if indexing else ""
             if not results:
-                return f"No results found for '{query}'."
+                return f"No results found for '{query}'.{note}"
             
-            # Limit results to prevent context overflow
-            return "Search Results:\n" + "\n".join(results[:20])
+            lines = []
+            for r in results:
+                # Truncate line if too long
+                lines.append(f"{r['path']}:{r['line']}: {r['text'][:100]}")
+            return "Search Results:\n" + "\n".join(lines) + note
         except Exception as e:
             return f"Search failed: {str(e)}"
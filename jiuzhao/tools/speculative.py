@@ -0,0 +1,91 @@
+import atexit
+import concurrent.futures
+import hashlib
+import os
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+
+def content_hash(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class SpeculativeChecker:
+    """
+    Starts checking a .lean file as soon as it is written, ahead of the
+    check_file that usually follows one model round trip later. Jobs are
+    keyed by path and content hash: check() consumes the result, finished or
+    in flight, when the file still holds that content and no explicit
+    `incremental` mode was asked for, and checks directly otherwise. Any
+    .lean write or build supersedes every older job, since the file may be
+    imported by the others; one still queued is cancelled, one already
+    running finishes unused (a REPL request cannot be interrupted). Results
+    are used at most once, so later checks go through the dependency-aware
+    compile cache.
+    """
+
+    def __init__(
+        self,
+        checker: Callable[[str, float, Optional[bool]], Tuple[int, str]],
+        timeout: float = 30,
+        workers: int = 1
+    ):
+        self.checker = checker
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="jiuzhao-speculate")
+        self._lock = threading.Lock()
+        # path -> (content hash, job)
+        self._jobs: Dict[str, Tuple[str, Future]] = {}
+        self.stats = {"started": 0, "cancelled": 0, "reused": 0, "missed": 0}
+        atexit.register(self.shutdown)
+
+    def submit(self, path: str, source: str):
+        """Start checking `path`, which has just been written with `source`."""
+        path = os.path.abspath(path)
+        digest = content_hash(source)
+        with self._lock:
+            previous = self._jobs.get(path)
+            if previous is not None and previous[0] == digest:
+                return  # rewritten unchanged; the job already covers it
+            self._drop()
+            try:
+                job = self._pool.submit(self.checker, path, self.timeout, None)
+            except RuntimeError:  # shutting down
+                self._jobs.pop(path, None)
+                return
+            self._jobs[path] = (digest, job)
+            self.stats["started"] += 1
+
+    def check(self, path: str, timeout: float, incremental: Optional[bool] = None) -> Tuple[int, str]:
+        """Same contract as compile_lean_file; answered by the speculative job when its content is current."""
+        with open(path, "r", encoding="utf-8") as f:
+            digest = content_hash(f.read())
+        with self._lock:
+            entry = self._jobs.pop(os.path.abspath(path), None)
+            job = entry[1] if entry is not None and entry[0] == digest and not entry[1].cancelled() else None
+            if incremental is not None:
+                job = None  # the speculative job ran in the default mode
+            self.stats["reused" if job is not None else "missed"] += 1
+        if job is None:
+            return self.checker(path, timeout, incremental)
+        try:
+            return job.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            raise subprocess.TimeoutExpired(["lean", path], timeout)
+
+    def invalidate(self):
+        """Drop every speculative result, e.g. after a build replaced the project's .olean files."""
+        with self._lock:
+            self._drop()
+
+    def _drop(self):
+        """Cancel and forget all jobs. Called with the lock held."""
+        for _, job in self._jobs.values():
+            if job.cancel():
+                self.stats["cancelled"] += 1
+        self._jobs.clear()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
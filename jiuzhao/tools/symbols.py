@@ -0,0 +1,412 @@
+import difflib
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from .base import BaseTool
+from .index import INDEX_DIR, walk_sources
+
+KINDS = ["theorem", "lemma", "def", "abbrev", "instance", "structure", "class", "inductive", "axiom", "opaque"]
+
+DECL_RE = re.compile(
+    r"^(?:@\[[^\]]*\]\s*)*"
+    r"(?:(?:private|protected|noncomputable|partial|unsafe|nonrec)\s+)*"
+    r"(theorem|lemma|def|abbrev|instance|structure|class|inductive|axiom|opaque)"
+    r"(?:\s+\([^)]*\))?\s+([^\s:({\[]+)(.*)$"
+)
+NAMESPACE_RE = re.compile(r"^namespace\s+(\S+)")
+SECTION_RE = re.compile(r"^(?:noncomputable\s+)?section\b")
+END_RE = re.compile(r"^end\b\s*(\S*)")
+# Where a signature stops: the body, a `where` block or the first match arm.
+SIG_END_RE = re.compile(r":=|\bwhere\b|^\s*\|")
+
+MAX_SIGNATURE_LINES = 12
+MAX_SIGNATURE_CHARS = 400
+MAX_DOC_CHARS = 400
+
+MAGIC = b"JZSYM\x00\x01\x00"
+# magic, record count, path count, digest, then offsets of records, short-name order, strings, paths
+HEADER = struct.Struct("<8sII32sQQQQ")
+# name_off, name_len, sig_off, sig_len, path_id, line, kind
+RECORD = struct.Struct("<IIIIIIB3x")
+INDEX_ENTRY = struct.Struct("<I")
+
+
+def short_key(name: bytes) -> bytes:
+    """
+    Sort key of the short-name order: the last name component, ASCII-lowercased.
+    Queries go through the same function, so non-ASCII names compare as stored.
+    """
+    return name.rsplit(b".", 1)[-1].lower()
+
+
+def _clean_doc(lines: List[str]) -> str:
+    text = " ".join(lines).strip()
+    text = text[3:] if text.startswith("/--") else text
+    text = text[:-2] if text.endswith("-/") else text
+    return " ".join(text.split())[:MAX_DOC_CHARS]
+
+
+def extract_declarations(text: str) -> Iterable[Tuple[str, str, str, int, str]]:
+    """
+    Yield (full_name, kind, signature, line, docstring) for each top-level
+    declaration in a Lean source. The docstring is "" when there is none.
+    """
+    lines = text.split("\n")
+    scopes: List[Optional[str]] = []
+    depth = 0
+    doc_lines: Optional[List[str]] = None
+    pending_doc = ""
+    for i, line in enumerate(lines):
+        in_comment = depth > 0
+        depth = max(0, depth + line.count("/-") - line.count("-/"))
+        if doc_lines is not None:
+            doc_lines.append(line)
+            if depth == 0:
+                pending_doc, doc_lines = _clean_doc(doc_lines), None
+            continue
+        if not in_comment and line.startswith("/--"):
+            if depth == 0:
+                pending_doc = _clean_doc([line])
+            else:
+                doc_lines = [line]
+            continue
+        if in_comment or not line or line[0].isspace():
+            continue
+
+        m = NAMESPACE_RE.match(line)
+        if m:
+            scopes.extend(m.group(1).split("."))
+            pending_doc = ""
+            continue
+        if SECTION_RE.match(line):
+            scopes.append(None)
+            pending_doc = ""
+            continue
+        m = END_RE.match(line)
+        if m:
+            closing = m.group(1).split(".") if m.group(1) else [None]
+            for _ in closing:
+                if scopes:
+                    scopes.pop()
+            pending_doc = ""
+            continue
+
+        m = DECL_RE.match(line)
+        if not m:
+            if not line.startswith("@["):
+                pending_doc = ""
+            continue
+        doc, pending_doc = pending_doc, ""
+        kind, name, rest = m.group(1), m.group(2), m.group(3)
+        if kind == "instance" and (name.startswith(":") or name == "where"):
+            continue
+        if name.startswith("_root_."):
+            full_name = name[len("_root_."):]
+        else:
+            full_name = ".".join([s for s in scopes if s] + [name])
+
+        sig_parts = []
+        current = rest
+        for j in range(i, min(i + MAX_SIGNATURE_LINES, len(lines))):
+            if j > i:
+                current = lines[j]
+            end = SIG_END_RE.search(current)
+            if end:
+                sig_parts.append(current[:end.start()])
+                break
+            sig_parts.append(current)
+        signature = " ".join(" ".join(sig_parts).split())[:MAX_SIGNATURE_CHARS]
+        yield full_name, kind, signature, i + 1, doc
+
+
+def sources_digest(root: str, include_project: bool, include_dependencies: bool) -> bytes:
+    """Fingerprint of the (path, mtime, size) of the sources a table is built from."""
+    digest = hashlib.sha256()
+    for path, _ in sorted(walk_sources(root, include_project, include_dependencies)):
+        try:
+            st = os.stat(os.path.join(root, path))
+        except OSError:
+            continue
+        digest.update(f"{path}\x00{st.st_mtime}\x00{st.st_size}\n".encode("utf-8"))
+    return digest.digest()
+
+
+def build_symbol_table(
+    root: str,
+    out_path: Path,
+    include_project: bool,
+    include_dependencies: bool
+) -> int:
+    """Extract declarations and write them as a memory-mappable table. Returns the symbol count."""
+    digest = sources_digest(root, include_project, include_dependencies)
+    paths: List[str] = []
+    entries: List[Tuple[bytes, bytes, int, int, int]] = []
+    for path, _ in walk_sources(root, include_project, include_dependencies):
+        try:
+            with open(os.path.join(root, path), "r", encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+        path_id = len(paths)
+        paths.append(path)
+        for name, kind, signature, line, _ in extract_declarations(text):
+            entries.append((name.encode("utf-8"), signature.encode("utf-8"), path_id, line, KINDS.index(kind)))
+
+    entries.sort(key=lambda e: e[0])
+    strings = bytearray()
+    records = bytearray()
+    for name, signature, path_id, line, kind in entries:
+        name_off = len(strings)
+        strings += name
+        sig_off = len(strings)
+        strings += signature
+        records += RECORD.pack(name_off, len(name), sig_off, len(signature), path_id, line, kind)
+
+    by_short = sorted(range(len(entries)), key=lambda k: short_key(entries[k][0]))
+    short_index = b"".join(INDEX_ENTRY.pack(k) for k in by_short)
+    paths_blob = "\n".join(paths).encode("utf-8")
+
+    records_off = HEADER.size
+    short_off = records_off + len(records)
+    strings_off = short_off + len(short_index)
+    paths_off = strings_off + len(strings)
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries), len(paths), digest, records_off, short_off, strings_off, paths_off))
+        f.write(records)
+        f.write(short_index)
+        f.write(strings)
+        f.write(paths_blob)
+    os.replace(tmp, out_path)
+    return len(entries)
+
+
+class SymbolTable:
+    """
+    Read-only view of a symbol table file through mmap.
+
+    Records are fixed-size and sorted by full name, so exact and prefix lookups
+    are binary searches over the mapped bytes; only matched records are decoded
+    into Python objects.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.count, path_count, self.digest,
+         self._records_off, self._short_off, self._strings_off, self._paths_off) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a symbol table")
+        self.paths = self._mm[self._paths_off:].decode("utf-8").split("\n") if path_count else []
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def _record(self, k: int) -> Tuple[int, int, int, int, int, int, int]:
+        return RECORD.unpack_from(self._mm, self._records_off + k * RECORD.size)
+
+    def _name(self, k: int) -> bytes:
+        name_off, name_len = self._record(k)[:2]
+        start = self._strings_off + name_off
+        return self._mm[start:start + name_len]
+
+    def _short_key(self, pos: int) -> bytes:
+        (k,) = INDEX_ENTRY.unpack_from(self._mm, self._short_off + pos * INDEX_ENTRY.size)
+        return short_key(self._name(k))
+
+    def _short_record(self, pos: int) -> int:
+        return INDEX_ENTRY.unpack_from(self._mm, self._short_off + pos * INDEX_ENTRY.size)[0]
+
+    def entry(self, k: int) -> Dict[str, Any]:
+        name_off, name_len, sig_off, sig_len, path_id, line, kind = self._record(k)
+        name = self._mm[self._strings_off + name_off:self._strings_off + name_off + name_len].decode("utf-8")
+        signature = self._mm[self._strings_off + sig_off:self._strings_off + sig_off + sig_len].decode("utf-8")
+        namespace = name.rsplit(".", 1)[0] if "." in name else ""
+        return {
+            "name": name,
+            "kind": KINDS[kind],
+            "namespace": namespace,
+            "signature": signature,
+            "path": self.paths[path_id],
+            "line": line
+        }
+
+    def _bisect(self, key: bytes, get, count: int) -> int:
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if get(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def exact(self, name: str) -> List[int]:
+        key = name.encode("utf-8")
+        k = self._bisect(key, self._name, self.count)
+        if k < self.count and self._name(k) == key:
+            return [k]
+        # Fall back to declarations whose last component is `name` (e.g. `add_comm` -> `Nat.add_comm`).
+        short = short_key(key)
+        pos = self._bisect(short, self._short_key, self.count)
+        found = []
+        while pos < self.count and self._short_key(pos) == short:
+            k = self._short_record(pos)
+            if self._name(k).endswith(b"." + key) or self._name(k) == key:
+                found.append(k)
+            pos += 1
+        return found
+
+    def prefix(self, prefix: str, limit: int) -> List[int]:
+        key = prefix.encode("utf-8")
+        k = self._bisect(key, self._name, self.count)
+        found = []
+        while k < self.count and len(found) < limit and self._name(k).startswith(key):
+            found.append(k)
+            k += 1
+        return found
+
+    def fuzzy(self, query: str, limit: int, max_candidates: int = 5000) -> List[Tuple[float, int]]:
+        """Rank declarations whose short name shares a leading stem with the query's short name."""
+        short = short_key(query.encode("utf-8"))
+        stem = short[:2]
+        pos = self._bisect(stem, self._short_key, self.count)
+        scored = []
+        matcher = difflib.SequenceMatcher(b=short.decode("utf-8", errors="replace"))
+        for _ in range(max_candidates):
+            if pos >= self.count:
+                break
+            cand = self._short_key(pos)
+            if not cand.startswith(stem):
+                break
+            matcher.set_seq1(cand.decode("utf-8", errors="replace"))
+            if matcher.real_quick_ratio() >= 0.5 and matcher.quick_ratio() >= 0.5:
+                scored.append((matcher.ratio(), self._short_record(pos)))
+            pos += 1
+        scored.sort(key=lambda s: -s[0])
+        return scored[:limit]
+
+
+def symbol_table_paths(root: str = ".") -> Tuple[Path, Path]:
+    digest = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:16]
+    return INDEX_DIR / f"{digest}.project.sym", INDEX_DIR / f"{digest}.deps.sym"
+
+
+def build_symbol_tables(root: str = ".") -> Tuple[int, int]:
+    """Rebuild both the project and the dependency symbol tables."""
+    project_path, deps_path = symbol_table_paths(root)
+    return (
+        build_symbol_table(root, project_path, include_project=True, include_dependencies=False),
+        build_symbol_table(root, deps_path, include_project=False, include_dependencies=True)
+    )
+
+
+_tables: Dict[str, SymbolTable] = {}
+_tables_lock = threading.Lock()
+
+
+def _stored_digest(path: Path) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        return HEADER.unpack(header)[3]
+    except (OSError, struct.error):
+        return None
+
+
+def _open_table(path: Path, root: str, include_project: bool, include_dependencies: bool, check: bool) -> SymbolTable:
+    table = _tables.get(str(path))
+    if check:
+        digest = sources_digest(root, include_project, include_dependencies)
+        if table is not None and table.digest == digest:
+            return table
+        if _stored_digest(path) != digest:
+            build_symbol_table(root, path, include_project, include_dependencies)
+    elif table is not None:
+        return table
+    elif not path.exists():
+        build_symbol_table(root, path, include_project, include_dependencies)
+
+    # The replaced table is not closed: symbol_lookup runs concurrently with
+    # other read-only tools, and a reader may still hold it. Its mmap is
+    # released once the last reference goes away.
+    table = SymbolTable(path)
+    _tables[str(path)] = table
+    return table
+
+
+def get_symbol_tables(root: str = ".") -> List[SymbolTable]:
+    """
+    Return the (project, dependencies) tables, building missing ones.
+    The project table is rebuilt whenever a project source changes; the
+    dependency table only when it is missing (refresh it with `jiuzhao index`).
+    """
+    project_path, deps_path = symbol_table_paths(root)
+    with _tables_lock:
+        return [
+            _open_table(project_path, root, True, False, check=True),
+            _open_table(deps_path, root, False, True, check=False)
+        ]
+
+
+class SymbolTool(BaseTool):
+    @property
+    def name(self) -> str:
+        return "symbol_lookup"
+
+    @property
+    def description(self) -> str:
+        return "Look up declarations (theorems, lemmas, defs, ...) by name in the project and Mathlib. Returns kind, signature and location. Use it to check that a lemma name exists before using it."
+
+    @property
+    def usage(self) -> str:
+        return """<TOOL name="symbol_lookup">
+{
+  "name": "Nat.add_comm",
+  "mode": "exact" | "prefix" | "fuzzy" (optional, default exact),
+  "limit": 10 (optional)
+}
+</TOOL>"""
+
+    def is_read_only(self, args: Dict[str, Any]) -> bool:
+        return True
+
+    def execute(self, args: Dict[str, Any]) -> str:
+        name = args.get("name")
+        if not name:
+            return "Error: 'name' argument is required."
+        mode = args.get("mode", "exact")
+        if mode not in ("exact", "prefix", "fuzzy"):
+            return "Error: Invalid mode. Use 'exact', 'prefix', or 'fuzzy'."
+        limit = min(int(args.get("limit", 10)), 50)
+
+        try:
+            tables = get_symbol_tables()
+            entries = []
+            if mode == "fuzzy":
+                scored = [(score, table, k) for table in tables for score, k in table.fuzzy(name, limit)]
+                scored.sort(key=lambda s: -s[0])
+                entries = [table.entry(k) for _, table, k in scored[:limit]]
+            else:
+                for table in tables:
+                    ids = table.exact(name) if mode == "exact" else table.prefix(name, limit)
+                    entries.extend(table.entry(k) for k in ids)
+                entries = entries[:limit]
+        except Exception as e:
+            return f"Symbol lookup failed: {str(e)}"
+
+        if not entries:
+            hint = " Try mode 'fuzzy'." if mode != "fuzzy" else ""
+            return f"No declarations found for '{name}'.{hint}"
+
+        lines = [f"{e['kind']} {e['name']} {e['signature']}  -- {e['path']}:{e['line']}" for e in entries]
+        return "Declarations:\n" + "\n".join(lines)
@@ -0,0 +1,189 @@
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class _NullSpan:
+    """Returned by span() while tracing is off; every operation is a no-op."""
+
+    enabled = False
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs: Any):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    enabled = True
+
+    __slots__ = ("tracer", "name", "cat", "args", "id", "parent", "tid", "start", "_cpu", "_children")
+
+    def __init__(self, tracer: "Tracer", name: str, cat: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.id = 0
+        self.parent = 0
+        self.tid = 0
+        self.start = 0
+        self._cpu = 0.0
+        self._children = None
+
+    def set(self, **attrs: Any):
+        self.args.update(attrs)
+
+    def __enter__(self) -> "Span":
+        stack = self.tracer._stack()
+        self.id = next(self.tracer._ids)
+        self.parent = stack[-1].id if stack else 0
+        self.tid = threading.get_ident()
+        stack.append(self)
+        self._cpu = time.thread_time()
+        if self.cat == "tool" and resource is not None:
+            self._children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        self.args["cpu_s"] = round(time.thread_time() - self._cpu, 6)
+        if self._children is not None:
+            # Covers subprocesses reaped during the span (`lean`, `lake build`).
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            self.args["child_cpu_s"] = round(
+                after.ru_utime + after.ru_stime - self._children.ru_utime - self._children.ru_stime, 6
+            )
+            # ru_maxrss of RUSAGE_CHILDREN is a lifetime maximum, not a value for
+            # this span; the job scheduler sets each job's own peak_rss_mb.
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        stack = self.tracer._stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self.tracer._finish(self, end)
+        return False
+
+
+class Tracer:
+    """
+    Collects finished spans in memory. Spans nest per thread; each records its
+    wall time, the calling thread's CPU time and free-form attributes.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self.events: List[Dict[str, Any]] = []
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _finish(self, span: Span, end: int):
+        event = {
+            "id": span.id,
+            "parent": span.parent,
+            "name": span.name,
+            "cat": span.cat,
+            "ts_us": (span.start - self.origin) / 1000,
+            "dur_us": (end - span.start) / 1000,
+            "tid": span.tid,
+            "args": span.args
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def export_jsonl(self, path: str):
+        with self._lock:
+            events = sorted(self.events, key=lambda e: e["ts_us"])
+        with open(path, "w", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+
+    def export_chrome(self, path: str):
+        """Write the Chrome `trace_event` format (chrome://tracing, Perfetto, speedscope)."""
+        with self._lock:
+            events = list(self.events)
+        trace_events = [{
+            "name": e["name"],
+            "cat": e["cat"],
+            "ph": "X",
+            "ts": e["ts_us"],
+            "dur": e["dur_us"],
+            "pid": self.pid,
+            "tid": e["tid"],
+            "args": e["args"]
+        } for e in events]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
+
+    def export(self, path: str):
+        """JSONL for `.jsonl` paths, Chrome trace JSON otherwise."""
+        if path.endswith(".jsonl"):
+            self.export_jsonl(path)
+        else:
+            self.export_chrome(path)
+
+
+_tracer: Optional[Tracer] = None
+
+
+def enable_tracing() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def disable_tracing():
+    global _tracer
+    _tracer = None
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def tracing_enabled() -> bool:
+    return _tracer is not None
+
+
+def get_current_span():
+    """The innermost open span of the calling thread, or the null span."""
+    if _tracer is None:
+        return NULL_SPAN
+    stack = _tracer._stack()
+    return stack[-1] if stack else NULL_SPAN
+
+
+def span(name: str, cat: str = "agent", **args: Any):
+    """
+    Open a span: `with span("llm.chat", "llm", model=m) as s: ...; s.set(tokens_out=n)`.
+    Costs one global lookup when tracing is disabled; callers should guard
+    expensive attribute computation with `s.enabled`.
+    """
+    if _tracer is None:
+        return NULL_SPAN
+    return Span(_tracer, name, cat, args)
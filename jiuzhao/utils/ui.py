@@ -1,8 +1,9 @@
 from rich.console import Console
 from rich.panel import Panel
-from rich.markdown import Markdown
 from rich.theme import Theme
 from rich.align import Align
+from rich.live import Live
+import time
 
 custom_theme = Theme({
     "info": "dim cyan",
@@ -30,14 +31,54 @@ def print_header():
     ))
     console.print()
 
+def _markdown(content: str):
+    # rich.markdown pulls in markdown-it; import it on the first agent message, not at startup.
+    from rich.markdown import Markdown
+    return Markdown(content)
+
 def print_agent_msg(content: str):
     console.print(Panel(
-        Markdown(content),
+        _markdown(content),
         title="🤖 Agent",
         border_style="green",
         title_align="left"
     ))
 
+class StreamingAgentMsg:
+    """Live-updating agent panel for streamed responses; renders like print_agent_msg."""
+
+    # Re-parsing Markdown on every token is wasteful; redraw at most this often.
+    MIN_INTERVAL = 0.05
+
+    def __init__(self):
+        self._live = Live(self._render(""), console=console, refresh_per_second=12, transient=False)
+        self._last = 0.0
+        self._text = ""
+
+    @staticmethod
+    def _render(content: str):
+        return Panel(
+            _markdown(content) if content else "[dim]...[/dim]",
+            title="🤖 Agent",
+            border_style="green",
+            title_align="left"
+        )
+
+    def __enter__(self):
+        self._live.__enter__()
+        return self
+
+    def update(self, content: str):
+        self._text = content
+        now = time.monotonic()
+        if now - self._last >= self.MIN_INTERVAL:
+            self._last = now
+            self._live.update(self._render(content))
+
+    def __exit__(self, *exc):
+        self._live.update(self._render(self._text))
+        return self._live.__exit__(*exc)
+
 def print_tool_use(tool_name: str, args: str):
     console.print(f"[dim]🔨 Tool Call: [bold]{tool_name}[/bold][/dim]")
     # Truncate args if they are too long (e.g. file content)